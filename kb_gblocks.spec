@@ -34,6 +34,7 @@ module kb_gblocks {
 	int            max_pos_contig_nonconserved;  /* 8=default */
 	int            min_block_len;                /* 10=default */
 	int            remove_mask_positions_flag;   /* 0=false,1=true default=0 */
+	string         engine;                       /* "binary"=Gblocks executable (default), "native"=in-process engine */
     } Gblocks_Params;
 
 
@@ -52,4 +53,129 @@ module kb_gblocks {
     **        output_type: MSA
     */
     funcdef run_Gblocks (Gblocks_Params params)  returns (Gblocks_Output) authentication required;
+
+
+    /* Gblocks Sweep Input Params
+    **
+    ** Every combination of trim_levels x min_block_lens x max_pos_contig_nonconserveds is evaluated with the native engine.
+    ** Settings are numbered in that order (the order of the returned settings list),
+    ** and save_setting_indices picks which of them are saved as MSA objects named <output_name>.<index>
+    */
+    typedef structure {
+        workspace_name workspace_name;
+	string         desc;
+	data_obj_ref   input_ref;
+        data_obj_name  output_name;
+	list<int>      trim_levels;                    /* default [0] */
+	list<int>      min_block_lens;                 /* default [0] (0=Gblocks default of 10) */
+	list<int>      max_pos_contig_nonconserveds;   /* default [8] */
+	int            min_seqs_for_conserved;         /* 0=use MSA-depth-derived default */
+	int            min_seqs_for_flank;             /* 0=use MSA-depth-derived default */
+	list<int>      save_setting_indices;           /* default [] */
+    } Gblocks_Sweep_Params;
+
+
+    /* Gblocks Sweep result for one setting
+    */
+    typedef structure {
+	int            index;
+	int            trim_level;
+	int            min_block_len;
+	int            max_pos_contig_nonconserved;
+	int            retained_len;
+	int            block_count;
+	float          gap_fraction;
+	data_obj_ref   output_ref;                     /* only for saved settings */
+    } Gblocks_Sweep_Setting;
+
+
+    /* Gblocks Sweep Output
+    */
+    typedef structure {
+	data_obj_name  report_name;
+	data_obj_ref   report_ref;
+	list<Gblocks_Sweep_Setting> settings;
+    } Gblocks_Sweep_Output;
+
+
+    /*  Method for evaluating a grid of Gblocks settings on one MSA
+    **
+    **        input_type: MSA
+    **        output_type: MSA (for each setting in save_setting_indices)
+    */
+    funcdef run_Gblocks_sweep (Gblocks_Sweep_Params params)  returns (Gblocks_Sweep_Output) authentication required;
+
+
+    /* Gblocks Batch Input Params
+    **
+    ** MSAs are taken from input_refs and/or the items of input_set_ref.
+    ** Each output MSA is named <input MSA name><output_suffix>
+    */
+    typedef structure {
+        workspace_name workspace_name;
+	string         desc;
+	list<data_obj_ref> input_refs;
+	data_obj_ref   input_set_ref;
+	string         output_suffix;                /* default ".Gblocks" */
+	int            trim_level;                   /* 0=no gaps allowed, 1=half gaps allowed, 2=all gaps allowed */
+	int            min_seqs_for_conserved;       /* 0=use MSA-depth-derived default */
+	int            min_seqs_for_flank;           /* 0=use MSA-depth-derived default */
+	int            max_pos_contig_nonconserved;  /* 8=default */
+	int            min_block_len;                /* 10=default */
+	string         engine;                       /* "binary"=Gblocks executable (default), "native"=in-process engine */
+	int            max_workers;                  /* 0=number of CPUs */
+    } Gblocks_Batch_Params;
+
+
+    /* Gblocks Batch Output
+    */
+    typedef structure {
+	data_obj_name  report_name;
+	data_obj_ref   report_ref;
+	list<data_obj_ref> output_refs;
+    } Gblocks_Batch_Output;
+
+
+    /*  Method for trimming many MSAs with the same Gblocks settings in one job
+    **
+    **        input_type: list of MSA, or a set of MSA
+    **        output_type: MSA (one per input)
+    */
+    funcdef run_Gblocks_batch (Gblocks_Batch_Params params)  returns (Gblocks_Batch_Output) authentication required;
+
+
+    /* Gblocks Preview Input Params
+    **
+    ** The Gblocks_Params settings, evaluated with the native engine.
+    */
+    typedef structure {
+	data_obj_ref   input_ref;
+	int            trim_level;                   /* 0=no gaps allowed, 1=half gaps allowed, 2=all gaps allowed */
+	int            min_seqs_for_conserved;       /* 0=use MSA-depth-derived default */
+	int            min_seqs_for_flank;           /* 0=use MSA-depth-derived default */
+	int            max_pos_contig_nonconserved;  /* 8=default */
+	int            min_block_len;                /* 10=default */
+    } Gblocks_Preview_Params;
+
+
+    /* Gblocks Preview Output
+    **
+    ** blocks are the [start, end) columns of each block, 0-based.
+    ** kept has one character per input MSA column: "1" kept, "0" dropped.
+    */
+    typedef structure {
+	list<tuple<int start, int end>> blocks;
+	int            alignment_length;
+	int            retained_len;
+	float          retained_fraction;
+	string         kept;
+    } Gblocks_Preview_Output;
+
+
+    /*  Method for previewing the blocks Gblocks settings keep, without saving anything
+    **
+    **        input_type: MSA
+    **        output_type: none
+    */
+    funcdef preview_Gblocks (Gblocks_Preview_Params params)  returns (Gblocks_Preview_Output) authentication required;
 };
@@ -12,7 +12,12 @@ import requests as _requests
 import random as _random
 import os as _os
 import traceback as _traceback
+import threading as _threading
+import zlib as _zlib
+from requests.adapters import HTTPAdapter as _HTTPAdapter
 from requests.exceptions import ConnectionError
+from urllib3.connectionpool import HTTPConnectionPool as _HTTPConnectionPool
+from urllib3.connectionpool import HTTPSConnectionPool as _HTTPSConnectionPool
 from urllib3.exceptions import ProtocolError
 
 try:
@@ -30,6 +35,11 @@ _CT = 'content-type'
 _AJ = 'application/json'
 _URL_SCHEME = frozenset(['http', 'https'])
 _CHECK_JOB_RETRYS = 3
+_POOL_SIZE_ENV = 'KB_CLIENT_HTTP_POOL_SIZE'
+_DEFAULT_POOL_SIZE = 10
+_COMPRESS_METHODS_ENV = 'KB_CLIENT_COMPRESS_METHODS'
+_GZIP_CHUNK = 1 << 16
+_JSONRPC_PARSE_ERROR = -32700
 
 
 def _get_token(user_id, password, auth_svc):
@@ -97,6 +107,393 @@ class _JSONObjectEncoder(_json.JSONEncoder):
         return _json.JSONEncoder.default(self, obj)
 
 
+class _CountingHTTPConnectionPool(_HTTPConnectionPool):
+
+    def _new_conn(self):
+        _session_pool.count('connections_opened')
+        return super(_CountingHTTPConnectionPool, self)._new_conn()
+
+
+class _CountingHTTPSConnectionPool(_HTTPSConnectionPool):
+
+    def _new_conn(self):
+        _session_pool.count('connections_opened')
+        _session_pool.count('tls_handshakes')
+        return super(_CountingHTTPSConnectionPool, self)._new_conn()
+
+
+class _SessionPool(object):
+    '''
+    Keep-alive HTTP connections shared by every client in the process.
+    requests.Session isn't thread safe, so each thread gets its own session,
+    but all sessions are mounted on one (thread safe) urllib3 connection pool
+    of up to pool_size connections per host.
+    '''
+    def __init__(self, pool_size):
+        self._lock = _threading.Lock()
+        self._local = _threading.local()
+        self._generation = 0
+        self.counters = {'requests': 0,
+                         'connections_opened': 0,
+                         'tls_handshakes': 0,
+                         'bytes_sent': 0,
+                         'bytes_received': 0}
+        self.configure(pool_size)
+
+    def configure(self, pool_size):
+        pool_size = int(pool_size)
+        if pool_size < 1:
+            raise ValueError('HTTP connection pool size must be at least 1')
+        adapter = _HTTPAdapter(pool_connections=pool_size,
+                               pool_maxsize=pool_size)
+        adapter.poolmanager.pool_classes_by_scheme = {
+            'http': _CountingHTTPConnectionPool,
+            'https': _CountingHTTPSConnectionPool}
+        with self._lock:
+            self.pool_size = pool_size
+            self._adapter = adapter
+            # threads remount their sessions on the new adapter
+            self._generation += 1
+
+    def session(self):
+        local = self._local
+        if getattr(local, 'generation', None) != self._generation:
+            session = _requests.Session()
+            session.mount('http://', self._adapter)
+            session.mount('https://', self._adapter)
+            local.session = session
+            local.generation = self._generation
+        return local.session
+
+    def count(self, counter, n=1):
+        with self._lock:
+            self.counters[counter] += n
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+        stats['pool_size'] = self.pool_size
+        stats['connections_reused'] = max(
+            stats['requests'] - stats['connections_opened'], 0)
+        return stats
+
+
+_session_pool = _SessionPool(
+    _os.environ.get(_POOL_SIZE_ENV, _DEFAULT_POOL_SIZE))
+
+
+def configure_session_pool(pool_size):
+    '''
+    Set the number of keep-alive connections per host shared by all clients
+    in this process (default 10, or $KB_CLIENT_HTTP_POOL_SIZE).
+    '''
+    _session_pool.configure(pool_size)
+
+
+def session_pool_stats():
+    '''
+    Counters for the shared HTTP connection pool: requests sent, connections
+    opened (each one a TCP handshake), TLS handshakes, connections reused and
+    request/response body bytes.
+    '''
+    return _session_pool.stats()
+
+
+class AdaptivePollStrategy(object):
+    '''
+    Schedules _check_job polls for callback jobs.
+
+    Durations of recent completions are kept per service method.  Once a
+    method has history, its predicted finish window runs from 0.9 x the
+    10th to 1.1 x the 90th percentile duration.  Polling skips ahead to the
+    window, polls at the base interval inside it, and backs off
+    geometrically once the job is overdue.  Without history the client's
+    geometric schedule is used.  Either way no interval is longer than
+    max(latency_floor_s, latency_fraction x time waited so far), which
+    bounds the latency a poll can add to a job.
+
+    The latency each completion actually incurred (time since the last
+    unfinished poll, an upper bound) is kept as a histogram per method.
+    '''
+    LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60, 300]
+
+    def __init__(self, latency_floor_s=0.5, latency_fraction=0.05,
+                 history_len=20):
+        self.latency_floor = latency_floor_s
+        self.latency_fraction = latency_fraction
+        self.history_len = history_len
+        self._lock = _threading.Lock()
+        self._durations = dict()
+        self._latency_hist = dict()
+
+    def predict(self, service_method):
+        '''
+        (start, end) of the window recent jobs of service_method finished
+        in, in seconds after submission, or None with no history
+        '''
+        with self._lock:
+            durations = sorted(self._durations.get(service_method, []))
+        if not durations:
+            return None
+        lo = durations[int(0.1 * (len(durations) - 1))]
+        hi = durations[int(round(0.9 * (len(durations) - 1)))]
+        return (0.9 * lo, 1.1 * hi)
+
+    def next_delay(self, client, service_method, elapsed, last_delay):
+        '''
+        Seconds to wait before the next poll of a job that has been running
+        for elapsed seconds, given the previous delay (None for the first)
+        '''
+        base = client.async_job_check_time
+        bound = min(client.async_job_check_max_time,
+                    max(self.latency_floor, self.latency_fraction * elapsed))
+        bound = max(bound, base)
+        window = self.predict(service_method)
+        if window is not None:
+            (window_start, window_end) = window
+            if elapsed < window_start - base:
+                return min(window_start - elapsed, bound)
+            if elapsed <= window_end:
+                return base
+            # overdue: back off geometrically, starting from the base interval
+            if last_delay is None or elapsed - last_delay <= window_end:
+                return min(base, bound)
+        if last_delay is None:
+            return min(base, bound)
+        return min(last_delay * client.async_job_check_time_scale_percent /
+                   100.0, bound)
+
+    def record(self, service_method, duration, latency):
+        with self._lock:
+            durations = self._durations.setdefault(service_method, [])
+            durations.append(duration)
+            del durations[:-self.history_len]
+            hist = self._latency_hist.setdefault(
+                service_method, [0] * (len(self.LATENCY_BUCKETS) + 1))
+            bucket_i = 0
+            while (bucket_i < len(self.LATENCY_BUCKETS) and
+                   latency > self.LATENCY_BUCKETS[bucket_i]):
+                bucket_i += 1
+            hist[bucket_i] += 1
+
+    def stats(self):
+        '''
+        Per service method: completions seen, the predicted finish window
+        and the poll-induced latency histogram (bucket upper bound -> count)
+        '''
+        with self._lock:
+            methods = sorted(self._latency_hist.keys())
+            hists = dict([(m, list(self._latency_hist[m])) for m in methods])
+        stats = dict()
+        for service_method in methods:
+            labels = ['<=' + str(b) + 's' for b in self.LATENCY_BUCKETS]
+            labels.append('>' + str(self.LATENCY_BUCKETS[-1]) + 's')
+            stats[service_method] = {
+                'completions': sum(hists[service_method]),
+                'predicted_window_sec': self.predict(service_method),
+                'latency_histogram': dict(zip(labels, hists[service_method]))}
+        return stats
+
+
+_poll_strategy = AdaptivePollStrategy()
+
+
+def poll_strategy_stats():
+    '''
+    Learned durations and poll-latency histograms of the shared
+    callback-job poll strategy
+    '''
+    return _poll_strategy.stats()
+
+
+class _ResponseStream(object):
+    '''
+    File-like view of a streamed response body that counts the bytes read
+    '''
+    def __init__(self, response):
+        self._response = response
+        self._raw = response.raw
+        self._raw.decode_content = True
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            chunk = self._raw.read()
+        else:
+            chunk = self._raw.read(size)
+        _session_pool.count('bytes_received', len(chunk))
+        return chunk
+
+    def close(self):
+        self._response.close()
+
+
+def _gzip_chunks(text_chunks, level):
+    '''
+    gzip an iterable of str pieces (e.g. from JSONEncoder.iterencode),
+    yielding compressed chunks as it goes, so neither the whole text nor
+    the whole compressed body is ever held.  Counts bytes in and out.
+    '''
+    compressor = _zlib.compressobj(level, _zlib.DEFLATED, 16 + _zlib.MAX_WBITS)
+    pending = []
+    pending_len = 0
+    for text_chunk in text_chunks:
+        pending.append(text_chunk)
+        pending_len += len(text_chunk)
+        if pending_len < _GZIP_CHUNK:
+            continue
+        raw = ''.join(pending).encode('utf-8')
+        pending = []
+        pending_len = 0
+        _request_compression.count('bytes_before_compression', len(raw))
+        out = compressor.compress(raw)
+        if out:
+            _request_compression.count('bytes_after_compression', len(out))
+            _session_pool.count('bytes_sent', len(out))
+            yield out
+    raw = ''.join(pending).encode('utf-8')
+    _request_compression.count('bytes_before_compression', len(raw))
+    out = compressor.compress(raw) + compressor.flush()
+    _request_compression.count('bytes_after_compression', len(out))
+    _session_pool.count('bytes_sent', len(out))
+    yield out
+
+
+class _CompressionRefused(Exception):
+    pass
+
+
+class _RequestCompression(object):
+    '''
+    Which calls send gzip request bodies: the configured service methods,
+    except to urls that have refused one (HTTP 415, or a JSON-RPC parse
+    error from a server that read the gzip bytes as JSON).  Those calls are
+    resent uncompressed, and later calls to that url aren't compressed.
+    '''
+    def __init__(self, methods=None, level=6):
+        self._lock = _threading.Lock()
+        self._refusing_urls = set()
+        self.counters = {'requests_compressed': 0,
+                         'refusals': 0,
+                         'bytes_before_compression': 0,
+                         'bytes_after_compression': 0}
+        self.configure(methods, level)
+
+    def configure(self, methods, level=6):
+        with self._lock:
+            self.methods = frozenset(methods or [])
+            self.level = int(level)
+
+    def applies(self, service_method, url):
+        with self._lock:
+            return (service_method in self.methods and
+                    url not in self._refusing_urls)
+
+    def refuse(self, url):
+        with self._lock:
+            self._refusing_urls.add(url)
+            self.counters['refusals'] += 1
+
+    def count(self, counter, n=1):
+        with self._lock:
+            self.counters[counter] += n
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats['methods'] = sorted(self.methods)
+            stats['refusing_urls'] = sorted(self._refusing_urls)
+        return stats
+
+
+_request_compression = _RequestCompression(
+    [m for m in _os.environ.get(_COMPRESS_METHODS_ENV, '').split(',') if m])
+
+
+def configure_request_compression(methods, level=6):
+    '''
+    Send gzip request bodies, encoded as they are sent, for the given
+    service methods (e.g. ['Workspace.save_objects']) from all clients in
+    this process (default none, or the comma separated
+    $KB_CLIENT_COMPRESS_METHODS).  Servers that can't read them are detected
+    on the first call and sent plain bodies after that.
+    '''
+    _request_compression.configure(methods, level)
+
+
+def request_compression_stats():
+    '''
+    Counters for request compression: requests compressed, refusals and the
+    body bytes before and after compression
+    '''
+    return _request_compression.stats()
+
+
+class _ServiceURLCache(object):
+    '''
+    ServiceWizard lookups shared by all clients in the process, keyed by
+    (service wizard url, module, version).  Successful lookups are kept for
+    ttl seconds, failed ones (the exception) for negative_ttl seconds.
+    '''
+    def __init__(self, ttl=300, negative_ttl=30):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._lock = _threading.Lock()
+        self._entries = dict()
+        self.counters = {'hits': 0,
+                         'misses': 0,
+                         'negative_hits': 0,
+                         'invalidations': 0}
+
+    def get(self, key, lookup_fn):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                if entry[2] is not None:
+                    self.counters['negative_hits'] += 1
+                    raise entry[2]
+                self.counters['hits'] += 1
+                return entry[1]
+            self.counters['misses'] += 1
+        try:
+            url = lookup_fn()
+        except (ServerError, ConnectionError, ProtocolError) as e:
+            with self._lock:
+                self._entries[key] = (now + self.negative_ttl, None, e)
+            raise
+        with self._lock:
+            self._entries[key] = (now + self.ttl, url, None)
+        return url
+
+    def invalidate(self, key, url):
+        '''
+        Drop key if it still resolves to url (which just failed to connect)
+        '''
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] == url:
+                del self._entries[key]
+                self.counters['invalidations'] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats['entries'] = len(self._entries)
+        stats['ttl_sec'] = self.ttl
+        stats['negative_ttl_sec'] = self.negative_ttl
+        return stats
+
+
+_service_url_cache = _ServiceURLCache()
+
+
+def service_url_cache_stats():
+    '''
+    Hit/miss counters of the shared ServiceWizard URL cache
+    '''
+    return _service_url_cache.stats()
+
+
 class BaseClient(object):
     '''
     The KBase base client.
@@ -120,6 +517,8 @@ class BaseClient(object):
     lookup_url - set to true when contacting KBase dynamic services.
     async_job_check_time_ms - the wait time between checking job state for
         asynchronous jobs run with the run_job method.
+    poll_strategy - the AdaptivePollStrategy scheduling job state checks.
+        Default is one strategy shared by all clients in the process.
     '''
     def __init__(
             self, url=None, timeout=30 * 60, user_id=None,
@@ -129,7 +528,8 @@ class BaseClient(object):
             lookup_url=False,
             async_job_check_time_ms=100,
             async_job_check_time_scale_percent=150,
-            async_job_check_max_time_ms=300000):
+            async_job_check_max_time_ms=300000,
+            poll_strategy=None):
         if url is None:
             raise ValueError('A url is required')
         scheme, _, _, _, _, _ = _urlparse(url)
@@ -144,6 +544,7 @@ class BaseClient(object):
         self.async_job_check_time_scale_percent = (
             async_job_check_time_scale_percent)
         self.async_job_check_max_time = async_job_check_max_time_ms / 1000.0
+        self.poll_strategy = poll_strategy or _poll_strategy
         # token overrides user_id and password
         if token is not None:
             self._headers['AUTHORIZATION'] = token
@@ -164,7 +565,7 @@ class BaseClient(object):
         if self.timeout < 1:
             raise ValueError('Timeout value must be at least 1 second')
 
-    def _call(self, url, method, params, context=None):
+    def _rpc_hash(self, method, params, context=None):
         arg_hash = {'method': method,
                     'params': params,
                     'version': '1.1',
@@ -174,15 +575,44 @@ class BaseClient(object):
             if type(context) is not dict:
                 raise ValueError('context is not type dict as required.')
             arg_hash['context'] = context
+        return arg_hash
+
+    def _rpc_body(self, method, params, context=None):
+        return _json.dumps(self._rpc_hash(method, params, context),
+                           cls=_JSONObjectEncoder)
 
-        body = _json.dumps(arg_hash, cls=_JSONObjectEncoder)
-        ret = _requests.post(url, data=body, headers=self._headers,
-                             timeout=self.timeout,
-                             verify=not self.trust_all_ssl_certificates)
+    def _rpc_body_gzip(self, method, params, context=None):
+        _request_compression.count('requests_compressed')
+        return _gzip_chunks(
+            _JSONObjectEncoder().iterencode(
+                self._rpc_hash(method, params, context)),
+            _request_compression.level)
+
+    def _post(self, url, body, stream=False, gzip=False):
+        _session_pool.count('requests')
+        headers = self._headers
+        if gzip:
+            # a generator: sent chunked, and counts its own bytes
+            headers = dict(self._headers)
+            headers['Content-Encoding'] = 'gzip'
+            headers[_CT] = _AJ
+        else:
+            _session_pool.count('bytes_sent', len(body))
+        ret = _session_pool.session().post(
+            url, data=body, headers=headers, timeout=self.timeout,
+            verify=not self.trust_all_ssl_certificates, stream=stream)
         ret.encoding = 'utf-8'
+        if stream and ret.status_code == 200:
+            return ret
+        _session_pool.count('bytes_received', len(ret.content))
+        if gzip and ret.status_code == 415:
+            raise _CompressionRefused()
         if ret.status_code == 500:
             if ret.headers.get(_CT) == _AJ:
                 err = ret.json()
+                if gzip and err.get('error', {}).get('code') == \
+                        _JSONRPC_PARSE_ERROR:
+                    raise _CompressionRefused()
                 if 'error' in err:
                     raise ServerError(**err['error'])
                 else:
@@ -191,6 +621,19 @@ class BaseClient(object):
                 raise ServerError('Unknown', 0, ret.text)
         if not ret.ok:
             ret.raise_for_status()
+        return ret
+
+    def _call(self, url, method, params, context=None):
+        ret = None
+        if _request_compression.applies(method, url):
+            try:
+                ret = self._post(
+                    url, self._rpc_body_gzip(method, params, context),
+                    gzip=True)
+            except _CompressionRefused:
+                _request_compression.refuse(url)
+        if ret is None:
+            ret = self._post(url, self._rpc_body(method, params, context))
         resp = ret.json()
         if 'result' not in resp:
             raise ServerError('Unknown', 0, 'An unknown server error occurred')
@@ -200,14 +643,22 @@ class BaseClient(object):
             return resp['result'][0]
         return resp['result']
 
+    def _service_url_key(self, service_method, service_version):
+        service, _ = service_method.split('.')
+        return (self.url, service, service_version)
+
     def _get_service_url(self, service_method, service_version):
         if not self.lookup_url:
             return self.url
         service, _ = service_method.split('.')
-        service_status_ret = self._call(
-            self.url, 'ServiceWizard.get_service_status',
-            [{'module_name': service, 'version': service_version}])
-        return service_status_ret['url']
+
+        def lookup():
+            service_status_ret = self._call(
+                self.url, 'ServiceWizard.get_service_status',
+                [{'module_name': service, 'version': service_version}])
+            return service_status_ret['url']
+        return _service_url_cache.get(
+            self._service_url_key(service_method, service_version), lookup)
 
     def _set_up_context(self, service_ver=None, context=None):
         if service_ver:
@@ -237,33 +688,97 @@ class BaseClient(object):
             or dev/beta/release.
         context - the rpc context dict.
         '''
+        job = self.submit_job(service_method, args, service_ver, context)
+        return self.wait_all([job])[0]
+
+    def submit_job(self, service_method, args, service_ver=None,
+                   context=None):
+        '''
+        Submit a SDK method asynchronously and return without waiting.
+        Arguments are as for run_job.  Returns a job handle to pass to
+        wait_all.
+        '''
         mod, _ = service_method.split('.')
         job_id = self._submit_job(service_method, args, service_ver, context)
-        async_job_check_time = self.async_job_check_time
-        check_job_failures = 0
-        while check_job_failures < _CHECK_JOB_RETRYS:
-            time.sleep(async_job_check_time)
-            async_job_check_time = (async_job_check_time *
-                                    self.async_job_check_time_scale_percent /
-                                    100.0)
-            if async_job_check_time > self.async_job_check_max_time:
-                async_job_check_time = self.async_job_check_max_time
+        return {'client': self, 'service': mod, 'service_method': service_method,
+                'job_id': job_id, 'submit_time': time.time()}
 
-            try:
-                job_state = self._check_job(mod, job_id)
-            except (ConnectionError, ProtocolError):
-                _traceback.print_exc()
-                check_job_failures += 1
-                continue
-
-            if job_state['finished']:
-                if not job_state['result']:
-                    return
-                if len(job_state['result']) == 1:
-                    return job_state['result'][0]
-                return job_state['result']
-        raise RuntimeError("_check_job failed {} times and exceeded limit".format(
-            check_job_failures))
+    def wait_all(self, jobs):
+        '''
+        Wait for a group of jobs from submit_job, which may come from
+        different clients.  Each job is polled on its own schedule from the
+        poll strategy, and all of them are waited on together, so the wall
+        time is that of the slowest job rather than the sum.
+        Returns the job results in the order of jobs.
+        '''
+        results = [None] * len(jobs)
+        check_job_failures = [0] * len(jobs)
+        last_poll = [job['submit_time'] for job in jobs]
+        last_delay = [None] * len(jobs)
+        next_poll = [None] * len(jobs)
+        for job_i, job in enumerate(jobs):
+            last_delay[job_i] = self.poll_strategy.next_delay(
+                self, job['service_method'],
+                time.time() - job['submit_time'], None)
+            next_poll[job_i] = job['submit_time'] + last_delay[job_i]
+        pending = set(range(len(jobs)))
+        while pending:
+            wait = min([next_poll[job_i] for job_i in pending]) - time.time()
+            if wait > 0:
+                time.sleep(wait)
+
+            for job_i in sorted(pending):
+                if next_poll[job_i] > time.time():
+                    continue
+                job = jobs[job_i]
+                try:
+                    job_state = job['client']._check_job(job['service'],
+                                                         job['job_id'])
+                except (ConnectionError, ProtocolError):
+                    _traceback.print_exc()
+                    check_job_failures[job_i] += 1
+                    if check_job_failures[job_i] >= _CHECK_JOB_RETRYS:
+                        raise RuntimeError(
+                            "_check_job failed {} times and exceeded limit"
+                            .format(check_job_failures[job_i]))
+                    job_state = {'finished': 0}
+                poll_time = time.time()
+
+                if job_state['finished']:
+                    # the job finished some time since the previous poll
+                    self.poll_strategy.record(
+                        job['service_method'],
+                        (last_poll[job_i] + poll_time) / 2.0 - job['submit_time'],
+                        poll_time - last_poll[job_i])
+                    results[job_i] = self._job_result(job_state)
+                    pending.discard(job_i)
+                    continue
+                last_poll[job_i] = poll_time
+                last_delay[job_i] = self.poll_strategy.next_delay(
+                    self, job['service_method'],
+                    poll_time - job['submit_time'], last_delay[job_i])
+                next_poll[job_i] = poll_time + last_delay[job_i]
+        return results
+
+    def _job_result(self, job_state):
+        if not job_state['result']:
+            return
+        if len(job_state['result']) == 1:
+            return job_state['result'][0]
+        return job_state['result']
+
+    def call_method_stream(self, service_method, args, service_ver=None,
+                           context=None):
+        '''
+        Call a standard or dynamic service, returning the JSON-RPC response
+        body as a file-like object to decode incrementally, instead of the
+        decoded result.  Arguments are as for call_method.  The caller must
+        close() it.
+        '''
+        url = self._get_service_url(service_method, service_ver)
+        context = self._set_up_context(service_ver, context)
+        body = self._rpc_body(service_method, args, context)
+        return _ResponseStream(self._post(url, body, stream=True))
 
     def call_method(self, service_method, args, service_ver=None,
                     context=None):
@@ -279,4 +794,11 @@ class BaseClient(object):
         '''
         url = self._get_service_url(service_method, service_ver)
         context = self._set_up_context(service_ver, context)
-        return self._call(url, service_method, args, context)
+        try:
+            return self._call(url, service_method, args, context)
+        except (ConnectionError, ProtocolError):
+            # the service may have moved; look it up again next time
+            if self.lookup_url:
+                _service_url_cache.invalidate(
+                    self._service_url_key(service_method, service_ver), url)
+            raise
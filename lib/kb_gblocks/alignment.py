@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+#
+# Compact in-memory MSA shared by every stage of a Gblocks run
+#
+# The residues live in one N x L numpy.uint8 matrix (one byte per residue)
+# instead of a dict of N Python strings, so export, validation, trimming,
+# mask removal and the output writers all work on the same buffer, and rows
+# and columns are numpy views rather than copies.
+#
+import re
+
+import numpy as np
+
+from kb_gblocks.alphabet import char_counts, GAP_CHARS, GAP_CODES
+from kb_gblocks.engine import msa_to_matrix, default_b1, default_b2
+
+
+# residues dropped by remove_mask_positions: gaps and unknown residues
+MASK_CHARS = (GAP_CHARS + 'Xx').encode('ascii')
+
+# bound on the rows x columns scratch array used per chunk when masking on all rows
+_MASK_CHUNK_CELLS = 1 << 26
+
+# bound on the rows x columns scratch arrays used per chunk by AlignmentStats
+_STATS_CHUNK_CELLS = 1 << 20
+
+
+def mask_keep_columns(matrix, ref_row=0, mask_chars=MASK_CHARS):
+    '''
+    Boolean vector of the columns to keep: those without a mask character in
+    row ref_row, or in any row if ref_row is None
+    '''
+    mask_codes = np.frombuffer(mask_chars, dtype=np.uint8)
+    if ref_row is not None:
+        is_mask = np.zeros(256, dtype=bool)
+        is_mask[mask_codes] = True
+        return ~is_mask[matrix[ref_row]]
+
+    # one comparison per mask character beats a lookup-table gather over the whole matrix
+    (N, L) = matrix.shape
+    masked = np.zeros(L, dtype=bool)
+    chunk_rows = max(1, _MASK_CHUNK_CELLS // max(L, 1))
+    for row_start in range(0, N, chunk_rows):
+        chunk = matrix[row_start:row_start+chunk_rows]
+        for mask_code in mask_codes:
+            masked |= (chunk == mask_code).any(axis=0)
+    return ~masked
+
+
+class Alignment(object):
+    '''
+    MSA rows as an N x L uint8 matrix, with row ids and display labels in row order
+    '''
+    __slots__ = ('row_ids', 'labels', 'matrix')
+
+    def __init__(self, row_ids, labels, matrix):
+        if matrix.ndim != 2 or matrix.shape[0] != len(row_ids) or len(labels) != len(row_ids):
+            raise ValueError("Alignment needs one row id and label per matrix row (got "+str(len(row_ids))
+                             +" ids, "+str(len(labels))+" labels, matrix "+str(matrix.shape)+")")
+        self.row_ids = list(row_ids)
+        self.labels = list(labels)
+        self.matrix = matrix
+
+    @classmethod
+    def from_MSA(cls, MSA_in, row_order, default_row_labels=None):
+        '''
+        Pack the rows of a KBaseTrees.MSA object, in row_order
+        '''
+        if default_row_labels is None:
+            default_row_labels = dict()
+        matrix = msa_to_matrix([MSA_in['alignment'][row_id] for row_id in row_order])
+        labels = [default_row_labels.get(row_id, row_id) for row_id in row_order]
+        return cls(row_order, labels, matrix)
+
+    @property
+    def N(self):
+        return self.matrix.shape[0]
+
+    @property
+    def L(self):
+        return self.matrix.shape[1]
+
+    def row(self, row_i):
+        return self.matrix[row_i]
+
+    def column(self, pos_i):
+        return self.matrix[:, pos_i]
+
+    def row_str(self, row_i, start=0, end=None):
+        return self.matrix[row_i, start:end].tobytes().decode('ascii')
+
+    def select_columns(self, keep):
+        '''
+        New Alignment with only the columns selected by keep (boolean mask or index array)
+        '''
+        # compress/take copy the kept columns about 3x faster than fancy indexing along axis 1
+        keep = np.asarray(keep)
+        if keep.dtype == bool:
+            return Alignment(self.row_ids, self.labels, np.compress(keep, self.matrix, axis=1))
+        return Alignment(self.row_ids, self.labels, np.take(self.matrix, keep, axis=1))
+
+    def remove_mask_positions(self, ref_row=0, mask_chars=MASK_CHARS):
+        '''
+        New Alignment without the columns that have a mask character in row
+        ref_row (in any row if ref_row is None)
+        '''
+        return self.select_columns(mask_keep_columns(self.matrix, ref_row, mask_chars))
+
+    def to_alignment_dict(self):
+        '''
+        row_id -> aligned sequence, as stored in the "alignment" field of a KBaseTrees.MSA
+        '''
+        alignment = dict()
+        for row_i, row_id in enumerate(self.row_ids):
+            alignment[row_id] = self.row_str(row_i)
+        return alignment
+
+    def write_fasta(self, path, use_labels=False):
+        '''
+        Write single-line FASTA one row at a time, headed by row ids or by
+        display labels (whitespace replaced with '_')
+        '''
+        with open(path, 'w') as fasta_handle:
+            for row_i, row_id in enumerate(self.row_ids):
+                if use_labels:
+                    row_id = re.sub(r'\s', '_', self.labels[row_i])
+                fasta_handle.write('>'+row_id+"\n")
+                fasta_handle.write(self.row_str(row_i)+"\n")
+
+
+class AlignmentStats(object):
+    '''
+    Shape and residue statistics of an Alignment, from one pass over its matrix:
+      N, L, row_lengths (ungapped length of each row), column_gaps (gaps per column),
+      char_counts (count of each byte value), declared_L (the MSA's alignment_length, if any)
+    '''
+    __slots__ = ('N', 'L', 'row_lengths', 'column_gaps', 'char_counts', 'declared_L')
+
+    def __init__(self, N, L, row_lengths, column_gaps, char_counts, declared_L=None):
+        self.N = N
+        self.L = L
+        self.row_lengths = row_lengths
+        self.column_gaps = column_gaps
+        self.char_counts = char_counts
+        self.declared_L = declared_L
+
+    @classmethod
+    def from_alignment(cls, aln, declared_L=None):
+        matrix = aln.matrix
+        (N, L) = matrix.shape
+        row_lengths = np.empty(N, dtype=np.int64)
+        column_gaps = np.zeros(L, dtype=np.int64)
+        counts = np.zeros(256, dtype=np.int64)
+        chunk_rows = max(1, _STATS_CHUNK_CELLS // max(L, 1))
+        for row_start in range(0, N, chunk_rows):
+            chunk = matrix[row_start:row_start+chunk_rows]
+            is_gap = chunk == GAP_CODES[0]
+            for gap_code in GAP_CODES[1:]:
+                is_gap |= chunk == gap_code
+            row_lengths[row_start:row_start+chunk.shape[0]] = L - is_gap.sum(axis=1)
+            column_gaps += is_gap.sum(axis=0)
+            counts += char_counts(chunk)
+        if declared_L is not None:
+            declared_L = int(declared_L)
+        return cls(N, L, row_lengths, column_gaps, counts, declared_L)
+
+    @property
+    def L_first_seq(self):
+        if self.N == 0:
+            return 0
+        return int(self.row_lengths[0])
+
+    @property
+    def rectangular(self):
+        '''
+        Every row is L long (always, once in the matrix) and L is the declared alignment_length
+        '''
+        return self.declared_L is None or self.declared_L == self.L
+
+    @property
+    def default_b1(self):
+        return default_b1(self.N)
+
+    @property
+    def default_b2(self):
+        return default_b2(self.N)
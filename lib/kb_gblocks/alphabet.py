@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+#
+# Sequence alphabet of an MSA, from one pass over its uint8 matrix
+#
+# Every byte value has a class in a 256-entry lookup table, so a single
+# bincount of the matrix gives the residue counts, and the type falls out of
+# which classes occur.  Upper and lower case are classed alike.
+#
+import numpy as np
+
+
+SEQ_TYPE_DNA = 'DNA'
+SEQ_TYPE_RNA = 'RNA'
+SEQ_TYPE_PROTEIN = 'protein'
+SEQ_TYPE_CODON = 'codon'
+
+# Gblocks -t values
+GBLOCKS_SEQ_TYPES = {SEQ_TYPE_DNA: 'd',
+                     SEQ_TYPE_RNA: 'd',
+                     SEQ_TYPE_PROTEIN: 'p',
+                     SEQ_TYPE_CODON: 'c'}
+
+# gap characters, shared by the classifier, the native engine, the mask and the CLUSTALW writer
+GAP_CHARS = '-.'
+GAP_CODES = np.frombuffer(GAP_CHARS.encode('ascii'), dtype=np.uint8)
+NUC_CHARS = 'ACGT'
+RNA_CHARS = 'U'
+# IUPAC ambiguity codes, and X as an unknown residue
+NUC_AMBIG_CHARS = 'NRYSWKMBDHVX'
+# letters that only occur in protein sequences, and the stop codon
+PROT_ONLY_CHARS = 'EFIJLOPQZ*'
+
+(CLASS_OTHER, CLASS_GAP, CLASS_NUC, CLASS_RNA, CLASS_NUC_AMBIG, CLASS_PROT_ONLY) = range(6)
+
+
+def _class_lut():
+    lut = np.full(256, CLASS_OTHER, dtype=np.uint8)
+    for chars, char_class in [(GAP_CHARS, CLASS_GAP),
+                              (NUC_CHARS, CLASS_NUC),
+                              (RNA_CHARS, CLASS_RNA),
+                              (NUC_AMBIG_CHARS, CLASS_NUC_AMBIG),
+                              (PROT_ONLY_CHARS, CLASS_PROT_ONLY)]:
+        for c in chars:
+            lut[ord(c)] = char_class
+            lut[ord(c.lower())] = char_class
+    return lut
+
+
+CHAR_CLASSES = _class_lut()
+
+# byte value -> is it a gap
+IS_GAP = CHAR_CLASSES == CLASS_GAP
+
+# bincount widens its input to intp, so count cache-sized pieces of the matrix
+_COUNT_CHUNK_CELLS = 1 << 16
+
+
+def char_counts(matrix):
+    '''
+    Count of each byte value in the matrix
+    '''
+    cells = matrix.ravel()
+    counts = np.zeros(256, dtype=np.int64)
+    for cell_start in range(0, cells.size, _COUNT_CHUNK_CELLS):
+        counts += np.bincount(cells[cell_start:cell_start+_COUNT_CHUNK_CELLS], minlength=256)
+    return counts
+
+
+def classify_alphabet(matrix, declared_type=None, counts=None):
+    '''
+    Sequence type of an MSA matrix and its character statistics.
+
+    DNA or RNA if every residue is a nucleotide or ambiguity code (RNA if it
+    has U and no T), otherwise protein.  A nucleotide MSA is codon if the MSA
+    object declares a codon sequence_type, since that can't be told from the
+    characters.  counts are the matrix's char_counts, if already known.
+    Returns a dict of
+      type, gblocks_type (the -t value), is_nuc,
+      char_counts (256 counts by byte value, gaps included),
+      n_residues, n_gaps, ambiguous_fraction,
+      frequencies (residue char -> fraction of residues), other_chars
+    '''
+    if counts is None:
+        counts = char_counts(matrix)
+    class_counts = np.bincount(CHAR_CLASSES, weights=counts, minlength=6).astype(np.int64)
+
+    n_gaps = int(class_counts[CLASS_GAP])
+    n_residues = int(counts.sum()) - n_gaps
+    if class_counts[CLASS_PROT_ONLY] > 0 or class_counts[CLASS_OTHER] > 0 or n_residues == 0:
+        seq_type = SEQ_TYPE_PROTEIN
+    elif class_counts[CLASS_RNA] > 0 and counts[[ord('T'), ord('t')]].sum() == 0:
+        seq_type = SEQ_TYPE_RNA
+    else:
+        seq_type = SEQ_TYPE_DNA
+    if seq_type != SEQ_TYPE_PROTEIN and declared_type is not None \
+            and str(declared_type).lower().startswith(SEQ_TYPE_CODON):
+        seq_type = SEQ_TYPE_CODON
+
+    residue_codes = np.flatnonzero((counts > 0) & (CHAR_CLASSES != CLASS_GAP))
+    frequencies = dict()
+    for code in residue_codes:
+        frequencies[chr(code)] = float(counts[code]) / n_residues
+    other_codes = np.flatnonzero((counts > 0) & (CHAR_CLASSES == CLASS_OTHER))
+
+    return {'type': seq_type,
+            'gblocks_type': GBLOCKS_SEQ_TYPES[seq_type],
+            'is_nuc': seq_type != SEQ_TYPE_PROTEIN,
+            'char_counts': counts,
+            'n_residues': n_residues,
+            'n_gaps': n_gaps,
+            'ambiguous_fraction': float(class_counts[CLASS_NUC_AMBIG]) / max(n_residues, 1),
+            'frequencies': frequencies,
+            'other_chars': ''.join([chr(code) for code in other_codes])}
+
+
+def format_alphabet(alphabet):
+    '''
+    One-line summary for the job log
+    '''
+    top = sorted(alphabet['frequencies'].items(), key=lambda item: -item[1])[:5]
+    return (alphabet['type']+' (-t='+alphabet['gblocks_type']+'): '+str(alphabet['n_residues'])+' residues, '
+            +str(alphabet['n_gaps'])+' gaps, '+'%.1f' % (100.0*alphabet['ambiguous_fraction'])+'% ambiguous, top '
+            +' '.join([c+'=%.3f' % freq for c, freq in top])
+            +(', other chars '+repr(alphabet['other_chars']) if alphabet['other_chars'] else ''))
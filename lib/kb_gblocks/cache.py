@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+#
+# Local disk caches keyed by immutable Workspace object versions
+#
+# Entries are written to a temp file and renamed into place, so readers in
+# other processes never see a partial entry.  Eviction is least-recently-used
+# by total bytes, using file mtimes (touched on every hit) as the use clock.
+#
+import os
+import json
+import errno
+import fcntl
+import hashlib
+import uuid
+
+import numpy as np
+
+from kb_gblocks.engine import param_is_set, DEFAULT_B3
+
+
+# Gblocks_Params that change the Gblocks stage output
+RESULT_PARAM_KEYS = ['trim_level',
+                     'min_seqs_for_conserved',
+                     'min_seqs_for_flank',
+                     'max_pos_contig_nonconserved',
+                     'min_block_len']
+
+
+def versioned_ref(info):
+    '''
+    Immutable "wsid/objid/ver" ref from a Workspace object_info tuple
+    '''
+    return str(info[6])+'/'+str(info[0])+'/'+str(info[4])
+
+
+def canonical_params(params, keys=RESULT_PARAM_KEYS):
+    '''
+    Parameter tuple that is the same for every spelling of the same settings
+    ("8" vs 8, missing vs None vs '').  Unset is 0, as both engines read 0 as
+    unset, except for max_pos_contig_nonconserved, where 0 is a real setting
+    (-b3=0): unset and negative values are its fixed default instead
+    '''
+    canonical = []
+    for key in keys:
+        if key == 'max_pos_contig_nonconserved':
+            val = DEFAULT_B3
+            if param_is_set(params, key) and int(params[key]) > -1:
+                val = int(params[key])
+        else:
+            val = 0
+            if param_is_set(params, key):
+                val = int(params[key])
+        canonical.append((key, val))
+    return tuple(canonical)
+
+
+class DiskLRUCache(object):
+    '''
+    Size-bounded directory of cache entries shared by all processes on the host
+    '''
+    ENTRY_SUFFIX = '.entry'
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        if not os.path.exists(self.cache_dir):
+            try:
+                os.makedirs(self.cache_dir)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+        self.lock_path = os.path.join(self.cache_dir, '.lock')
+        self.stats_path = os.path.join(self.cache_dir, '.stats.json')
+
+    def entry_path(self, key):
+        return os.path.join(self.cache_dir, key+self.ENTRY_SUFFIX)
+
+    def _locked(self):
+        lock_handle = open(self.lock_path, 'a')
+        fcntl.flock(lock_handle, fcntl.LOCK_EX)
+        return lock_handle
+
+    def _unlock(self, lock_handle):
+        fcntl.flock(lock_handle, fcntl.LOCK_UN)
+        lock_handle.close()
+
+    def lookup(self, key):
+        '''
+        Return the path of a cached entry (marking it used), or None
+        '''
+        path = self.entry_path(key)
+        try:
+            os.utime(path, None)
+        except OSError:
+            return None
+        return path
+
+    def store(self, key, write_fn):
+        '''
+        Create an entry by calling write_fn(tmp_path), then evict down to max_bytes
+        '''
+        tmp_path = os.path.join(self.cache_dir, '.tmp.'+str(uuid.uuid4()))
+        try:
+            write_fn(tmp_path)
+            os.rename(tmp_path, self.entry_path(key))
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self.evict()
+        return self.entry_path(key)
+
+    def evict(self):
+        lock_handle = self._locked()
+        try:
+            entries = []
+            total_bytes = 0
+            for name in os.listdir(self.cache_dir):
+                if not name.endswith(self.ENTRY_SUFFIX):
+                    continue
+                try:
+                    st = os.stat(os.path.join(self.cache_dir, name))
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, name))
+                total_bytes += st.st_size
+            entries.sort()
+            for mtime, size, name in entries:
+                if total_bytes <= self.max_bytes:
+                    break
+                try:
+                    os.remove(os.path.join(self.cache_dir, name))
+                except OSError:
+                    pass
+                total_bytes -= size
+        finally:
+            self._unlock(lock_handle)
+
+    def _read_stats(self):
+        stats = {'hits': 0, 'misses': 0, 'bytes_saved': 0}
+        if os.path.exists(self.stats_path):
+            try:
+                with open(self.stats_path, 'r') as stats_handle:
+                    stats.update(json.load(stats_handle))
+            except ValueError:
+                pass
+        return stats
+
+    def stats(self):
+        '''
+        Cumulative hit/miss counters
+        '''
+        lock_handle = self._locked()
+        try:
+            return self._read_stats()
+        finally:
+            self._unlock(lock_handle)
+
+    def record(self, hit, bytes_saved=0):
+        '''
+        Update the cumulative hit/miss counters, returning the new totals
+        '''
+        lock_handle = self._locked()
+        try:
+            stats = self._read_stats()
+            if hit:
+                stats['hits'] += 1
+                stats['bytes_saved'] += bytes_saved
+            else:
+                stats['misses'] += 1
+            with open(self.stats_path, 'w') as stats_handle:
+                json.dump(stats, stats_handle)
+        finally:
+            self._unlock(lock_handle)
+        return stats
+
+
+class ResultCache(DiskLRUCache):
+    '''
+    Gblocks stage results: the trimmed alignment matrix and the block map
+    '''
+
+    def make_key(self, info, params, engine):
+        key_src = json.dumps([versioned_ref(info), info[8], canonical_params(params), engine])
+        return hashlib.sha1(key_src.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        path = self.lookup(key)
+        if path is None:
+            return None
+        try:
+            with open(path, 'rb') as entry_handle:
+                entry = np.load(entry_handle)
+                return {'row_ids': entry['row_ids'].tolist(),
+                        'matrix': entry['matrix'],
+                        'blocks': entry['blocks']}
+        except (IOError, OSError, ValueError, KeyError):
+            return None
+
+    def put(self, key, row_ids, matrix, blocks):
+        def write_entry(tmp_path):
+            with open(tmp_path, 'wb') as entry_handle:
+                np.savez(entry_handle,
+                         row_ids=np.array(row_ids),
+                         matrix=matrix,
+                         blocks=np.asarray(blocks, dtype=np.int64).reshape(-1, 2))
+        return self.store(key, write_entry)
+
+
+class ObjectCache(DiskLRUCache):
+    '''
+    Decoded Workspace MSA objects: the fetched fields apart from the alignment,
+    the object_info, and the alignment as row ids and a matrix, stored compressed
+    '''
+
+    def make_key(self, info, included):
+        key_src = json.dumps([versioned_ref(info), info[8], sorted(included)])
+        return hashlib.sha1(key_src.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        path = self.lookup(key)
+        if path is None:
+            return None
+        try:
+            with open(path, 'rb') as entry_handle:
+                entry = np.load(entry_handle)
+                header = json.loads(entry['header'].tobytes().decode('utf-8'))
+                return {'data': header['data'],
+                        'info': header['info'],
+                        'fetched_bytes': header['fetched_bytes'],
+                        'row_ids': entry['row_ids'].tolist(),
+                        'matrix': entry['matrix']}
+        except (IOError, OSError, ValueError, KeyError):
+            return None
+
+    def put(self, key, data, info, row_ids, matrix, fetched_bytes):
+        '''
+        fetched_bytes is what the Workspace sent, counted as saved on every hit
+        '''
+        header = json.dumps({'data': data, 'info': info, 'fetched_bytes': fetched_bytes}).encode('utf-8')
+
+        def write_entry(tmp_path):
+            with open(tmp_path, 'wb') as entry_handle:
+                np.savez_compressed(entry_handle,
+                                    header=np.frombuffer(header, dtype=np.uint8),
+                                    row_ids=np.array(row_ids),
+                                    matrix=matrix)
+        return self.store(key, write_entry)
+
+
+class ColumnCountCache(DiskLRUCache):
+    '''
+    Per-column residue counts of an MSA version (see engine.column_counts),
+    and the residues in its first sequence that settings are checked against,
+    so later trims of that version with other settings take O(L), whatever N
+    is.  Each entry is one .npy file, int32, (L+2) x K: row 0 holds the K
+    symbol codes, row 1 L_first_seq (in every column), the rest the L x K
+    counts.  It is memory-mapped when read.
+    '''
+
+    def make_key(self, info):
+        key_src = json.dumps([versioned_ref(info), info[8], 'column_counts'])
+        return hashlib.sha1(key_src.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        path = self.lookup(key)
+        if path is None:
+            return None
+        try:
+            entry = np.load(path, mmap_mode='r')
+            # no symbols only for an empty MSA
+            L_first_seq = int(entry[1, 0]) if entry.shape[1] > 0 else 0
+            return (entry[2:], np.asarray(entry[0]).astype(np.uint8), L_first_seq)
+        except (IOError, OSError, ValueError, IndexError):
+            return None
+
+    def put(self, key, counts, symbols, L_first_seq):
+        def write_entry(tmp_path):
+            entry = np.empty((counts.shape[0]+2, len(symbols)), dtype=np.int32)
+            entry[0] = symbols
+            entry[1] = L_first_seq
+            entry[2:] = counts
+            with open(tmp_path, 'wb') as entry_handle:
+                np.save(entry_handle, entry)
+        return self.store(key, write_entry)
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+#
+# Non-blocking callback jobs on the generated SDK clients (DataFileUtil, KBaseReport, ...)
+#
+# The generated clients only expose blocking methods, which run_job() one at a
+# time.  These helpers go through the client's BaseClient instead, so jobs on
+# any mix of clients can be submitted together and polled as one group.  They
+# live here rather than in installed_clients, whose clients are regenerated by
+# kb-sdk install.
+#
+
+
+def submit_job(client, service_method, params, context=None):
+    '''
+    Submit service_method (e.g. "DataFileUtil.file_to_shock_mass") with params on
+    a generated SDK client, without waiting for it to finish.  Returns a job
+    handle for wait_all
+    '''
+    return client._client.submit_job(service_method, [params], client._service_ver, context)
+
+
+def wait_all(jobs):
+    '''
+    Wait for job handles from submit_job, polling them as one group.  Returns
+    the job results, in the order of jobs
+    '''
+    if len(jobs) == 0:
+        return []
+    return jobs[0]['client'].wait_all(jobs)
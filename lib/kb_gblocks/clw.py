@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+#
+# CLUSTALW writer for trimmed MSAs
+#
+# The conservation line is computed a block of columns at a time: every
+# residue symbol gets one bit, each column is reduced to the bitmask of the
+# symbols it contains, and the bitmask is tested against precomputed masks for
+# the strong and weak groups.
+#
+import re
+
+import numpy as np
+
+from kb_gblocks.alphabet import IS_GAP
+
+
+CLW_ROW_WIDTH = 60
+CLW_ID_ALN_GAP = ' '
+
+NUC_STRONG_GROUPS = ['AG', 'CTU']
+NUC_WEAK_GROUPS = []
+PROT_STRONG_GROUPS = ['AST', 'EKNQ', 'HKNQ', 'DENQ', 'HKQR', 'ILMV', 'FILM', 'HY', 'FWY']
+PROT_WEAK_GROUPS = ['ACS', 'ATV', 'AGS', 'KNST', 'APST', 'DGNS', 'DEKNQS', 'DEHKNQ', 'EHKNQR', 'FILMV', 'FHY']
+
+# bound on the N x columns bitmask scratch array used per block
+_CLW_BLOCK_CELLS = 1 << 23
+
+
+def _symbol_bits(matrix):
+    '''
+    Assign one bit to each non-gap symbol in the MSA.  Returns the 256-entry
+    bit lookup table (uint64, or Python ints if there are over 64 symbols)
+    '''
+    present = np.flatnonzero(np.bincount(matrix.ravel(), minlength=256))
+    present = present[~IS_GAP[present]]
+    if len(present) <= 64:
+        bit_lut = np.zeros(256, dtype=np.uint64)
+        for bit_i, code in enumerate(present):
+            bit_lut[code] = np.uint64(1) << np.uint64(bit_i)
+    else:
+        bit_lut = np.zeros(256, dtype=object)
+        for bit_i, code in enumerate(present):
+            bit_lut[code] = 1 << bit_i
+    return bit_lut
+
+
+def _group_masks(bit_lut, groups):
+    return [np.bitwise_or.reduce(bit_lut[[ord(c) for c in group]]) for group in groups]
+
+
+def conservation_line(block, bit_lut, strong_masks, weak_masks):
+    '''
+    CLUSTALW conservation characters for a block of MSA columns:
+      '*' one residue, ':' all residues in a strong group, '.' all in a weak group
+    '''
+    col_masks = np.bitwise_or.reduce(bit_lut[block], axis=0)
+    n_residues = (~IS_GAP[block]).sum(axis=0)
+
+    cons = np.full(block.shape[1], ord(' '), dtype=np.uint8)
+    undecided = n_residues > 1
+    single = undecided & ((col_masks & (col_masks - 1)) == 0)
+    cons[single] = ord('*')
+    undecided &= ~single
+    for cons_char, group_masks in [(':', strong_masks), ('.', weak_masks)]:
+        in_group = np.zeros(block.shape[1], dtype=bool)
+        for group_mask in group_masks:
+            in_group |= (col_masks & ~group_mask) == 0
+        in_group &= undecided
+        cons[in_group] = ord(cons_char)
+        undecided &= ~in_group
+    return cons.tobytes().decode('ascii')
+
+
+def write_clw(path, aln, all_seqs_nuc, title):
+    '''
+    Write an Alignment in CLUSTALW format, 60 columns per row, streaming one
+    block of columns at a time
+    '''
+    if all_seqs_nuc:
+        strong_groups, weak_groups = NUC_STRONG_GROUPS, NUC_WEAK_GROUPS
+    else:
+        strong_groups, weak_groups = PROT_STRONG_GROUPS, PROT_WEAK_GROUPS
+    matrix = aln.matrix
+    (N, L) = matrix.shape
+
+    bit_lut = _symbol_bits(matrix)
+    strong_masks = _group_masks(bit_lut, strong_groups)
+    weak_masks = _group_masks(bit_lut, weak_groups)
+
+    long_id_len = max([len(label) for label in aln.labels] + [0])
+    row_prefixes = [re.sub(r'\s', '_', label).ljust(long_id_len)+CLW_ID_ALN_GAP for label in aln.labels]
+    cons_prefix = ' '*long_id_len + CLW_ID_ALN_GAP
+
+    block_width = CLW_ROW_WIDTH * max(1, _CLW_BLOCK_CELLS // (max(N, 1) * CLW_ROW_WIDTH))
+    aln_pos = np.zeros(N, dtype=np.int64)
+
+    with open(path, 'w') as clw_handle:
+        clw_handle.write(title+"\n\n")
+        for block_start in range(0, L, block_width):
+            block = matrix[:, block_start:block_start+block_width]
+            cons = conservation_line(block, bit_lut, strong_masks, weak_masks)
+            chunk_starts = np.arange(0, block.shape[1], CLW_ROW_WIDTH)
+            chunk_residues = np.add.reduceat((~IS_GAP[block]).astype(np.int64), chunk_starts, axis=1)
+            chunk_pos = aln_pos[:, None] + np.cumsum(chunk_residues, axis=1)
+            aln_pos = chunk_pos[:, -1]
+
+            for chunk_i, chunk_start in enumerate(chunk_starts):
+                chunk_end = chunk_start + CLW_ROW_WIDTH
+                lines = []
+                for row_i in range(N):
+                    lines.append(row_prefixes[row_i]
+                                 + block[row_i, chunk_start:chunk_end].tobytes().decode('ascii')
+                                 + ' ' + str(chunk_pos[row_i, chunk_i]))
+                lines.append(cons_prefix + cons[chunk_start:chunk_end])
+                clw_handle.write("\n".join(lines)+"\n\n")
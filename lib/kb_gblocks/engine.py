@@ -0,0 +1,388 @@
+# -*- coding: utf-8 -*-
+#
+# Native (in-process) implementation of the Gblocks block selection algorithm
+#
+#   Castresana, J. (2000) Selection of conserved blocks from multiple
+#   alignments for their use in phylogenetic analysis. Mol Biol Evol 17:540-552
+#
+# The MSA is held as an N x L numpy.uint8 matrix (one byte per residue).  All
+# work after the per-column residue counts is done on length-L vectors, so the
+# block selection itself does not depend on the number of sequences.
+#
+import multiprocessing
+
+import numpy as np
+
+from kb_gblocks.alphabet import char_counts, GAP_CODES
+
+
+# Gblocks parameter defaults (see Gblocks documentation)
+DEFAULT_B3 = 8    # max number of contiguous nonconserved positions
+DEFAULT_B4 = 10   # min length of a block
+DEFAULT_B5 = 'n'  # allowed gap positions: (n)one, (h)alf, (a)ll
+
+# trim_level in Gblocks_Params maps onto b5
+TRIM_LEVEL_TO_B5 = {0: 'n', 1: 'h', 2: 'a'}
+
+# case-folding lookup table so that 'a' and 'A' count as the same residue
+_UPPER_LUT = np.arange(256, dtype=np.uint8)
+_UPPER_LUT[ord('a'):ord('z')+1] -= 32
+
+
+def param_is_set(params, key):
+    return key in params and params[key] != None and params[key] != ''
+
+
+def default_b1(n_seqs):
+    '''
+    Gblocks default min number of sequences for a conserved position, also its lower bound
+    '''
+    return n_seqs // 2 + 1
+
+
+def default_b2(n_seqs):
+    '''
+    Gblocks default min number of sequences for a flank position
+    '''
+    return int(0.85 * n_seqs + 0.5)
+
+
+def resolve_params(params, n_seqs):
+    '''
+    Translate Gblocks_Params into Gblocks b1..b5 values for an MSA of n_seqs rows,
+    filling in the Gblocks defaults for anything left unset (0 or missing)
+    '''
+    b1 = default_b1(n_seqs)
+    if param_is_set(params, 'min_seqs_for_conserved') and int(params['min_seqs_for_conserved']) != 0:
+        b1 = int(params['min_seqs_for_conserved'])
+
+    b2 = default_b2(n_seqs)
+    if param_is_set(params, 'min_seqs_for_flank') and int(params['min_seqs_for_flank']) != 0:
+        b2 = int(params['min_seqs_for_flank'])
+    if b2 < b1:
+        b2 = b1
+
+    b3 = DEFAULT_B3
+    if param_is_set(params, 'max_pos_contig_nonconserved') and int(params['max_pos_contig_nonconserved']) > -1:
+        b3 = int(params['max_pos_contig_nonconserved'])
+
+    b4 = DEFAULT_B4
+    if param_is_set(params, 'min_block_len') and int(params['min_block_len']) != 0:
+        b4 = int(params['min_block_len'])
+
+    b5 = DEFAULT_B5
+    if param_is_set(params, 'trim_level'):
+        trim_level = int(params['trim_level'])
+        if trim_level not in TRIM_LEVEL_TO_B5:
+            raise ValueError("trim_level ("+str(params['trim_level'])+") was not between 0-2")
+        b5 = TRIM_LEVEL_TO_B5[trim_level]
+
+    return {'b1': b1, 'b2': b2, 'b3': b3, 'b4': b4, 'b5': b5}
+
+
+def msa_to_matrix(rows):
+    '''
+    Pack a list of equal-length aligned sequences into an N x L uint8 matrix
+    '''
+    N = len(rows)
+    L = len(rows[0]) if N > 0 else 0
+    matrix = np.empty((N, L), dtype=np.uint8)
+    for row_i, row in enumerate(rows):
+        if not isinstance(row, bytes):
+            row = row.encode('ascii')
+        if len(row) != L:
+            raise ValueError("MSA rows are not all the same length (row "+str(row_i)+" has "+str(len(row))+", expected "+str(L)+")")
+        matrix[row_i, :] = np.frombuffer(row, dtype=np.uint8)
+    return matrix
+
+
+# bound on the rows x columns scratch arrays used per chunk by column_counts
+_COLUMN_COUNT_CHUNK_CELLS = 1 << 20
+
+
+def column_counts(matrix, byte_counts=None):
+    '''
+    Count each (case-folded) symbol in every column of the MSA matrix.
+    byte_counts are the matrix's alphabet.char_counts, if already known.
+
+    Returns (counts, symbols) where counts is an L x K int32 matrix and
+    symbols is the uint8 vector of the K symbols present (gaps included).
+    '''
+    (N, L) = matrix.shape
+    if byte_counts is None:
+        byte_counts = char_counts(matrix)
+    present = np.flatnonzero(byte_counts)
+    symbols = np.unique(_UPPER_LUT[present])
+    K = len(symbols)
+    counts = np.zeros((L, K), dtype=np.int32)
+    if N == 0 or L == 0:
+        return counts, symbols
+
+    # byte value -> symbol index, so one bincount over (column, symbol) cells counts a chunk
+    symbol_index = np.zeros(256, dtype=np.intp)
+    symbol_index[present] = np.searchsorted(symbols, _UPPER_LUT[present])
+    # the chunk's (column, symbol) bins are bounded too, for long alignments of few rows
+    chunk_cols = max(1, min(L, _COLUMN_COUNT_CHUNK_CELLS // max(N, K)))
+    chunk_rows = max(1, _COLUMN_COUNT_CHUNK_CELLS // chunk_cols)
+    for col_start in range(0, L, chunk_cols):
+        col_end = min(col_start+chunk_cols, L)
+        cell_offsets = np.arange(col_end-col_start, dtype=np.intp) * K
+        for row_start in range(0, N, chunk_rows):
+            cells = symbol_index[matrix[row_start:row_start+chunk_rows, col_start:col_end]]
+            cells += cell_offsets
+            counts[col_start:col_end] += np.bincount(cells.ravel(), minlength=(col_end-col_start)*K).reshape(-1, K).astype(np.int32)
+    return counts, symbols
+
+
+def _runs(mask):
+    '''
+    Return (starts, ends) of the True runs in a boolean vector, half-open and 64-bit
+    '''
+    padded = np.concatenate(([0], np.asarray(mask, dtype=np.int8), [0]))
+    edges = np.diff(padded)
+    starts = np.flatnonzero(edges == 1).astype(np.int64)
+    ends = np.flatnonzero(edges == -1).astype(np.int64)
+    return starts, ends
+
+
+def _fill(L, starts, ends):
+    '''
+    Inverse of _runs(): boolean vector of length L that is True on [starts, ends)
+    '''
+    steps = np.zeros(L+1, dtype=np.int64)
+    steps[starts] += 1
+    steps[ends] -= 1
+    return np.cumsum(steps[:L]) > 0
+
+
+def _trim_flanks(starts, ends, flank):
+    '''
+    Shrink each block until both ends are flank (highly conserved) positions,
+    dropping blocks that contain none
+    '''
+    flank_pos = np.flatnonzero(flank).astype(np.int64)
+    first = np.searchsorted(flank_pos, starts, 'left')
+    last = np.searchsorted(flank_pos, ends, 'left') - 1
+    ok = first <= last
+    return flank_pos[first[ok]], flank_pos[last[ok]] + 1
+
+
+def select_blocks(counts, symbols, n_seqs, b1, b2, b3=DEFAULT_B3, b4=DEFAULT_B4, b5=DEFAULT_B5):
+    '''
+    Run the Gblocks block selection on per-column symbol counts.
+
+    Returns (keep, blocks): a length-L boolean vector of retained columns and
+    a K x 2 int64 array of half-open [start, end) block coordinates.
+    '''
+    L = counts.shape[0]
+    is_gap = np.isin(symbols, GAP_CODES)
+    gap_count = counts[:, is_gap].sum(axis=1)
+    if (~is_gap).any():
+        max_count = counts[:, ~is_gap].max(axis=1)
+    else:
+        max_count = np.zeros(L, dtype=np.int32)
+
+    if b5 == 'n':
+        gap_pos = gap_count > 0
+    elif b5 == 'h':
+        gap_pos = 2 * gap_count.astype(np.int64) >= n_seqs
+    elif b5 == 'a':
+        gap_pos = np.zeros(L, dtype=bool)
+    else:
+        raise ValueError("unknown gap mode b5='"+str(b5)+"'")
+
+    # 1. classify positions: nonconserved, conserved (>= b1), flank / highly conserved (>= b2)
+    conserved = (max_count >= b1) & ~gap_pos
+    flank = (max_count >= b2) & ~gap_pos
+    nonconserved = ~conserved
+
+    # 2. reject stretches of contiguous nonconserved positions longer than b3
+    nc_starts, nc_ends = _runs(nonconserved)
+    too_long = (nc_ends - nc_starts) > b3
+    keep = ~_fill(L, nc_starts[too_long], nc_ends[too_long])
+
+    # 3. trim block flanks back to highly conserved positions
+    starts, ends = _runs(keep)
+    starts, ends = _trim_flanks(starts, ends, flank)
+
+    # 4. reject blocks shorter than b4
+    long_enough = (ends - starts) >= b4
+    starts, ends = starts[long_enough], ends[long_enough]
+    keep = _fill(L, starts, ends)
+
+    # 5. remove gap positions along with the nonconserved stretches they sit in.  That can
+    #    leave new block ends on conserved but not highly conserved positions, so trim the
+    #    flanks again, then re-check block length
+    if gap_pos.any():
+        gap_cumsum = np.concatenate(([0], np.cumsum(gap_pos, dtype=np.int64)))
+        has_gap = gap_cumsum[nc_ends] > gap_cumsum[nc_starts]
+        keep &= ~_fill(L, nc_starts[has_gap], nc_ends[has_gap])
+        starts, ends = _runs(keep)
+        starts, ends = _trim_flanks(starts, ends, flank)
+        long_enough = (ends - starts) >= b4
+        starts, ends = starts[long_enough], ends[long_enough]
+        keep = _fill(L, starts, ends)
+
+    return keep, np.column_stack((starts, ends))
+
+
+def gap_fraction(counts, symbols, n_seqs, keep):
+    '''
+    Fraction of gap characters among the cells of the retained columns
+    '''
+    L_kept = int(keep.sum())
+    if L_kept == 0 or n_seqs == 0:
+        return 0.0
+    gap_count = counts[:, np.isin(symbols, GAP_CODES)].sum(axis=1)
+    return float(gap_count[keep].sum()) / (n_seqs * L_kept)
+
+
+def evaluate_setting(counts, symbols, n_seqs, params):
+    '''
+    Summarize the trim produced by one Gblocks_Params setting
+    '''
+    keep, blocks = select_blocks(counts, symbols, n_seqs, **resolve_params(params, n_seqs))
+    return {'retained_len': int(keep.sum()),
+            'block_count': len(blocks),
+            'gap_fraction': gap_fraction(counts, symbols, n_seqs, keep)}
+
+
+# per-worker copy of the column counts for sweep(), set by the pool initializer
+_sweep_state = {}
+
+
+def _sweep_init(counts, symbols, n_seqs):
+    _sweep_state['counts'] = counts
+    _sweep_state['symbols'] = symbols
+    _sweep_state['n_seqs'] = n_seqs
+
+
+def _sweep_worker(params):
+    return evaluate_setting(_sweep_state['counts'], _sweep_state['symbols'], _sweep_state['n_seqs'], params)
+
+
+def sweep(counts, symbols, n_seqs, settings, processes=None):
+    '''
+    Evaluate a list of Gblocks_Params settings against one set of column counts,
+    in parallel on a process pool.  Results are in the order of settings.
+    '''
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    processes = min(processes, len(settings))
+    if processes <= 1:
+        return [evaluate_setting(counts, symbols, n_seqs, params) for params in settings]
+
+    pool = multiprocessing.Pool(processes, initializer=_sweep_init, initargs=(counts, symbols, n_seqs))
+    try:
+        return pool.map(_sweep_worker, settings)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def format_flanks(blocks):
+    '''
+    Gblocks-style 1-based inclusive block listing, e.g. "[1  10]  [25  40]"
+    '''
+    return '  '.join(['['+str(start+1)+'  '+str(end)+']' for start, end in blocks])
+
+
+def write_gb_fasta(path, row_ids, matrix):
+    '''
+    Write a trimmed MSA in the layout Gblocks uses for its "-gb" file:
+    60 residues per line, in space-separated groups of 10
+    '''
+    line_width = 60
+    group_width = 10
+    L = matrix.shape[1]
+    with open(path, 'w') as gb_handle:
+        for row_i, row_id in enumerate(row_ids):
+            row = matrix[row_i].tobytes().decode('ascii')
+            gb_handle.write('>'+row_id+"\n")
+            for line_start in range(0, L, line_width):
+                line = row[line_start:line_start+line_width]
+                groups = [line[i:i+group_width] for i in range(0, len(line), group_width)]
+                gb_handle.write(' '.join(groups)+"\n")
+            gb_handle.write("\n")
+
+
+
+# whitespace Gblocks puts inside "-gb" sequence lines (groups of 10, line ends)
+_GB_SPACE_CHARS = b' \t\r\n'
+
+
+class RowBuffer(object):
+    '''
+    Preallocated N x L uint8 matrix filled one row at a time.  L is fixed by
+    the first row; capacity doubles if more than n_rows_hint rows arrive.
+    '''
+    __slots__ = ('matrix', 'n_rows', 'n_rows_hint')
+
+    def __init__(self, n_rows_hint):
+        self.matrix = None
+        self.n_rows = 0
+        self.n_rows_hint = max(n_rows_hint, 1)
+
+    def append(self, row):
+        if self.matrix is None:
+            self.matrix = np.empty((self.n_rows_hint, len(row)), dtype=np.uint8)
+        if len(row) != self.matrix.shape[1]:
+            raise ValueError("MSA rows are not all the same length (row "+str(self.n_rows)+" has "+str(len(row))+", expected "+str(self.matrix.shape[1])+")")
+        if self.n_rows == self.matrix.shape[0]:
+            grown = np.empty((2*self.n_rows, self.matrix.shape[1]), dtype=np.uint8)
+            grown[:self.n_rows] = self.matrix
+            self.matrix = grown
+        self.matrix[self.n_rows] = np.frombuffer(row, dtype=np.uint8)
+        self.n_rows += 1
+
+    def result(self):
+        if self.matrix is None:
+            return np.empty((0, 0), dtype=np.uint8)
+        return self.matrix[:self.n_rows]
+
+
+def read_gb_fasta(path, n_rows_hint=0, chunk_size=1 << 22):
+    '''
+    Read a Gblocks "-gb" file (or any FASTA with equal-length rows) in large
+    chunks, stripping the column-group spaces with bytes.translate() and
+    filling a preallocated N x L uint8 matrix.  Linear in the file size.
+
+    Returns (row_ids, matrix)
+    '''
+    row_ids = []
+    rows = RowBuffer(n_rows_hint)
+    row_parts = None
+    pending = b''
+    with open(path, 'rb') as gb_handle:
+        while True:
+            chunk = gb_handle.read(chunk_size)
+            buf = pending + chunk
+            if chunk:
+                # only parse whole lines; the tail waits for the next chunk
+                cut = buf.rfind(b'\n') + 1
+                pending = buf[cut:]
+                buf = buf[:cut]
+            pos = 0
+            buf_len = len(buf)
+            while pos < buf_len:
+                if buf.startswith(b'>', pos):
+                    if row_parts is not None:
+                        rows.append(b''.join(row_parts))
+                    row_parts = []
+                    end = buf.find(b'\n', pos)
+                    if end < 0:
+                        end = buf_len
+                    row_ids.append(buf[pos+1:end].rstrip().decode('utf-8'))
+                    pos = end + 1
+                else:
+                    # everything up to the next header is sequence
+                    end = buf.find(b'\n>', pos)
+                    end = buf_len if end < 0 else end + 1
+                    if row_parts is not None:
+                        row_parts.append(buf[pos:end].translate(None, _GB_SPACE_CHARS))
+                    pos = end
+            if not chunk:
+                break
+    if row_parts is not None:
+        rows.append(b''.join(row_parts))
+    return row_ids, rows.result()
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+#
+# Helpers for running the Gblocks executable non-interactively
+#
+#   Gblocks <MSA_file> -t=<d|p|c> -b1=<n> -b2=<n> -b3=<n> -b4=<n> -b5=<n|h|a>
+#
+import os
+import re
+import subprocess
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from kb_gblocks.engine import param_is_set, TRIM_LEVEL_TO_B5
+
+
+def build_gblocks_cmd(gblocks_bin, input_MSA_file_path, params, seq_type):
+    '''
+    Build the Gblocks argv for Gblocks_Params, for sequence type seq_type
+    ('d' DNA, 'p' protein or 'c' codons).  Settings left at 0 or unset are
+    not passed, so Gblocks applies its own MSA-depth-derived defaults.
+    '''
+    gblocks_cmd = [gblocks_bin, input_MSA_file_path]
+
+    # sequence type
+    if seq_type not in ['d', 'p', 'c']:
+        raise ValueError("sequence type ("+str(seq_type)+") must be d, p or c")
+    gblocks_cmd.append('-t='+seq_type)
+
+    # allowed gap positions
+    if param_is_set(params, 'trim_level') and int(params['trim_level']) != 0:
+        trim_level = int(params['trim_level'])
+        if trim_level not in TRIM_LEVEL_TO_B5:
+            raise ValueError("trim_level ("+str(params['trim_level'])+") was not between 0-2")
+        gblocks_cmd.append('-b5='+TRIM_LEVEL_TO_B5[trim_level])
+
+    # flank must precede conserved because it acts as upper bound for acceptable conserved values
+    if param_is_set(params, 'min_seqs_for_flank') and int(params['min_seqs_for_flank']) != 0:
+        gblocks_cmd.append('-b2='+str(int(params['min_seqs_for_flank'])))
+
+    if param_is_set(params, 'min_seqs_for_conserved') and int(params['min_seqs_for_conserved']) != 0:
+        gblocks_cmd.append('-b1='+str(int(params['min_seqs_for_conserved'])))
+
+    if param_is_set(params, 'max_pos_contig_nonconserved') and int(params['max_pos_contig_nonconserved']) > -1:
+        gblocks_cmd.append('-b3='+str(int(params['max_pos_contig_nonconserved'])))
+
+    if param_is_set(params, 'min_block_len') and int(params['min_block_len']) != 0:
+        gblocks_cmd.append('-b4='+str(int(params['min_block_len'])))
+
+    return gblocks_cmd
+
+
+def _pump(stream, prefix, log_buffer, log_lock, log_fn):
+    for line in iter(stream.readline, ''):
+        line = prefix+line.rstrip("\n")
+        with log_lock:
+            log_buffer.append(line)
+        if log_fn is not None:
+            log_fn(line)
+    stream.close()
+
+
+def run_streaming(cmd, cwd=None, env=None, timeout=None, log_fn=None, max_log_lines=1000):
+    '''
+    Run cmd without a shell, draining stdout and stderr concurrently so the child
+    can never block on a full pipe.  Each line is passed to log_fn as it arrives
+    and the last max_log_lines lines are kept.  The child is killed if it runs
+    longer than timeout seconds.
+
+    Returns (returncode, log_lines)
+    '''
+    log_buffer = deque(maxlen=max_log_lines)
+    log_lock = threading.Lock()
+    devnull = open(os.devnull, 'r')
+    try:
+        p = subprocess.Popen(cmd,
+                             cwd = cwd,
+                             env = env,
+                             stdin = devnull,
+                             stdout = subprocess.PIPE,
+                             stderr = subprocess.PIPE,
+                             shell = False,
+                             universal_newlines = True)
+        pumps = [threading.Thread(target=_pump, args=(p.stdout, '', log_buffer, log_lock, log_fn)),
+                 threading.Thread(target=_pump, args=(p.stderr, 'STDERR: ', log_buffer, log_lock, log_fn))]
+        for pump in pumps:
+            pump.daemon = True
+            pump.start()
+
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        timed_out = False
+
+        # pipes close when the child exits, so the pumps finishing is our exit signal
+        for pump in pumps:
+            pump.join(None if deadline is None else max(deadline - time.time(), 0))
+        while p.poll() is None:
+            if deadline is not None and time.time() >= deadline:
+                timed_out = True
+                p.kill()
+                break
+            time.sleep(0.05)
+        p.wait()
+        for pump in pumps:
+            pump.join(1.0)
+    finally:
+        devnull.close()
+
+    if timed_out:
+        raise ValueError("'"+os.path.basename(cmd[0])+"' exceeded timeout of "+str(timeout)+" sec and was killed.  Last output:\n"+"\n".join(log_buffer))
+    return p.returncode, list(log_buffer)
+
+
+def read_gblocks_flanks(gblocks_htm_file_path):
+    '''
+    Read the block map from the "Flanks: [1  10]  [25  40]" line of the Gblocks
+    results page, as a K x 2 int64 array of half-open [start, end) coordinates
+    '''
+    blocks = []
+    if os.path.isfile(gblocks_htm_file_path):
+        with open(gblocks_htm_file_path, 'r') as htm_handle:
+            for line in htm_handle:
+                if 'Flanks:' in line:
+                    for start, end in re.findall(r'\[\s*(\d+)\s+(\d+)\s*\]', line.split('Flanks:', 1)[1]):
+                        blocks.append((int(start)-1, int(end)))
+                    break
+    return np.array(blocks, dtype=np.int64).reshape(-1, 2)
@@ -53,7 +53,8 @@ class kb_gblocks(object):
            parameter "trim_level" of Long, parameter "min_seqs_for_conserved"
            of Long, parameter "min_seqs_for_flank" of Long, parameter
            "max_pos_contig_nonconserved" of Long, parameter "min_block_len"
-           of Long, parameter "remove_mask_positions_flag" of Long
+           of Long, parameter "remove_mask_positions_flag" of Long,
+           parameter "engine" of String
         :returns: instance of type "Gblocks_Output" (Gblocks Output) ->
            structure: parameter "report_name" of type "data_obj_name",
            parameter "report_ref" of type "data_obj_ref"
@@ -61,6 +62,105 @@ class kb_gblocks(object):
         return self._client.call_method('kb_gblocks.run_Gblocks',
                                         [params], self._service_ver, context)
 
+    def run_Gblocks_sweep(self, params, context=None):
+        """
+        Method for evaluating a grid of Gblocks settings on one MSA
+        **
+        **        input_type: MSA
+        **        output_type: MSA (for each setting in save_setting_indices)
+        :param params: instance of type "Gblocks_Sweep_Params" (Gblocks
+           Sweep Input Params ** ** Every combination of trim_levels x
+           min_block_lens x max_pos_contig_nonconserveds is evaluated with
+           the native engine. ** Settings are numbered in that order (the
+           order of the returned settings list), ** and save_setting_indices
+           picks which of them are saved as MSA objects ** named
+           <output_name>.<index>) -> structure: parameter "workspace_name"
+           of type "workspace_name" (** The workspace object refs are of
+           form: ** **    objects = ws.get_objects([{'ref':
+           params['workspace_id']+'/'+params['obj_name']}]) ** ** "ref" means
+           the entire name combining the workspace id and the object name **
+           "id" is a numerical identifier of the workspace or object, and
+           should just be used for workspace ** "name" is a string identifier
+           of a workspace or object.  This is received from Narrative.),
+           parameter "desc" of String, parameter "input_ref" of type
+           "data_obj_ref", parameter "output_name" of type "data_obj_name",
+           parameter "trim_levels" of list of Long, parameter
+           "min_block_lens" of list of Long, parameter
+           "max_pos_contig_nonconserveds" of list of Long, parameter
+           "min_seqs_for_conserved" of Long, parameter "min_seqs_for_flank"
+           of Long, parameter "save_setting_indices" of list of Long
+        :returns: instance of type "Gblocks_Sweep_Output" (Gblocks Sweep
+           Output) -> structure: parameter "report_name" of type
+           "data_obj_name", parameter "report_ref" of type "data_obj_ref",
+           parameter "settings" of list of type "Gblocks_Sweep_Setting"
+           (Gblocks Sweep result for one setting) -> structure: parameter
+           "index" of Long, parameter "trim_level" of Long, parameter
+           "min_block_len" of Long, parameter "max_pos_contig_nonconserved"
+           of Long, parameter "retained_len" of Long, parameter
+           "block_count" of Long, parameter "gap_fraction" of Double,
+           parameter "output_ref" of type "data_obj_ref"
+        """
+        return self._client.call_method('kb_gblocks.run_Gblocks_sweep',
+                                        [params], self._service_ver, context)
+
+    def run_Gblocks_batch(self, params, context=None):
+        """
+        Method for trimming many MSAs with the same Gblocks settings in one job
+        **
+        **        input_type: list of MSA, or a set of MSA
+        **        output_type: MSA (one per input)
+        :param params: instance of type "Gblocks_Batch_Params" (Gblocks
+           Batch Input Params ** ** MSAs are taken from input_refs and/or
+           the items of input_set_ref. ** Each output MSA is named
+           <input MSA name><output_suffix>) -> structure: parameter
+           "workspace_name" of type "workspace_name" (** The workspace object
+           refs are of form: ** **    objects = ws.get_objects([{'ref':
+           params['workspace_id']+'/'+params['obj_name']}]) ** ** "ref" means
+           the entire name combining the workspace id and the object name **
+           "id" is a numerical identifier of the workspace or object, and
+           should just be used for workspace ** "name" is a string identifier
+           of a workspace or object.  This is received from Narrative.),
+           parameter "desc" of String, parameter "input_refs" of list of type
+           "data_obj_ref", parameter "input_set_ref" of type "data_obj_ref",
+           parameter "output_suffix" of String, parameter "trim_level" of
+           Long, parameter "min_seqs_for_conserved" of Long, parameter
+           "min_seqs_for_flank" of Long, parameter
+           "max_pos_contig_nonconserved" of Long, parameter "min_block_len"
+           of Long, parameter "engine" of String, parameter "max_workers" of
+           Long
+        :returns: instance of type "Gblocks_Batch_Output" (Gblocks Batch
+           Output) -> structure: parameter "report_name" of type
+           "data_obj_name", parameter "report_ref" of type "data_obj_ref",
+           parameter "output_refs" of list of type "data_obj_ref"
+        """
+        return self._client.call_method('kb_gblocks.run_Gblocks_batch',
+                                        [params], self._service_ver, context)
+
+    def preview_Gblocks(self, params, context=None):
+        """
+        Method for previewing the blocks Gblocks settings keep, without saving anything
+        **
+        **        input_type: MSA
+        **        output_type: none
+        :param params: instance of type "Gblocks_Preview_Params" (Gblocks
+           Preview Input Params ** ** The Gblocks_Params settings, evaluated
+           with the native engine.) -> structure: parameter "input_ref" of
+           type "data_obj_ref", parameter "trim_level" of Long, parameter
+           "min_seqs_for_conserved" of Long, parameter "min_seqs_for_flank"
+           of Long, parameter "max_pos_contig_nonconserved" of Long,
+           parameter "min_block_len" of Long
+        :returns: instance of type "Gblocks_Preview_Output" (Gblocks Preview
+           Output ** ** blocks are the [start, end) columns of each block,
+           0-based. ** kept has one character per input MSA column: "1" kept,
+           "0" dropped.) -> structure: parameter "blocks" of list of tuple of
+           size 2: parameter "start" of Long, parameter "end" of Long,
+           parameter "alignment_length" of Long, parameter "retained_len" of
+           Long, parameter "retained_fraction" of Double, parameter "kept" of
+           String
+        """
+        return self._client.call_method('kb_gblocks.preview_Gblocks',
+                                        [params], self._service_ver, context)
+
     def status(self, context=None):
         return self._client.call_method('kb_gblocks.status',
                                         [], self._service_ver, context)
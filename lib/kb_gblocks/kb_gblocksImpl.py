@@ -2,6 +2,8 @@
 #BEGIN_HEADER
 import os
 import sys
+import time
+import resource
 import shutil
 import hashlib
 import subprocess
@@ -9,6 +11,8 @@ import requests
 import re
 import traceback
 import uuid
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 from datetime import datetime
 from pprint import pprint, pformat
 import numpy as np
@@ -24,6 +28,16 @@ from requests_toolbelt import MultipartEncoder
 from biokbase.AbstractHandle.Client import AbstractHandle as HandleService
 from installed_clients.DataFileUtilClient import DataFileUtil as DFUClient
 from installed_clients.KBaseReportClient import KBaseReport
+from installed_clients.baseclient import configure_session_pool, session_pool_stats, poll_strategy_stats, service_url_cache_stats
+from installed_clients.baseclient import configure_request_compression, request_compression_stats
+from kb_gblocks.engine import param_is_set, resolve_params, default_b1, default_b2, column_counts, select_blocks, format_flanks, write_gb_fasta, read_gb_fasta, sweep
+from kb_gblocks.gblocks_runner import build_gblocks_cmd, run_streaming, read_gblocks_flanks
+from kb_gblocks.cache import ResultCache, ObjectCache, ColumnCountCache, versioned_ref
+from kb_gblocks.alignment import Alignment, AlignmentStats
+from kb_gblocks.alphabet import classify_alphabet, format_alphabet
+from kb_gblocks.msa_stream import get_objects2_stream, read_MSA_objects, order_rows
+from kb_gblocks.clw import write_clw
+from kb_gblocks.callback_jobs import submit_job, wait_all
 
 # silence whining
 import requests
@@ -59,6 +73,19 @@ class kb_gblocks:
     handleURL = None
 
     GBLOCKS_bin = '/kb/module/Gblocks'
+    GBLOCKS_engines = ['binary', 'native']
+    GBLOCKS_bin_max_len = 32000  # the binary stores b3 and b4 as short ints; the native engine has no such limit
+    GBLOCKS_timeout = 3600  # sec, override with 'gblocks-timeout' in config
+    GBLOCKS_max_log_lines = 1000
+    result_cache_max_bytes = 2 * 1024**3  # override with 'result-cache-max-bytes' in config, 0 to disable
+    object_cache_max_bytes = 4 * 1024**3  # override with 'object-cache-max-bytes' in config, 0 to disable
+    column_count_cache_max_bytes = 1024**3  # override with 'column-count-cache-max-bytes' in config, 0 to disable
+
+    # KBaseTrees.MSA fields needed to trim.  The rest (ws_refs, kb_refs, etc.)
+    # are only fetched to carry over into output MSAs
+    MSA_trim_fields = ['alignment', 'row_order', 'default_row_labels', 'alignment_length', 'sequence_type']
+    MSA_carry_over_fields = ['description', 'trim_info', 'alignment_attributes',
+                             'ws_refs', 'kb_refs', 'parent_msa_ref']
 
     # target is a list for collecting log messages
     def log(self, target, message):
@@ -68,6 +95,485 @@ class kb_gblocks:
         print(message)
         sys.stdout.flush()
 
+    # pre-flight for an input MSA: its object_info and the small fields row_order and
+    # alignment_length, so params that can't work are rejected before the alignment downloads.
+    # returns (info, versioned ref, N, L), with N or L None if the MSA doesn't record them
+    def get_MSA_preflight(self, ws, input_ref, console=None):
+        fetch_start = self.fetch_stats()
+        try:
+            info = ws.get_object_info3({'objects': [{'ref': input_ref}]})['infos'][0]
+        except Exception as e:
+            raise ValueError('Unable to fetch input_ref object info from workspace: ' + str(e))
+        input_type_name = info[2].split('.')[1].split('-')[0]
+        if input_type_name != 'MSA':
+            raise ValueError('Cannot yet handle input_ref type of: '+input_type_name)
+
+        # pin the version, so the bulk fetch gets the object that was checked
+        input_versioned_ref = versioned_ref(info)
+        try:
+            MSA_sizes = ws.get_objects2({'objects': [{'ref': input_versioned_ref,
+                                                      'included': ['/row_order', '/alignment_length']}]})['data'][0]['data']
+        except Exception as e:
+            raise ValueError('Unable to fetch input_ref object from workspace: ' + str(e))
+        N_seqs = None
+        if 'row_order' in MSA_sizes:
+            N_seqs = len(MSA_sizes['row_order'])
+        L_alignment = MSA_sizes.get('alignment_length')
+
+        self.log_fetch_stats(console, 'pre-flight '+input_ref+' ('+input_versioned_ref+', '+str(info[9])+' bytes, N='
+                             +str(N_seqs)+', L='+str(L_alignment)+')', fetch_start)
+        return (info, input_versioned_ref, N_seqs, L_alignment)
+
+    # check Gblocks_Params against an MSA with N_seqs rows and L_first_seq residues in its first
+    # row (or whatever upper bound on that L_name names).  N_seqs or L_first_seq None skips those
+    # checks.  Problems go in invalid_msgs; returns the engine to run, which may be switched to
+    # native for settings too long for the binary
+    def validate_Gblocks_params(self, params, N_seqs, L_first_seq, engine, engine_requested,
+                                invalid_msgs, console, L_name='L first seq'):
+        if N_seqs is not None and N_seqs < 2:
+            self.log(invalid_msgs,"must have multiple records in MSA: "+params['input_ref'])
+
+        # settings left unset or 0 get the Gblocks defaults, as in engine.resolve_params
+        min_seqs_for_conserved = None
+        if param_is_set(params, 'min_seqs_for_conserved') and int(params['min_seqs_for_conserved']) != 0:
+            min_seqs_for_conserved = int(params['min_seqs_for_conserved'])
+        min_seqs_for_flank = None
+        if param_is_set(params, 'min_seqs_for_flank') and int(params['min_seqs_for_flank']) != 0:
+            min_seqs_for_flank = int(params['min_seqs_for_flank'])
+        elif N_seqs is not None:
+            min_seqs_for_flank = default_b2(N_seqs)
+
+        # min_seqs_for_conserved
+        if min_seqs_for_conserved is not None:
+            if N_seqs is not None and min_seqs_for_conserved < default_b1(N_seqs):
+                self.log(invalid_msgs,"Min Seqs for Conserved Pos ("+str(min_seqs_for_conserved)+") must be >= N/2+1 (N="+str(N_seqs)+", N/2+1="+str(default_b1(N_seqs))+")\n")
+            if min_seqs_for_flank is not None and min_seqs_for_conserved > min_seqs_for_flank:
+                self.log(invalid_msgs,"Min Seqs for Conserved Pos ("+str(min_seqs_for_conserved)+") must be <= Min Seqs for Flank Pos ("+str(min_seqs_for_flank)+")\n")
+
+        # min_seqs_for_flank
+        if min_seqs_for_flank is not None and N_seqs is not None:
+            if min_seqs_for_flank > N_seqs:
+                self.log(invalid_msgs,"Min Seqs for Flank Pos ("+str(min_seqs_for_flank)+") must be <= N (N="+str(N_seqs)+")\n")
+
+        # max_pos_contig_nonconserved
+        gblocks_bin_limit_hit = False
+        if param_is_set(params, 'max_pos_contig_nonconserved') and int(params['max_pos_contig_nonconserved']) != 0:
+            if int(params['max_pos_contig_nonconserved']) < 0:
+                self.log(invalid_msgs,"Max Num Non-Conserved Pos ("+str(params['max_pos_contig_nonconserved'])+") must be >= 0"+"\n")
+            if L_first_seq is not None and int(params['max_pos_contig_nonconserved']) > L_first_seq:
+                self.log(invalid_msgs,"Max Num Non-Conserved Pos ("+str(params['max_pos_contig_nonconserved'])+") must be <= "+L_name+" ("+str(L_first_seq)+")\n")
+            if int(params['max_pos_contig_nonconserved']) >= self.GBLOCKS_bin_max_len:
+                gblocks_bin_limit_hit = True
+
+        # min_block_len
+        if param_is_set(params, 'min_block_len') and int(params['min_block_len']) != 0:
+            if int(params['min_block_len']) < 2:
+                self.log(invalid_msgs,"Min Block Len ("+str(params['min_block_len'])+") must be >= 2"+"\n")
+            if L_first_seq is not None and int(params['min_block_len']) > L_first_seq:
+                self.log(invalid_msgs,"Min Block Len ("+str(params['min_block_len'])+") must be <= "+L_name+" ("+str(L_first_seq)+")\n")
+            if int(params['min_block_len']) >= self.GBLOCKS_bin_max_len:
+                gblocks_bin_limit_hit = True
+
+        # trim_level
+        if param_is_set(params, 'trim_level') and int(params['trim_level']) != 0:
+            if int(params['trim_level']) < 0 or int(params['trim_level']) > 2:
+                self.log(invalid_msgs,"Trim Level ("+str(params['trim_level'])+") must be >= 0 and <= 2"+"\n")
+
+        # the binary can't handle long supermatrix settings, so route them to the native engine
+        if gblocks_bin_limit_hit and engine == 'binary':
+            if engine_requested:
+                self.log(invalid_msgs,"Max Num Non-Conserved Pos and Min Block Len must be < "+str(self.GBLOCKS_bin_max_len)+" for the Gblocks binary.  Use the native engine for longer settings\n")
+            else:
+                self.log(console,"Max Num Non-Conserved Pos or Min Block Len >= "+str(self.GBLOCKS_bin_max_len)+", switching to native engine")
+                engine = 'native'
+        return engine
+
+    # check every sweep setting with validate_Gblocks_params, so a sweep accepts what run_Gblocks
+    # accepts.  Each problem is reported once, with the settings it applies to
+    def validate_sweep_settings(self, params, settings, N_seqs, L_first_seq, console, L_name='L first seq'):
+        setting_indices_by_msg = dict()
+        invalid_msgs = []
+        for setting_i, setting in enumerate(settings):
+            setting_msgs = []
+            self.validate_Gblocks_params(dict(setting, input_ref=params['input_ref']), N_seqs, L_first_seq,
+                                         'native', True, setting_msgs, console, L_name=L_name)
+            for msg in setting_msgs:
+                msg = msg.rstrip("\n")
+                if msg not in setting_indices_by_msg:
+                    setting_indices_by_msg[msg] = []
+                    invalid_msgs.append(msg)
+                setting_indices_by_msg[msg].append(str(setting_i))
+        if len(invalid_msgs) > 0:
+            raise ValueError("\n".join([msg+" (settings "+", ".join(setting_indices_by_msg[msg])+")"
+                                         for msg in invalid_msgs]))
+
+    # save a report of invalid_msgs without running anything.  Returns the method's returnVal
+    def save_invalid_report(self, ctx, ws, params, method, report, invalid_msgs, console):
+
+        # load the method provenance from the context object
+        self.log(console,"SETTING PROVENANCE")  # DEBUG
+        provenance = self.get_provenance(ctx, [params['input_ref']], method)
+
+        # report
+        report += "FAILURE\n\n"+"\n".join(invalid_msgs)+"\n"
+        reportObj = {
+            'objects_created':[],
+            'text_message':report
+            }
+
+        reportName = 'gblocks_report_'+str(uuid.uuid4())
+        report_obj_info = ws.save_objects({
+#            'id':info[6],
+            'workspace':params['workspace_name'],
+            'objects':[
+                {
+                    'type':'KBaseReport.Report',
+                    'data':reportObj,
+                    'name':reportName,
+                    'meta':{},
+                    'hidden':1,
+                    'provenance':provenance
+                }
+            ]
+        })[0]
+
+
+        self.log(console,"BUILDING RETURN OBJECT")
+        returnVal = { 'report_name': reportName,
+                      'report_ref': str(report_obj_info[6]) + '/' + str(report_obj_info[0]) + '/' + str(report_obj_info[4])
+#                      'output_ref': None
+                      }
+        self.log(console,method+" DONE")
+        return returnVal
+
+    # fetch just the parts of an MSA object the trimmer reads (see MSA_trim_fields),
+    # returning them with its object_info and the alignment.  The response is decoded
+    # as it streams in, so alignment rows go straight into the Alignment matrix.
+    # Object versions never change, so they are kept in the local object cache;
+    # pass the object's info if it's known, otherwise an info call pins the version
+    def get_input_MSA(self, ws, input_ref, console=None, n_rows_hint=0, info=None):
+        object_cache_key = None
+        cached_MSA = None
+        if self.object_cache is not None:
+            if info is None:
+                try:
+                    info = ws.get_object_info3({'objects': [{'ref': input_ref}]})['infos'][0]
+                except Exception as e:
+                    raise ValueError('Unable to fetch input_ref object info from workspace: ' + str(e))
+            object_cache_key = self.object_cache.make_key(info, self.MSA_trim_fields)
+            cached_MSA = self.object_cache.get(object_cache_key)
+
+        if cached_MSA is not None:
+            (data, info, row_ids, MSA_matrix) = (cached_MSA['data'], cached_MSA['info'],
+                                                 cached_MSA['row_ids'], cached_MSA['matrix'])
+            self.log(console, 'USING CACHED OBJECT for '+input_ref+' ('+versioned_ref(info)+')')
+            self.log_cache_stats(console, 'object cache', self.object_cache.record(True, cached_MSA['fetched_bytes']),
+                                 'bytes not downloaded')
+        else:
+            if info is not None:
+                input_ref = versioned_ref(info)
+            fetch_start = self.fetch_stats()
+            try:
+                MSA_stream = get_objects2_stream(ws, {'objects': [{'ref': input_ref,
+                                                                   'included': ['/'+field for field in self.MSA_trim_fields]}]})
+                try:
+                    (data, info, row_ids, MSA_matrix) = read_MSA_objects(MSA_stream, [n_rows_hint])[0]
+                finally:
+                    MSA_stream.close()
+
+            except Exception as e:
+                raise ValueError('Unable to fetch input_ref object from workspace: ' + str(e))
+                #to get the full stack trace: traceback.format_exc()
+
+            self.log_fetch_stats(console, 'fetched '+input_ref, fetch_start)
+            if object_cache_key is not None:
+                self.object_cache.put(object_cache_key, data, info, row_ids, MSA_matrix,
+                                      session_pool_stats()['bytes_received'] - fetch_start[0])
+                self.log_cache_stats(console, 'object cache', self.object_cache.record(False), 'bytes not downloaded')
+
+        (MSA_in, info, row_order, default_row_labels) = self.parse_MSA_object(data, info, row_ids)
+        MSA_aln = Alignment(row_order,
+                            [default_row_labels.get(row_id, row_id) for row_id in row_order],
+                            order_rows(row_ids, MSA_matrix, row_order))
+        return (MSA_in, info, MSA_aln)
+
+    # fetch the MSA fields only carried over to output MSAs, once there is output to save
+    def get_MSA_carry_over(self, ws, infos):
+        try:
+            objects = ws.get_objects2({'objects': [{'ref': str(info[6])+'/'+str(info[0])+'/'+str(info[4]),
+                                                    'included': ['/'+field for field in self.MSA_carry_over_fields]}
+                                                   for info in infos]})['data']
+        except Exception as e:
+            raise ValueError('Unable to fetch input MSA metadata from workspace: ' + str(e))
+        return [obj['data'] for obj in objects]
+
+    # bytes received by all clients so far, and the time
+    def fetch_stats(self):
+        return (session_pool_stats()['bytes_received'], time.time())
+
+    def log_fetch_stats(self, console, what, fetch_start):
+        (bytes_start, time_start) = fetch_start
+        self.log(console, what+': '+str(session_pool_stats()['bytes_received'] - bytes_start)+' bytes in '
+                 +'%.2f' % (time.time() - time_start)+' sec, peak RSS '
+                 +str(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024)+' MB')
+
+    # per-column residue counts of an MSA version, counted from MSA_aln once and then read from
+    # the column count cache, with the residues in its first sequence.  Returns (counts, symbols,
+    # L_first_seq), or None if they aren't cached and there's no MSA_aln to count.  MSA_stats are
+    # MSA_aln's AlignmentStats, if already known
+    def get_column_counts(self, info, MSA_aln=None, console=None, MSA_stats=None):
+        column_count_key = None
+        if self.column_count_cache is not None and info is not None:
+            column_count_key = self.column_count_cache.make_key(info)
+            cached_counts = self.column_count_cache.get(column_count_key)
+            if cached_counts is not None:
+                self.log(console, 'USING CACHED COLUMN COUNTS for '+versioned_ref(info))
+                bytes_saved = MSA_aln.matrix.nbytes if MSA_aln is not None else 0
+                self.log_cache_stats(console, 'column count cache',
+                                     self.column_count_cache.record(True, bytes_saved), 'MSA bytes not re-counted')
+                return cached_counts
+        if MSA_aln is None:
+            return None
+
+        if MSA_stats is None:
+            MSA_stats = AlignmentStats.from_alignment(MSA_aln)
+        (counts, symbols) = column_counts(MSA_aln.matrix, MSA_stats.char_counts)
+        if column_count_key is not None:
+            self.column_count_cache.put(column_count_key, counts, symbols, MSA_stats.L_first_seq)
+            self.log_cache_stats(console, 'column count cache', self.column_count_cache.record(False),
+                                 'MSA bytes not re-counted')
+        return (counts, symbols, MSA_stats.L_first_seq)
+
+    def log_cache_stats(self, console, cache_name, cache_stats, saved_what):
+        cache_lookups = cache_stats['hits'] + cache_stats['misses']
+        self.log(console, cache_name+': '+str(cache_stats['hits'])+'/'+str(cache_lookups)+' hits ('
+                 +str(int(round(100.0*cache_stats['hits']/max(cache_lookups, 1))))+'%), '
+                 +str(cache_stats['bytes_saved'])+' '+saved_what)
+
+    # alignment_row_ids are the alignment keys, for MSA data decoded without its alignment
+    def parse_MSA_object(self, data, info, alignment_row_ids=None):
+        input_type_name = info[2].split('.')[1].split('-')[0]
+        if input_type_name != 'MSA':
+            raise ValueError('Cannot yet handle input_ref type of: '+input_type_name)
+
+        MSA_in = data
+        if alignment_row_ids is None:
+            alignment_row_ids = MSA_in['alignment'].keys()
+        if 'row_order' in MSA_in.keys():
+            row_order = MSA_in['row_order']
+        else:
+            row_order = sorted(alignment_row_ids)
+
+        default_row_labels = dict()
+        if 'default_row_labels' in MSA_in.keys():
+            default_row_labels = MSA_in['default_row_labels']
+        else:
+            for row_id in row_order:
+                default_row_labels[row_id] = row_id
+
+        return (MSA_in, info, row_order, default_row_labels)
+
+    # Determine whether DNA, RNA, protein or codon sequences, with residue counts
+    # (taken from MSA_stats if given, rather than counted again)
+    def get_MSA_alphabet(self, MSA_in, MSA_aln, console=None, MSA_stats=None):
+        counts = None
+        if MSA_stats is not None:
+            counts = MSA_stats.char_counts
+        alphabet = classify_alphabet(MSA_aln.matrix, MSA_in.get('sequence_type'), counts)
+        self.log(console, 'alphabet: '+format_alphabet(alphabet))
+        return alphabet
+
+    # load the method provenance from the context object
+    def get_provenance(self, ctx, input_refs, method):
+        provenance = [{}]
+        if 'provenance' in ctx:
+            provenance = ctx['provenance']
+        # add additional info to provenance here, in this case the input data object reference
+        provenance[0]['input_ws_objects'] = list(input_refs)
+        provenance[0]['service'] = 'kb_gblocks'
+        provenance[0]['method'] = method
+        return provenance
+
+    # output MSA carries over the input MSA's other fields (labels, ws_refs, etc.)
+    def build_MSA_out(self, MSA_in, MSA_carry_over, alignment, L_alignment, output_name, desc=None):
+        MSA_out = dict()
+        for MSA_fields in [MSA_carry_over, MSA_in]:
+            for key in MSA_fields.keys():
+                MSA_out[key] = MSA_fields[key]
+        MSA_out['alignment'] = alignment
+        MSA_out['name'] = output_name
+        MSA_out['alignment_length'] = L_alignment
+        if desc != None and desc != '':
+            MSA_out['desc'] = desc
+        return MSA_out
+
+    # run one MSA through the selected engine.  The binary needs MSA_aln written to
+    # input_MSA_file_path and leaves its "-gb" output next to it; the native engine trims
+    # in memory and only writes output_GBLOCKS_file_path for upload (None to skip).
+    # returns (trimmed Alignment, block map)
+    def run_gblocks_engine(self, engine, params, MSA_aln, alphabet,
+                           input_MSA_file_path, output_GBLOCKS_file_path, console, info=None, MSA_stats=None):
+
+        # Run the native engine in-process on the MSA matrix
+        #
+        if engine == 'native':
+            self.log(console, 'RUNNING NATIVE GBLOCKS ENGINE:')
+            N_seqs = MSA_aln.N
+            gblocks_params = resolve_params(params, N_seqs)
+            self.log(console, '    '+' '.join([k+'='+str(gblocks_params[k]) for k in sorted(gblocks_params.keys())]))
+
+            (counts, symbols, L_first_seq) = self.get_column_counts(info, MSA_aln, console, MSA_stats)
+            keep, blocks = select_blocks(counts, symbols, N_seqs, **gblocks_params)
+            L_kept = int(keep.sum())
+            L_orig = MSA_aln.L
+            self.log(console, 'Flanks: '+format_flanks(blocks))
+            self.log(console, 'New number of positions: '+str(L_kept)+' ('+str(int(round(100.0*L_kept/max(L_orig,1))))+'% of the original '+str(L_orig)+' positions)')
+
+            trimmed_aln = MSA_aln.select_columns(keep)
+            # same layout as the binary's "-gb" output, so the uploaded file doesn't depend on the engine
+            if output_GBLOCKS_file_path is not None:
+                write_gb_fasta(output_GBLOCKS_file_path, trimmed_aln.row_ids, trimmed_aln.matrix)
+            return (trimmed_aln, blocks)
+
+        # Run the Gblocks binary
+        #
+        else:
+            # export to FASTA file
+            self.log(console, 'writing fasta file: '+input_MSA_file_path)
+            MSA_aln.write_fasta(input_MSA_file_path)
+
+            ### Construct the command
+            #
+            #  e.g. Gblocks <MSA_file> -t=p -b5=h -b3=8 -b4=10
+            #
+            gblocks_cmd = build_gblocks_cmd(self.GBLOCKS_bin, input_MSA_file_path, params, alphabet['gblocks_type'])
+
+            # check for necessary files
+            if not os.path.isfile(self.GBLOCKS_bin):
+                raise ValueError("no such file '"+self.GBLOCKS_bin+"'")
+            if not os.path.isfile(input_MSA_file_path):
+                raise ValueError("no such file '"+input_MSA_file_path+"'")
+            if not os.path.getsize(input_MSA_file_path) > 0:
+                raise ValueError("empty file '"+input_MSA_file_path+"'")
+
+
+            # Run GBLOCKS, capture output as it happens
+            #
+            self.log(console, 'RUNNING GBLOCKS:')
+            self.log(console, '    '+' '.join(gblocks_cmd))
+
+            # all options are on the command line, so no shell and nothing on stdin.
+            # stdout and stderr are drained while Gblocks runs so it can't stall on a full pipe
+            env = os.environ.copy()
+            gblocks_returncode, gblocks_log = run_streaming(gblocks_cmd,
+                                                            cwd = self.scratch,
+                                                            env = env,
+                                                            timeout = self.GBLOCKS_timeout,
+                                                            log_fn = lambda line: self.log(None, line),
+                                                            max_log_lines = self.GBLOCKS_max_log_lines)
+            console.extend(gblocks_log)
+            self.log(console, 'return code: ' + str(gblocks_returncode))
+#            if gblocks_returncode != 0:
+            if gblocks_returncode != 1:
+                raise ValueError('Error running GBLOCKS, return code: '+str(gblocks_returncode) + 
+                    '\n\n'+ '\n'.join(console))
+
+            # Check that GBLOCKS produced output.  It names it by appending "-gb" to the input file
+            #
+            gblocks_output_file_path = input_MSA_file_path+'-gb'
+            if not os.path.isfile(gblocks_output_file_path):
+                raise ValueError("failed to create GBLOCKS output: "+gblocks_output_file_path)
+            elif not os.path.getsize(gblocks_output_file_path) > 0:
+                raise ValueError("created empty file for GBLOCKS output: "+gblocks_output_file_path)
+
+            return (self.read_gblocks_output(gblocks_output_file_path, MSA_aln),
+                    read_gblocks_flanks(gblocks_output_file_path+'.htm'))
+
+    # upload output files to SHOCK with a single callback job, however many there are.
+    #   artifacts are {'file_path', 'name', 'label'}.  The job is only submitted here, so the
+    #   caller can do other work while it runs; wait_artifact_upload() returns the report file_links
+    def submit_artifact_upload(self, artifacts, console):
+        artifact_sizes = [os.path.getsize(artifact['file_path']) for artifact in artifacts]
+        dfu = DFUClient(self.callbackURL)
+        upload_start = time.time()
+        try:
+            upload_job = submit_job(dfu, 'DataFileUtil.file_to_shock_mass',
+                                    [{'file_path': artifact['file_path'],
+                                      'make_handle': 0} for artifact in artifacts])
+        except Exception as e:
+            raise ValueError ('error loading output files to shock: '+str(e))
+        self.log(console, 'uploading '+str(len(artifacts))+' files ('+str(sum(artifact_sizes))+' bytes) in one job')
+        return {'artifacts': artifacts, 'artifact_sizes': artifact_sizes,
+                'job': upload_job, 'upload_start': upload_start}
+
+    def wait_artifact_upload(self, artifact_upload, console):
+        try:
+            upload_rets = wait_all([artifact_upload['job']])[0]
+        except Exception as e:
+            raise ValueError ('error loading output files to shock: '+str(e))
+        upload_time = time.time() - artifact_upload['upload_start']
+
+        file_links = []
+        for artifact, artifact_size, upload_ret in zip(artifact_upload['artifacts'],
+                                                       artifact_upload['artifact_sizes'], upload_rets):
+            self.log(console, 'uploaded '+artifact['name']+': '+str(artifact_size)+' bytes (shock_id '+upload_ret['shock_id']+')')
+            file_links.append({'shock_id': upload_ret['shock_id'],
+                               'name': artifact['name'],
+                               'label': artifact['label']})
+        self.log(console, 'uploaded '+str(len(file_links))+' files ('+str(sum(artifact_upload['artifact_sizes']))+' bytes) in '
+                 +'%.2f' % upload_time+' sec from submission')
+        return file_links
+
+    # read the trimmed MSA from a Gblocks "-gb" file.  Rows keep the labels of MSA_aln
+    def read_gblocks_output(self, output_GBLOCKS_file_path, MSA_aln):
+        (id_order, trimmed_matrix) = read_gb_fasta(output_GBLOCKS_file_path, n_rows_hint=MSA_aln.N)
+        label_by_id = dict(zip(MSA_aln.row_ids, MSA_aln.labels))
+        return Alignment(id_order, [label_by_id.get(row_id, row_id) for row_id in id_order], trimmed_matrix)
+
+    # trim one MSA of a batch, from its get_objects2 data and info.  Failures are returned, not
+    # raised, so one bad MSA doesn't sink the batch.  Returns {'MSA_in', 'N_seqs', 'L_in'} (None
+    # where not known) with either 'alignment' or 'error'
+    def trim_batch_MSA(self, batch_job):
+        (batch_i, data, info, params, engine, engine_requested, batch_dir) = batch_job
+        console = []
+        batch_result = {'MSA_in': data, 'N_seqs': None, 'L_in': None}
+        if 'alignment_length' in data:
+            batch_result['L_in'] = data['alignment_length']
+        try:
+            if 'alignment' not in data:
+                raise ValueError("MSA has no alignment")
+            (MSA_in, info, row_order, default_row_labels) = self.parse_MSA_object(data, info)
+            batch_result['N_seqs'] = len(row_order)
+            if len(row_order) < 2:
+                batch_result['error'] = "must have multiple records in MSA"
+                return batch_result
+            MSA_aln = Alignment.from_MSA(MSA_in, row_order, default_row_labels)
+            if batch_result['L_in'] is None:
+                batch_result['L_in'] = MSA_aln.L
+
+            # the same checks as run_Gblocks, against this MSA's first sequence
+            MSA_stats = AlignmentStats.from_alignment(MSA_aln, MSA_in.get('alignment_length'))
+            invalid_msgs = []
+            engine = self.validate_Gblocks_params(params, MSA_stats.N, MSA_stats.L_first_seq, engine, engine_requested,
+                                                  invalid_msgs, console)
+            if len(invalid_msgs) > 0:
+                batch_result['error'] = ' '.join([msg.rstrip("\n") for msg in invalid_msgs])
+                return batch_result
+
+            input_MSA_file_path = os.path.join(batch_dir, str(batch_i)+'.'+info[1]+".fasta")
+            alphabet = self.get_MSA_alphabet(MSA_in, MSA_aln, console, MSA_stats)
+            # batch outputs are only saved as MSA objects, so there's no "-gb" file to upload
+            trimmed_aln = self.run_gblocks_engine(engine, params, MSA_aln, alphabet,
+                                                  input_MSA_file_path, None, console, info, MSA_stats)[0]
+        except Exception as e:
+            batch_result['error'] = str(e)
+            return batch_result
+        if trimmed_aln.L == 0:
+            batch_result['error'] = "params produced no blocks.  Consider changing to less stringent values"
+            return batch_result
+        batch_result['alignment'] = trimmed_aln
+        return batch_result
+
     #END_CLASS_HEADER
 
     # config contains contents of config file in a hash or None if it couldn't
@@ -91,6 +597,39 @@ class kb_gblocks:
         if not os.path.exists(self.scratch):
             os.makedirs(self.scratch)
 
+        # keep-alive connections per host shared by the Workspace, DataFileUtil and KBaseReport clients
+        if config.get('client-http-pool-size'):
+            configure_session_pool(int(config['client-http-pool-size']))
+
+        # gzip request bodies for these methods, e.g. "Workspace.save_objects" for large output MSAs
+        if config.get('client-compress-methods'):
+            configure_request_compression([method.strip() for method in config['client-compress-methods'].split(',')],
+                                          int(config.get('client-compress-level') or 6))
+
+        if config.get('gblocks-timeout'):
+            self.GBLOCKS_timeout = int(config['gblocks-timeout'])
+
+        if config.get('result-cache-max-bytes'):
+            self.result_cache_max_bytes = int(config['result-cache-max-bytes'])
+        self.result_cache = None
+        if self.result_cache_max_bytes > 0:
+            result_cache_dir = config.get('result-cache-dir') or os.path.join(self.scratch, 'gblocks_result_cache')
+            self.result_cache = ResultCache(result_cache_dir, self.result_cache_max_bytes)
+
+        if config.get('object-cache-max-bytes'):
+            self.object_cache_max_bytes = int(config['object-cache-max-bytes'])
+        self.object_cache = None
+        if self.object_cache_max_bytes > 0:
+            object_cache_dir = config.get('object-cache-dir') or os.path.join(self.scratch, 'ws_object_cache')
+            self.object_cache = ObjectCache(object_cache_dir, self.object_cache_max_bytes)
+
+        if config.get('column-count-cache-max-bytes'):
+            self.column_count_cache_max_bytes = int(config['column-count-cache-max-bytes'])
+        self.column_count_cache = None
+        if self.column_count_cache_max_bytes > 0:
+            column_count_cache_dir = config.get('column-count-cache-dir') or os.path.join(self.scratch, 'gblocks_column_counts')
+            self.column_count_cache = ColumnCountCache(column_count_cache_dir, self.column_count_cache_max_bytes)
+
         #END_CONSTRUCTOR
         pass
 
@@ -115,7 +654,8 @@ class kb_gblocks:
            parameter "trim_level" of Long, parameter "min_seqs_for_conserved"
            of Long, parameter "min_seqs_for_flank" of Long, parameter
            "max_pos_contig_nonconserved" of Long, parameter "min_block_len"
-           of Long, parameter "remove_mask_positions_flag" of Long
+           of Long, parameter "remove_mask_positions_flag" of Long,
+           parameter "engine" of String
         :returns: instance of type "Gblocks_Output" (Gblocks Output) ->
            structure: parameter "report_name" of type "data_obj_name",
            parameter "report_ref" of type "data_obj_ref"
@@ -141,70 +681,40 @@ class kb_gblocks:
         if 'output_name' not in params:
             raise ValueError('output_name parameter is required')
 
+        engine = 'binary'
+        engine_requested = False
+        if 'engine' in params and params['engine'] != None and params['engine'] != '':
+            engine = params['engine']
+            engine_requested = True
+        if engine not in self.GBLOCKS_engines:
+            raise ValueError('engine must be one of '+', '.join(self.GBLOCKS_engines)+": '"+str(engine)+"'")
 
-        #### Get the input_ref MSA object
+
+        #### Pre-flight: check params against the MSA's size before downloading it
         ##
-        try:
-            ws = workspaceService(self.workspaceURL, token=ctx['token'])
-            objects = ws.get_objects([{'ref': params['input_ref']}])
-            data = objects[0]['data']
-            info = objects[0]['info']
-            input_name = info[1]
-            input_type_name = info[2].split('.')[1].split('-')[0]
+        ws = workspaceService(self.workspaceURL, token=ctx['token'])
+        (info, input_versioned_ref, N_seqs, L_alignment) = self.get_MSA_preflight(ws, params['input_ref'], console)
+        engine = self.validate_Gblocks_params(params, N_seqs, L_alignment, engine, engine_requested,
+                                              invalid_msgs, console, L_name='alignment length')
+        if len(invalid_msgs) > 0:
+            return [self.save_invalid_report(ctx, ws, params, 'run_Gblocks', report, invalid_msgs, console)]
 
-        except Exception as e:
-            raise ValueError('Unable to fetch input_ref object from workspace: ' + str(e))
-            #to get the full stack trace: traceback.format_exc()
-
-        if input_type_name == 'MSA':
-            MSA_in = data
-            row_order = []
-            default_row_labels = dict()
-            if 'row_order' in MSA_in.keys():
-                row_order = MSA_in['row_order']
-            else:
-                row_order = sorted(MSA_in['alignment'].keys())
 
-            if 'default_row_labels' in MSA_in.keys():
-                default_row_labels = MSA_in['default_row_labels']
-            else:
-                for row_id in row_order:
-                    default_row_labels[row_id] = row_id
-            if len(row_order) < 2:
-                self.log(invalid_msgs,"must have multiple records in MSA: "+params['input_ref'])
+        #### Get the input_ref MSA object
+        ##
+        (MSA_in, info, MSA_aln) = self.get_input_MSA(ws, input_versioned_ref, console, n_rows_hint=N_seqs or 0, info=info)
+        input_name = info[1]
 
-            # export features to FASTA file
-            input_MSA_file_path = os.path.join(self.scratch, input_name+".fasta")
-            self.log(console, 'writing fasta file: '+input_MSA_file_path)
-            records = []
-            for row_id in row_order:
-                #self.log(console,"row_id: '"+row_id+"'")  # DEBUG
-                #self.log(console,"alignment: '"+MSA_in['alignment'][row_id]+"'")  # DEBUG
-            # using SeqIO makes multiline sequences.  (Gblocks doesn't care, but FastTree doesn't like multiline, and I don't care enough to change code)
-                #record = SeqRecord(Seq(MSA_in['alignment'][row_id]), id=row_id, description=default_row_labels[row_id])
-                #records.append(record)
-            #SeqIO.write(records, input_MSA_file_path, "fasta")
-                records.extend(['>'+row_id,
-                                MSA_in['alignment'][row_id]
-                               ])
-            with open(input_MSA_file_path,'w',0) as input_MSA_file_handle:
-                input_MSA_file_handle.write("\n".join(records)+"\n")
-
-
-            # Determine whether nuc or protein sequences
-            #
-            NUC_MSA_pattern = re.compile("^[\.\-_ACGTUXNRYSWKMBDHVacgtuxnryswkmbdhv \t\n]+$")
-            all_seqs_nuc = True
-            for row_id in row_order:
-                #self.log(console, row_id+": '"+MSA_in['alignment'][row_id]+"'")
-                if NUC_MSA_pattern.match(MSA_in['alignment'][row_id]) == None:
-                    all_seqs_nuc = False
-                    break
+        # the binary engine exports to this FASTA file
+        input_MSA_file_path = os.path.join(self.scratch, input_name+".fasta")
 
-        # Missing proper input_type
+        # Shape and residue counts in one pass over the matrix, for validation and the alphabet
         #
-        else:
-            raise ValueError('Cannot yet handle input_ref type of: '+type_name)
+        MSA_stats = AlignmentStats.from_alignment(MSA_aln, MSA_in.get('alignment_length'))
+
+        # Determine whether nuc or protein sequences
+        #
+        alphabet = self.get_MSA_alphabet(MSA_in, MSA_aln, console, MSA_stats)
 
 
         # DEBUG: check the MSA file contents
@@ -214,118 +724,18 @@ class kb_gblocks:
 #                self.log(invalid_msgs,"MSA_LINE: '"+line+"'")
 
 
-        # validate input data
+        # validate input data.  N and L first seq are only known now (row_order is optional)
         #
-        N_seqs = 0
-        L_first_seq = 0
-        with open(input_MSA_file_path, 'r', 0) as input_MSA_file_handle:
-            for line in input_MSA_file_handle:
-                if line.startswith('>'):
-                    N_seqs += 1
-                    continue
-                if L_first_seq == 0:
-                    for c in line:
-                        if c != '-' and c != ' ' and c != "\n":
-                            L_first_seq += 1
-        # min_seqs_for_conserved
-        if 'min_seqs_for_conserved' in params and params['min_seqs_for_conserved'] != None and int(params['min_seqs_for_conserved']) != 0:
-            if int(params['min_seqs_for_conserved']) < int(0.5*N_seqs)+1:
-                self.log(invalid_msgs,"Min Seqs for Conserved Pos ("+str(params['min_seqs_for_conserved'])+") must be >= N/2+1 (N="+str(N_seqs)+", N/2+1="+str(int(0.5*N_seqs)+1)+")\n")
-            if int(params['min_seqs_for_conserved']) > int(params['min_seqs_for_flank']):
-                self.log(invalid_msgs,"Min Seqs for Conserved Pos ("+str(params['min_seqs_for_conserved'])+") must be <= Min Seqs for Flank Pos ("+str(params['min_seqs_for_flank'])+")\n")
-
-        # min_seqs_for_flank
-        if 'min_seqs_for_flank' in params and params['min_seqs_for_flank'] != None and int(params['min_seqs_for_flank']) != 0:
-            if int(params['min_seqs_for_flank']) > N_seqs:
-                self.log(invalid_msgs,"Min Seqs for Flank Pos ("+str(params['min_seqs_for_flank'])+") must be <= N (N="+str(N_seqs)+")\n")
-
-        # max_pos_contig_nonconserved
-        if 'max_pos_contig_nonconserved' in params and params['max_pos_contig_nonconserved'] != None and int(params['max_pos_contig_nonconserved']) != 0:
-            if int(params['max_pos_contig_nonconserved']) < 0:
-                self.log(invalid_msgs,"Max Num Non-Conserved Pos ("+str(params['max_pos_contig_nonconserved'])+") must be >= 0"+"\n")
-            if int(params['max_pos_contig_nonconserved']) > L_first_seq or int(params['max_pos_contig_nonconserved']) >= 32000:
-                self.log(invalid_msgs,"Max Num Non-Conserved Pos ("+str(params['max_pos_contig_nonconserved'])+") must be <= L first seq ("+str(L_first_seq)+") and < 32000\n")
-
-        # min_block_len
-        if 'min_block_len' in params and params['min_block_len'] != None and int(params['min_block_len']) != 0:
-            if int(params['min_block_len']) < 2:
-                self.log(invalid_msgs,"Min Block Len ("+str(params['min_block_len'])+") must be >= 2"+"\n")
-            if int(params['min_block_len']) > L_first_seq or int(params['min_block_len']) >= 32000:
-                self.log(invalid_msgs,"Min Block Len ("+str(params['min_block_len'])+") must be <= L first seq ("+str(L_first_seq)+") and < 32000\n")
-
-        # trim_level
-        if 'trim_level' in params and params['trim_level'] != None and int(params['trim_level']) != 0:
-            if int(params['trim_level']) < 0 or int(params['trim_level']) > 2:
-                self.log(invalid_msgs,"Trim Level ("+str(params['trim_level'])+") must be >= 0 and <= 2"+"\n")
-
-
+        self.log(console, 'N='+str(MSA_stats.N)+', L='+str(MSA_stats.L)+', L first seq='+str(MSA_stats.L_first_seq)
+                 +', default Min Seqs for Conserved Pos='+str(MSA_stats.default_b1)
+                 +', default Min Seqs for Flank Pos='+str(MSA_stats.default_b2))
+        if not MSA_stats.rectangular:
+            self.log(console, "WARNING: alignment_length ("+str(MSA_stats.declared_L)+") is not the length of the alignment rows ("
+                     +str(MSA_stats.L)+"), using "+str(MSA_stats.L))
+        engine = self.validate_Gblocks_params(params, MSA_stats.N, MSA_stats.L_first_seq, engine, engine_requested,
+                                              invalid_msgs, console)
         if len(invalid_msgs) > 0:
-
-            # load the method provenance from the context object
-            self.log(console,"SETTING PROVENANCE")  # DEBUG
-            provenance = [{}]
-            if 'provenance' in ctx:
-                provenance = ctx['provenance']
-            # add additional info to provenance here, in this case the input data object reference
-            provenance[0]['input_ws_objects'] = []
-            provenance[0]['input_ws_objects'].append(params['input_ref'])
-            provenance[0]['service'] = 'kb_gblocks'
-            provenance[0]['method'] = 'run_Gblocks'
-
-            # report
-            report += "FAILURE\n\n"+"\n".join(invalid_msgs)+"\n"
-            reportObj = {
-                'objects_created':[],
-                'text_message':report
-                }
-
-            reportName = 'gblocks_report_'+str(uuid.uuid4())
-            report_obj_info = ws.save_objects({
-#                'id':info[6],
-                'workspace':params['workspace_name'],
-                'objects':[
-                    {
-                        'type':'KBaseReport.Report',
-                        'data':reportObj,
-                        'name':reportName,
-                        'meta':{},
-                        'hidden':1,
-                        'provenance':provenance
-                    }
-                ]
-            })[0]
-
-
-            self.log(console,"BUILDING RETURN OBJECT")
-            returnVal = { 'report_name': reportName,
-                          'report_ref': str(report_obj_info[6]) + '/' + str(report_obj_info[0]) + '/' + str(report_obj_info[4])
-#                          'output_ref': None
-                          }
-            self.log(console,"run_Gblocks DONE")
-            return [returnVal]
-
-
-        ### Construct the command
-        #
-        #  e.g.
-        #  for "0.5" gaps: cat "o\n<MSA_file>\nb\n5\ng\nm\nq\n" | Gblocks
-        #  for "all" gaps: cat "o\n<MSA_file>\nb\n5\n5\ng\nm\nq\n" | Gblocks
-        #
-        gblocks_cmd = [self.GBLOCKS_bin]
-
-        # check for necessary files
-        if not os.path.isfile(self.GBLOCKS_bin):
-            raise ValueError("no such file '"+self.GBLOCKS_bin+"'")
-        if not os.path.isfile(input_MSA_file_path):
-            raise ValueError("no such file '"+input_MSA_file_path+"'")
-        if not os.path.getsize(input_MSA_file_path) > 0:
-            raise ValueError("empty file '"+input_MSA_file_path+"'")
-
-        # DEBUG
-#        with open(input_MSA_file_path,'r',0) as input_MSA_file_handle:
-#            for line in input_MSA_file_handle:
-#                #self.log(console,"MSA LINE: '"+line+"'")  # too big for console
-#                self.log(invalid_msgs,"MSA LINE: '"+line+"'")
+            return [self.save_invalid_report(ctx, ws, params, 'run_Gblocks', report, invalid_msgs, console)]
 
 
         # set the output path
@@ -339,178 +749,58 @@ class kb_gblocks:
         output_GBLOCKS_file_path = input_MSA_file_path+'-gb'
         output_aln_file_path = output_GBLOCKS_file_path
 
-        # Gblocks is interactive and only accepts args from pipe input
-        #if 'arg' in params and params['arg'] != None and params['arg'] != 0:
-        #    fasttree_cmd.append('-arg')
-        #    fasttree_cmd.append(val)
-
-
-        # Run GBLOCKS, capture output as it happens
-        #
-        self.log(console, 'RUNNING GBLOCKS:')
-        self.log(console, '    '+' '.join(gblocks_cmd))
-#        report += "\n"+'running GBLOCKS:'+"\n"
-#        report += '    '+' '.join(gblocks_cmd)+"\n"
-
-        # FastTree requires shell=True in order to see input data
-        env = os.environ.copy()
-        #joined_fasttree_cmd = ' '.join(fasttree_cmd)  # redirect out doesn't work with subprocess unless you join command first
-        #p = subprocess.Popen([joined_fasttree_cmd], \
-        p = subprocess.Popen(gblocks_cmd, \
-                             cwd = self.scratch, \
-                             stdin = subprocess.PIPE, \
-                             stdout = subprocess.PIPE, \
-                             stderr = subprocess.PIPE, \
-                             shell = True, \
-                             env = env)
-#                             executable = '/bin/bash' )
-
-        
-        # write commands to process
-        #
-        #  for "0.5" gaps: cat "o\n<MSA_file>\nb\n5\ng\nm\nq\n" | Gblocks
-        #  for "all" gaps: cat "o\n<MSA_file>\nb\n5\n5\ng\nm\nq\n" | Gblocks
-
-        p.stdin.write("o"+"\n")  # open MSA file
-        p.stdin.write(input_MSA_file_path+"\n")
-
-        if 'trim_level' in params and params['trim_level'] != None and int(params['trim_level']) != 0:
-            p.stdin.write("b"+"\n")
-            if int(params['trim_level']) >= 1:
-                self.log (console,"changing trim level")
-                p.stdin.write("5"+"\n")  # set to "half"
-                if int(params['trim_level']) == 2:
-                    self.log (console,"changing trim level")
-                    p.stdin.write("5"+"\n")  # set to "all"
-                elif int(params['trim_level']) > 2:
-                    raise ValueError ("trim_level ("+str(params['trim_level'])+") was not between 0-2")
-                p.stdin.write("m"+"\n")
-
-        # flank must precede conserved because it acts us upper bound for acceptable conserved values
-        if 'min_seqs_for_flank' in params and params['min_seqs_for_flank'] != None and int(params['min_seqs_for_flank']) != 0:
-            self.log (console,"changing min_seqs_for_flank")
-            p.stdin.write("b"+"\n")
-            p.stdin.write("2"+"\n")
-            p.stdin.write(str(params['min_seqs_for_flank'])+"\n")
-            p.stdin.write("m"+"\n")
-
-        if 'min_seqs_for_conserved' in params and params['min_seqs_for_conserved'] != None and int(params['min_seqs_for_conserved']) != 0:
-            self.log (console,"changing min_seqs_for_conserved")
-            p.stdin.write("b"+"\n")
-            p.stdin.write("1"+"\n")
-            p.stdin.write(str(params['min_seqs_for_conserved'])+"\n")
-            p.stdin.write("m"+"\n")
-
-        if 'max_pos_contig_nonconserved' in params and params['max_pos_contig_nonconserved'] != None and int(params['max_pos_contig_nonconserved']) > -1:
-            self.log (console,"changing max_pos_contig_nonconserved")
-            p.stdin.write("b"+"\n")
-            p.stdin.write("3"+"\n")
-            p.stdin.write(str(params['max_pos_contig_nonconserved'])+"\n")
-            p.stdin.write("m"+"\n")
-
-        if 'min_block_len' in params and params['min_block_len'] != None and params['min_block_len'] != 0:
-            self.log (console,"changing min_block_len")
-            p.stdin.write("b"+"\n")
-            p.stdin.write("4"+"\n")
-            p.stdin.write(str(params['min_block_len'])+"\n")
-            p.stdin.write("m"+"\n")
-        
-        p.stdin.write("g"+"\n")  # get blocks
-        p.stdin.write("q"+"\n")  # quit
-        p.stdin.close()
-        p.wait()
-
 
-        # Read output
+        # Run Gblocks, unless this MSA version has already been trimmed with these params
         #
-        while True:
-            line = p.stdout.readline()
-            #line = p.stderr.readline()
-            if not line: break
-            self.log(console, line.replace('\n', ''))
-
-        p.stdout.close()
-        #p.stderr.close()
-        p.wait()
-        self.log(console, 'return code: ' + str(p.returncode))
-#        if p.returncode != 0:
-        if p.returncode != 1:
-            raise ValueError('Error running GBLOCKS, return code: '+str(p.returncode) + 
-                '\n\n'+ '\n'.join(console))
-
-        # Check that GBLOCKS produced output
-        #
-        if not os.path.isfile(output_GBLOCKS_file_path):
-            raise ValueError("failed to create GBLOCKS output: "+output_GBLOCKS_file_path)
-        elif not os.path.getsize(output_GBLOCKS_file_path) > 0:
-            raise ValueError("created empty file for GBLOCKS output: "+output_GBLOCKS_file_path)
+        result_cache_key = None
+        cached_result = None
+        if self.result_cache is not None:
+            result_cache_key = self.result_cache.make_key(info, params, engine)
+            cached_result = self.result_cache.get(result_cache_key)
+
+        if cached_result is not None:
+            self.log(console, 'USING CACHED GBLOCKS RESULT for '+params['input_ref']+' (key '+result_cache_key+')')
+            self.log(console, 'Flanks: '+format_flanks(cached_result['blocks']))
+            write_gb_fasta(output_GBLOCKS_file_path, cached_result['row_ids'], cached_result['matrix'])
+            label_by_id = dict(zip(MSA_aln.row_ids, MSA_aln.labels))
+            trimmed_aln = Alignment(cached_result['row_ids'],
+                                    [label_by_id.get(row_id, row_id) for row_id in cached_result['row_ids']],
+                                    cached_result['matrix'])
+            bytes_saved = MSA_aln.matrix.nbytes
+            cache_stats = self.result_cache.record(True, bytes_saved)
+        else:
+            (trimmed_aln, gblocks_blocks) = self.run_gblocks_engine(engine, params, MSA_aln, alphabet,
+                                                                    input_MSA_file_path, output_GBLOCKS_file_path,
+                                                                    console, info, MSA_stats)
+            if self.result_cache is not None:
+                cache_stats = self.result_cache.record(False)
+        if self.result_cache is not None:
+            self.log_cache_stats(console, 'result cache', cache_stats, 'input bytes not re-trimmed')
 
 
         # load the method provenance from the context object
         #
         self.log(console,"SETTING PROVENANCE")  # DEBUG
-        provenance = [{}]
-        if 'provenance' in ctx:
-            provenance = ctx['provenance']
-        # add additional info to provenance here, in this case the input data object reference
-        provenance[0]['input_ws_objects'] = []
-        provenance[0]['input_ws_objects'].append(params['input_ref'])
-        provenance[0]['service'] = 'kb_gblocks'
-        provenance[0]['method'] = 'run_Gblocks'
+        provenance = self.get_provenance(ctx, [params['input_ref']], 'run_Gblocks')
 
 
         # reformat output to single-line FASTA MSA and check that output not empty (often happens when param combinations don't produce viable blocks
         #
-        output_fasta_buf = []
-        id_order = []
-        this_id = None
-        ids = dict()
-        alignment = dict()
-        L_alignment = 0;
-        L_alignment_set = False
-        with open(output_GBLOCKS_file_path,'r',0) as output_GBLOCKS_file_handle:
-            for line in output_GBLOCKS_file_handle:
-                line = line.rstrip()
-                if line.startswith('>'):
-                    this_id = line[1:]
-                    output_fasta_buf.append ('>'+re.sub('\s','_',default_row_labels[this_id]))
-                    id_order.append(this_id)
-                    alignment[this_id] = ''
-                    if L_alignment != 0 and not L_alignment_set:
-                         L_alignment_set = True
-                    continue
-                output_fasta_buf.append (line)
-                for c in line:
-                    if c != ' ' and c != "\n":
-                        alignment[this_id] += c
-                        if not L_alignment_set:
-                            L_alignment += 1
-        if L_alignment == 0:
+        if cached_result is None and result_cache_key is not None:
+            self.result_cache.put(result_cache_key, trimmed_aln.row_ids, trimmed_aln.matrix, gblocks_blocks)
+        if trimmed_aln.L == 0:
             self.log(invalid_msgs,"params produced no blocks.  Consider changing to less stringent values")
         else:
-            if 'remove_mask_positions_flag' in params and params['remove_mask_positions_flag'] != None and params['remove_mask_positions_flag'] != '' and params['remove_mask_positions_flag'] == 1:
+            if 'remove_mask_positions_flag' in params and params['remove_mask_positions_flag'] != None and params['remove_mask_positions_flag'] != '' and int(params['remove_mask_positions_flag']) == 1:
                 self.log (console,"removing mask positions")
-                mask = []
-                new_alignment = dict()
-                for i in range(0,L_alignment):
-                    mask[i] = '+'
-                    if alignment[id_order[0]][i] == '-' \
-                        or alignment[id_order[0]][i] == 'X' \
-                        or alignment[id_order[0]][i] == 'x':
-                        mask[i] = '-'
-                for row_id in id_order:
-                    new_alignment[row_id] = ''
-                    for i,c in enumerate(alignment[row_id]):
-                         if mask[i] == '+':
-                            new_alignment[row_id] += c
-                alignment = new_alignment
-
-            L_alignment = len(alignment[id_order[0]])
+                # columns with a gap or X in the first row
+                trimmed_aln = trimmed_aln.remove_mask_positions(ref_row=0)
+                if trimmed_aln.L == 0:
+                    self.log(invalid_msgs,"no positions left after removing mask positions")
 
             # write fasta with tidied ids
             output_MSA_file_path = os.path.join(output_dir, params['output_name']+'.fasta');
-            with open(output_MSA_file_path,'w',0) as output_MSA_file_handle:
-                output_MSA_file_handle.write("\n".join(output_fasta_buf)+"\n")
+            trimmed_aln.write_fasta(output_MSA_file_path, use_labels=True)
 
 
         # Upload results
@@ -524,22 +814,39 @@ class kb_gblocks:
 #            output_MSA_buf = output_MSA_buf.rstrip()
 #            self.log(console,"\nMSA:\n"+output_MSA_buf+"\n")
         
-            # Build output_MSA structure
-            #   first extract old info from MSA (labels, ws_refs, etc.)
-            #
-            MSA_out = dict()
-            for key in MSA_in.keys():
-                 MSA_out[key] = MSA_in[key]
-
-            # then replace with new info
-            #
-            MSA_out['alignment'] = alignment
-            MSA_out['name'] = params['output_name']
-            MSA_out['alignment_length'] = alignment_length = L_alignment
             MSA_name = params['output_name']
             MSA_description = ''
             if 'desc' in params and params['desc'] != None and params['desc'] != '':
-                MSA_out['desc'] = MSA_description = params['desc']
+                MSA_description = params['desc']
+
+            # create CLW formatted output file
+            output_clw_file_path = os.path.join(output_dir, input_name+'-MSA.clw');
+            write_clw(output_clw_file_path, trimmed_aln, alphabet['is_nuc'],
+                      'CLUSTALW format of GBLOCKS trimmed MSA '+MSA_name+': '+MSA_description)
+            with open(output_clw_file_path, 'r') as output_clw_file_handle:
+                clw_buf_str = output_clw_file_handle.read()
+
+
+            # upload all output files to SHOCK for file_links in one callback job,
+            # which runs while the output MSA is saved
+            output_artifacts = [{'file_path': output_aln_file_path,
+                                 'name': params['output_name']+'-GBLOCKS.FASTA',
+                                 'label': 'GBLOCKS-trimmed MSA FASTA'},
+                                {'file_path': output_clw_file_path,
+                                 'name': params['output_name']+'-GBLOCKS.CLW',
+                                 'label': 'GBLOCKS-trimmed MSA CLUSTALW'}]
+            if engine == 'binary' and cached_result is None and os.path.isfile(output_GBLOCKS_file_path+'.htm'):
+                output_artifacts.append({'file_path': output_GBLOCKS_file_path+'.htm',
+                                         'name': params['output_name']+'-GBLOCKS.html',
+                                         'label': 'Gblocks results page'})
+            artifact_upload = self.submit_artifact_upload(output_artifacts, console)
+
+
+            # Build output_MSA structure
+            #   first extract old info from MSA (labels, ws_refs, etc.)
+            #
+            MSA_carry_over = self.get_MSA_carry_over(ws, [info])[0]
+            MSA_out = self.build_MSA_out(MSA_in, MSA_carry_over, trimmed_aln.to_alignment_dict(), trimmed_aln.L, MSA_name, MSA_description)
 
             # Store MSA_out
             #
@@ -554,155 +861,7 @@ class kb_gblocks:
                                 }]
                         })[0]
 
-
-            # create CLW formatted output file
-            max_row_width = 60
-            id_aln_gap_width = 1
-            gap_chars = ''
-            for sp_i in range(id_aln_gap_width):
-                gap_chars += ' '
-            # DNA
-            if all_seqs_nuc:
-                strong_groups = { 'AG': True,
-                                  'CTU': True
-                                  }
-                weak_groups = None
-            # PROTEINS
-            else:
-                strong_groups = { 'AST':  True,
-                                  'EKNQ': True,
-                                  'HKNQ': True,
-                                  'DENQ': True,
-                                  'HKQR': True,
-                                  'ILMV': True,
-                                  'FILM': True,
-                                  'HY':   True,
-                                  'FWY':  True
-                                  }
-                weak_groups = { 'ACS':    True,
-                                'ATV':    True,
-                                'AGS':    True,
-                                'KNST':   True,
-                                'APST':   True,
-                                'DGNS':   True,
-                                'DEKNQS': True,
-                                'DEHKNQ': True,
-                                'EHKNQR': True,
-                                'FILMV':  True,
-                                'FHY':    True
-                                }
-                
-            clw_buf = []
-            clw_buf.append ('CLUSTALW format of GBLOCKS trimmed MSA '+MSA_name+': '+MSA_description)
-            clw_buf.append ('')
-
-            long_id_len = 0
-            aln_pos_by_id = dict()
-            for row_id in row_order:
-                aln_pos_by_id[row_id] = 0
-                row_id_disp = default_row_labels[row_id]
-                if long_id_len < len(row_id_disp):
-                    long_id_len = len(row_id_disp)
-
-            full_row_cnt = alignment_length // max_row_width
-            if alignment_length % max_row_width == 0:
-                full_row_cnt -= 1
-            for chunk_i in range (full_row_cnt + 1):
-                for row_id in row_order:
-                    row_id_disp = re.sub('\s','_',default_row_labels[row_id])
-                    for sp_i in range (long_id_len-len(row_id_disp)):
-                        row_id_disp += ' '
-
-                    aln_chunk_upper_bound = (chunk_i+1)*max_row_width
-                    if aln_chunk_upper_bound > alignment_length:
-                        aln_chunk_upper_bound = alignment_length
-                    aln_chunk = alignment[row_id][chunk_i*max_row_width:aln_chunk_upper_bound]
-                    for c in aln_chunk:
-                        if c != '-':
-                            aln_pos_by_id[row_id] += 1
-
-                    clw_buf.append (row_id_disp+gap_chars+aln_chunk+' '+str(aln_pos_by_id[row_id]))
-
-                # conservation line
-                cons_line = ''
-                for pos_i in range(chunk_i*max_row_width, aln_chunk_upper_bound):
-                    col_chars = dict()
-                    seq_cnt = 0
-                    for row_id in row_order:
-                        char = alignment[row_id][pos_i]
-                        if char != '-':
-                            seq_cnt += 1
-                            col_chars[char] = True
-                    if seq_cnt <= 1:
-                        cons_char = ' '
-                    elif len(col_chars.keys()) == 1:
-                        cons_char = '*'
-                    else:
-                        strong = False
-                        for strong_group in strong_groups.keys():
-                            this_strong_group = True
-                            for seen_char in col_chars.keys():
-                                if seen_char not in strong_group:
-                                    this_strong_group = False
-                                    break
-                            if this_strong_group:
-                                strong = True
-                                break
-                        if not strong:
-                            weak = False
-                            if weak_groups != None:
-                                for weak_group in weak_groups.keys():
-                                    this_weak_group = True
-                                    for seen_char in col_chars.keys():
-                                        if seen_char not in weak_group:
-                                            this_strong_group = False
-                                            break
-                                    if this_weak_group:
-                                        weak = True
-                        if strong:
-                            cons_char = ':'
-                        elif weak:
-                            cons_char = '.'
-                        else:
-                            cons_char = ' '
-                    cons_line += cons_char
-
-                lead_space = ''
-                for sp_i in range(long_id_len):
-                    lead_space += ' '
-                lead_space += gap_chars
-
-                clw_buf.append(lead_space+cons_line)
-                clw_buf.append('')
-
-            # write clw to file
-            clw_buf_str = "\n".join(clw_buf)+"\n"
-            output_clw_file_path = os.path.join(output_dir, input_name+'-MSA.clw');
-            with open (output_clw_file_path, "w", 0) as output_clw_file_handle:
-                output_clw_file_handle.write(clw_buf_str)
-            output_clw_file_handle.close()
-
-
-            # upload GBLOCKS FASTA output to SHOCK for file_links
-            dfu = DFUClient(self.callbackURL)
-            try:
-                output_upload_ret = dfu.file_to_shock({'file_path': output_aln_file_path,
-# DEBUG
-#                                                      'make_handle': 0,
-#                                                      'pack': 'zip'})
-                                                       'make_handle': 0})
-            except:
-                raise ValueError ('error loading aln_out file to shock')
-
-            # upload GBLOCKS CLW output to SHOCK for file_links
-            try:
-                output_clw_upload_ret = dfu.file_to_shock({'file_path': output_clw_file_path,
-# DEBUG
-#                                                      'make_handle': 0,
-#                                                      'pack': 'zip'})
-                                                           'make_handle': 0})
-            except:
-                raise ValueError ('error loading clw_out file to shock')
+            file_links = self.wait_artifact_upload(artifact_upload, console)
 
 
             # make HTML reports
@@ -716,25 +875,17 @@ class kb_gblocks:
 
             reportName = 'gblocks_report_'+str(uuid.uuid4())
             reportObj = {
-                'objects_created':[{'ref':params['workspace_name']+'/'+params['output_name'],
+                'objects_created':[{'ref':versioned_ref(new_obj_info),
                                     'description':'GBLOCKS MSA'}],
                 #'message': '',
                 'message': clw_buf_str,
                 #'direct_html': '',
                 #'direct_html_link_index': 0,
-                'file_links': [],
+                'file_links': file_links,
                 #'html_links': [],
                 'workspace_name': params['workspace_name'],
                 'report_object_name': reportName
                 }
-            reportObj['file_links'] = [{'shock_id': output_upload_ret['shock_id'],
-                                        'name': params['output_name']+'-GBLOCKS.FASTA',
-                                        'label': 'GBLOCKS-trimmed MSA FASTA'
-                                        },
-                                       {'shock_id': output_clw_upload_ret['shock_id'],
-                                        'name': params['output_name']+'-GBLOCKS.CLW',
-                                        'label': 'GBLOCKS-trimmed MSA CLUSTALW'
-                                        }]
 
             # save report object
             #
@@ -786,12 +937,489 @@ class kb_gblocks:
                              'returnVal is not type dict as required.')
         # return the results
         return [returnVal]
+    def run_Gblocks_sweep(self, ctx, params):
+        """
+        Method for evaluating a grid of Gblocks settings on one MSA
+        **
+        **        input_type: MSA
+        **        output_type: MSA (for each setting in save_setting_indices)
+        :param params: instance of type "Gblocks_Sweep_Params" (Gblocks
+           Sweep Input Params ** ** Every combination of trim_levels x
+           min_block_lens x max_pos_contig_nonconserveds is evaluated with
+           the native engine. ** Settings are numbered in that order (the
+           order of the returned settings list), ** and save_setting_indices
+           picks which of them are saved as MSA objects ** named
+           <output_name>.<index>) -> structure: parameter "workspace_name"
+           of type "workspace_name" (** The workspace object refs are of
+           form: ** **    objects = ws.get_objects([{'ref':
+           params['workspace_id']+'/'+params['obj_name']}]) ** ** "ref" means
+           the entire name combining the workspace id and the object name **
+           "id" is a numerical identifier of the workspace or object, and
+           should just be used for workspace ** "name" is a string identifier
+           of a workspace or object.  This is received from Narrative.),
+           parameter "desc" of String, parameter "input_ref" of type
+           "data_obj_ref", parameter "output_name" of type "data_obj_name",
+           parameter "trim_levels" of list of Long, parameter
+           "min_block_lens" of list of Long, parameter
+           "max_pos_contig_nonconserveds" of list of Long, parameter
+           "min_seqs_for_conserved" of Long, parameter "min_seqs_for_flank"
+           of Long, parameter "save_setting_indices" of list of Long
+        :returns: instance of type "Gblocks_Sweep_Output" (Gblocks Sweep
+           Output) -> structure: parameter "report_name" of type
+           "data_obj_name", parameter "report_ref" of type "data_obj_ref",
+           parameter "settings" of list of type "Gblocks_Sweep_Setting"
+           (Gblocks Sweep result for one setting) -> structure: parameter
+           "index" of Long, parameter "trim_level" of Long, parameter
+           "min_block_len" of Long, parameter "max_pos_contig_nonconserved"
+           of Long, parameter "retained_len" of Long, parameter
+           "block_count" of Long, parameter "gap_fraction" of Double,
+           parameter "output_ref" of type "data_obj_ref"
+        """
+        # ctx is the context object
+        # return variables are: returnVal
+        #BEGIN run_Gblocks_sweep
+        console = []
+        self.log(console,'Running run_Gblocks_sweep with params=')
+        self.log(console, "\n"+pformat(params))
+
+
+        #### do some basic checks
+        #
+        if 'workspace_name' not in params:
+            raise ValueError('workspace_name parameter is required')
+        if 'input_ref' not in params:
+            raise ValueError('input_ref parameter is required')
+        if 'output_name' not in params:
+            raise ValueError('output_name parameter is required')
+
+        grid = dict()
+        for grid_key, default_val in [('trim_levels', 0),
+                                      ('min_block_lens', 0),
+                                      ('max_pos_contig_nonconserveds', 8)]:
+            grid[grid_key] = [default_val]
+            if grid_key in params and params[grid_key] != None and len(params[grid_key]) > 0:
+                grid[grid_key] = [int(val) for val in params[grid_key]]
+
+        settings = []
+        for trim_level in grid['trim_levels']:
+            for min_block_len in grid['min_block_lens']:
+                for max_pos_contig_nonconserved in grid['max_pos_contig_nonconserveds']:
+                    setting = {'trim_level': trim_level,
+                               'min_block_len': min_block_len,
+                               'max_pos_contig_nonconserved': max_pos_contig_nonconserved}
+                    for key in ['min_seqs_for_conserved', 'min_seqs_for_flank']:
+                        if key in params:
+                            setting[key] = params[key]
+                    settings.append(setting)
+        self.validate_sweep_settings(params, settings, None, None, console)
+
+        save_setting_indices = []
+        if 'save_setting_indices' in params and params['save_setting_indices'] != None:
+            save_setting_indices = [int(setting_i) for setting_i in params['save_setting_indices']]
+        for setting_i in save_setting_indices:
+            if setting_i < 0 or setting_i >= len(settings):
+                raise ValueError("save_setting_indices value "+str(setting_i)+" is not between 0 and "+str(len(settings)-1))
+
+
+        #### Pre-flight: check the grid against the MSA's size before downloading it
+        ##
+        ws = workspaceService(self.workspaceURL, token=ctx['token'])
+        (info, input_versioned_ref, N_seqs, L_alignment) = self.get_MSA_preflight(ws, params['input_ref'], console)
+        self.validate_sweep_settings(params, settings, N_seqs, L_alignment, console, L_name='alignment length')
+
+
+        #### Get the input_ref MSA object and count residues once for the whole grid
+        ##
+        (MSA_in, info, MSA_aln) = self.get_input_MSA(ws, input_versioned_ref, console, n_rows_hint=N_seqs or 0, info=info)
+        MSA_stats = AlignmentStats.from_alignment(MSA_aln, MSA_in.get('alignment_length'))
+        N_seqs = MSA_stats.N
+        self.validate_sweep_settings(params, settings, N_seqs, MSA_stats.L_first_seq, console)
+        (counts, symbols, L_first_seq) = self.get_column_counts(info, MSA_aln, console, MSA_stats)
+
+
+        #### Evaluate the grid
+        ##
+        self.log(console, 'EVALUATING '+str(len(settings))+' GBLOCKS SETTINGS')
+        sweep_results = sweep(counts, symbols, N_seqs, settings)
+
+        sweep_table = []
+        for setting_i, setting in enumerate(settings):
+            sweep_row = {'index': setting_i,
+                         'trim_level': setting['trim_level'],
+                         'min_block_len': setting['min_block_len'],
+                         'max_pos_contig_nonconserved': setting['max_pos_contig_nonconserved']}
+            sweep_row.update(sweep_results[setting_i])
+            sweep_table.append(sweep_row)
+
+        table_buf = ["\t".join(['index', 'trim_level', 'min_block_len', 'max_pos_contig_nonconserved',
+                                'retained_len', 'block_count', 'gap_fraction'])]
+        for sweep_row in sweep_table:
+            table_buf.append("\t".join([str(sweep_row['index']),
+                                        str(sweep_row['trim_level']),
+                                        str(sweep_row['min_block_len']),
+                                        str(sweep_row['max_pos_contig_nonconserved']),
+                                        str(sweep_row['retained_len']),
+                                        str(sweep_row['block_count']),
+                                        '%.4f' % sweep_row['gap_fraction']]))
+        self.log(console, "\n".join(table_buf))
+
+
+        #### Save the picked settings
+        ##
+        provenance = self.get_provenance(ctx, [params['input_ref']], 'run_Gblocks_sweep')
+        MSA_description = ''
+        if 'desc' in params and params['desc'] != None and params['desc'] != '':
+            MSA_description = params['desc']
+
+        save_objects = []
+        saved_setting_indices = []
+        MSA_carry_over = None
+        for setting_i in save_setting_indices:
+            if sweep_table[setting_i]['retained_len'] == 0:
+                self.log(console, 'setting '+str(setting_i)+' produced no blocks, not saving')
+                continue
+            setting = settings[setting_i]
+            keep, blocks = select_blocks(counts, symbols, N_seqs, **resolve_params(setting, N_seqs))
+            trimmed_aln = MSA_aln.select_columns(keep)
+
+            MSA_name = params['output_name']+'.'+str(setting_i)
+            if MSA_carry_over is None:
+                MSA_carry_over = self.get_MSA_carry_over(ws, [info])[0]
+            MSA_out = self.build_MSA_out(MSA_in, MSA_carry_over, trimmed_aln.to_alignment_dict(), trimmed_aln.L, MSA_name, MSA_description)
+            save_objects.append({'type': 'KBaseTrees.MSA',
+                                 'data': MSA_out,
+                                 'name': MSA_name,
+                                 'meta': {},
+                                 'provenance': provenance
+                                 })
+            saved_setting_indices.append(setting_i)
+
+        objects_created = []
+        if len(save_objects) > 0:
+            self.log(console,"SAVING "+str(len(save_objects))+" TRIMMED MSAs")
+            new_obj_infos = ws.save_objects({'workspace': params['workspace_name'],
+                                             'objects': save_objects
+                                             })
+            for setting_i, new_obj_info in zip(saved_setting_indices, new_obj_infos):
+                output_ref = versioned_ref(new_obj_info)
+                sweep_table[setting_i]['output_ref'] = output_ref
+                objects_created.append({'ref': output_ref,
+                                        'description': 'GBLOCKS MSA setting '+str(setting_i)})
+
+
+        # build output report object
+        #
+        self.log(console,"BUILDING REPORT")  # DEBUG
+        reportName = 'gblocks_sweep_report_'+str(uuid.uuid4())
+        reportObj = {
+            'objects_created': objects_created,
+            'message': "\n".join(table_buf)+"\n",
+            'workspace_name': params['workspace_name'],
+            'report_object_name': reportName
+            }
+        SERVICE_VER = 'release'
+        reportClient = KBaseReport(self.callbackURL, token=ctx['token'], service_ver=SERVICE_VER)
+        report_info = reportClient.create_extended_report(reportObj)
+
+        returnVal = { 'report_name': report_info['name'],
+                      'report_ref': report_info['ref'],
+                      'settings': sweep_table
+                      }
+        self.log(console,"run_Gblocks_sweep DONE")
+        #END run_Gblocks_sweep
+
+        # At some point might do deeper type checking...
+        if not isinstance(returnVal, dict):
+            raise ValueError('Method run_Gblocks_sweep return value ' +
+                             'returnVal is not type dict as required.')
+        # return the results
+        return [returnVal]
+    def run_Gblocks_batch(self, ctx, params):
+        """
+        Method for trimming many MSAs with the same Gblocks settings in one job
+        **
+        **        input_type: list of MSA, or a set of MSA
+        **        output_type: MSA (one per input)
+        :param params: instance of type "Gblocks_Batch_Params" (Gblocks
+           Batch Input Params ** ** MSAs are taken from input_refs and/or
+           the items of input_set_ref. ** Each output MSA is named
+           <input MSA name><output_suffix>) -> structure: parameter
+           "workspace_name" of type "workspace_name" (** The workspace object
+           refs are of form: ** **    objects = ws.get_objects([{'ref':
+           params['workspace_id']+'/'+params['obj_name']}]) ** ** "ref" means
+           the entire name combining the workspace id and the object name **
+           "id" is a numerical identifier of the workspace or object, and
+           should just be used for workspace ** "name" is a string identifier
+           of a workspace or object.  This is received from Narrative.),
+           parameter "desc" of String, parameter "input_refs" of list of type
+           "data_obj_ref", parameter "input_set_ref" of type "data_obj_ref",
+           parameter "output_suffix" of String, parameter "trim_level" of
+           Long, parameter "min_seqs_for_conserved" of Long, parameter
+           "min_seqs_for_flank" of Long, parameter
+           "max_pos_contig_nonconserved" of Long, parameter "min_block_len"
+           of Long, parameter "engine" of String, parameter "max_workers" of
+           Long
+        :returns: instance of type "Gblocks_Batch_Output" (Gblocks Batch
+           Output) -> structure: parameter "report_name" of type
+           "data_obj_name", parameter "report_ref" of type "data_obj_ref",
+           parameter "output_refs" of list of type "data_obj_ref"
+        """
+        # ctx is the context object
+        # return variables are: returnVal
+        #BEGIN run_Gblocks_batch
+        console = []
+        self.log(console,'Running run_Gblocks_batch with params=')
+        self.log(console, "\n"+pformat(params))
+
+
+        #### do some basic checks
+        #
+        if 'workspace_name' not in params:
+            raise ValueError('workspace_name parameter is required')
+        input_refs = []
+        if 'input_refs' in params and params['input_refs'] != None:
+            input_refs.extend(params['input_refs'])
+        if ('input_set_ref' not in params or params['input_set_ref'] == None or params['input_set_ref'] == '') \
+                and len(input_refs) == 0:
+            raise ValueError('input_refs or input_set_ref parameter is required')
+
+        engine = 'binary'
+        engine_requested = False
+        if 'engine' in params and params['engine'] != None and params['engine'] != '':
+            engine = params['engine']
+            engine_requested = True
+        if engine not in self.GBLOCKS_engines:
+            raise ValueError('engine must be one of '+', '.join(self.GBLOCKS_engines)+": '"+str(engine)+"'")
+
+        # the checks that don't depend on the MSA.  Each MSA gets the rest when it's trimmed
+        invalid_msgs = []
+        engine = self.validate_Gblocks_params(params, None, None, engine, engine_requested, invalid_msgs, console)
+        if len(invalid_msgs) > 0:
+            raise ValueError("\n".join([msg.rstrip("\n") for msg in invalid_msgs]))
+
+        output_suffix = '.Gblocks'
+        if 'output_suffix' in params and params['output_suffix'] != None and params['output_suffix'] != '':
+            output_suffix = params['output_suffix']
+
+        max_workers = multiprocessing.cpu_count()
+        if 'max_workers' in params and params['max_workers'] != None and int(params['max_workers']) > 0:
+            max_workers = int(params['max_workers'])
+
+
+        #### Get all the input MSA objects in one call
+        ##
+        ws = workspaceService(self.workspaceURL, token=ctx['token'])
+        if 'input_set_ref' in params and params['input_set_ref'] != None and params['input_set_ref'] != '':
+            try:
+                set_obj = ws.get_objects2({'objects': [{'ref': params['input_set_ref']}]})['data'][0]['data']
+            except Exception as e:
+                raise ValueError('Unable to fetch input_set_ref object from workspace: ' + str(e))
+            for item in set_obj['items']:
+                input_refs.append(item['ref'])
+        fetch_start = self.fetch_stats()
+        try:
+            objects = ws.get_objects2({'objects': [{'ref': input_ref,
+                                                    'included': ['/'+field for field in self.MSA_trim_fields]}
+                                                   for input_ref in input_refs]})['data']
+        except Exception as e:
+            raise ValueError('Unable to fetch input_refs objects from workspace: ' + str(e))
+        self.log_fetch_stats(console, 'fetched '+str(len(input_refs))+' MSAs', fetch_start)
+
+
+        #### Trim on a bounded pool
+        ##
+        timestamp = int((datetime.utcnow() - datetime.utcfromtimestamp(0)).total_seconds()*1000)
+        batch_dir = os.path.join(self.scratch, 'batch.'+str(timestamp))
+        if not os.path.exists(batch_dir):
+            os.makedirs(batch_dir)
+
+        batch_jobs = []
+        for batch_i, obj in enumerate(objects):
+            batch_jobs.append((batch_i, obj['data'], obj['info'], params, engine, engine_requested, batch_dir))
+
+        n_workers = max(1, min(max_workers, len(batch_jobs)))
+        self.log(console, 'RUNNING GBLOCKS ('+engine+') on '+str(len(batch_jobs))+' MSAs with '+str(n_workers)+' workers')
+        pool = ThreadPool(n_workers)
+        try:
+            batch_results = pool.map(self.trim_batch_MSA, batch_jobs)
+        finally:
+            pool.close()
+            pool.join()
+
+
+        #### Save all trimmed MSAs in one call
+        ##
+        provenance = self.get_provenance(ctx, input_refs, 'run_Gblocks_batch')
+        MSA_description = ''
+        if 'desc' in params and params['desc'] != None and params['desc'] != '':
+            MSA_description = params['desc']
+
+        # metadata to carry over, for the MSAs that trimmed successfully
+        carry_over_infos = [obj['info'] for obj, batch_result in zip(objects, batch_results)
+                            if 'error' not in batch_result]
+        MSA_carry_overs = []
+        if len(carry_over_infos) > 0:
+            MSA_carry_overs = self.get_MSA_carry_over(ws, carry_over_infos)
+
+        save_objects = []
+        summary_buf = ["\t".join(['input', 'N_seqs', 'L_in', 'L_out', 'output'])]
+        for input_ref, obj, batch_result in zip(input_refs, objects, batch_results):
+            info = obj['info']
+            (N_seqs, L_in) = [('-' if val is None else str(val)) for val in [batch_result['N_seqs'], batch_result['L_in']]]
+            if 'error' in batch_result:
+                self.log(console, info[1]+' ('+input_ref+'): '+batch_result['error'])
+                summary_buf.append("\t".join([info[1], N_seqs, L_in, '-', 'FAILED: '+batch_result['error']]))
+                continue
+            MSA_name = info[1]+output_suffix
+            trimmed_aln = batch_result['alignment']
+            MSA_out = self.build_MSA_out(batch_result['MSA_in'], MSA_carry_overs[len(save_objects)],
+                                         trimmed_aln.to_alignment_dict(), trimmed_aln.L,
+                                         MSA_name, MSA_description)
+            save_objects.append({'type': 'KBaseTrees.MSA',
+                                 'data': MSA_out,
+                                 'name': MSA_name,
+                                 'meta': {},
+                                 'provenance': provenance
+                                 })
+            summary_buf.append("\t".join([info[1], N_seqs, L_in, str(trimmed_aln.L), MSA_name]))
+        self.log(console, "\n".join(summary_buf))
+
+        output_refs = []
+        objects_created = []
+        if len(save_objects) > 0:
+            self.log(console,"SAVING "+str(len(save_objects))+" TRIMMED MSAs")
+            new_obj_infos = ws.save_objects({'workspace': params['workspace_name'],
+                                             'objects': save_objects
+                                             })
+            for new_obj_info in new_obj_infos:
+                output_ref = str(new_obj_info[6])+'/'+str(new_obj_info[0])+'/'+str(new_obj_info[4])
+                output_refs.append(output_ref)
+                objects_created.append({'ref': output_ref,
+                                        'description': 'GBLOCKS MSA'})
+
+
+        # build output report object
+        #
+        self.log(console,"BUILDING REPORT")  # DEBUG
+        reportName = 'gblocks_batch_report_'+str(uuid.uuid4())
+        reportObj = {
+            'objects_created': objects_created,
+            'message': "Trimmed "+str(len(output_refs))+" of "+str(len(objects))+" MSAs\n\n"+"\n".join(summary_buf)+"\n",
+            'workspace_name': params['workspace_name'],
+            'report_object_name': reportName
+            }
+        SERVICE_VER = 'release'
+        reportClient = KBaseReport(self.callbackURL, token=ctx['token'], service_ver=SERVICE_VER)
+        report_info = reportClient.create_extended_report(reportObj)
+
+        returnVal = { 'report_name': report_info['name'],
+                      'report_ref': report_info['ref'],
+                      'output_refs': output_refs
+                      }
+        self.log(console,"run_Gblocks_batch DONE")
+        #END run_Gblocks_batch
+
+        # At some point might do deeper type checking...
+        if not isinstance(returnVal, dict):
+            raise ValueError('Method run_Gblocks_batch return value ' +
+                             'returnVal is not type dict as required.')
+        # return the results
+        return [returnVal]
+    def preview_Gblocks(self, ctx, params):
+        """
+        Method for previewing the blocks Gblocks settings keep, without saving anything
+        **
+        **        input_type: MSA
+        **        output_type: none
+        :param params: instance of type "Gblocks_Preview_Params" (Gblocks
+           Preview Input Params ** ** The Gblocks_Params settings, evaluated
+           with the native engine.) -> structure: parameter "input_ref" of
+           type "data_obj_ref", parameter "trim_level" of Long, parameter
+           "min_seqs_for_conserved" of Long, parameter "min_seqs_for_flank"
+           of Long, parameter "max_pos_contig_nonconserved" of Long,
+           parameter "min_block_len" of Long
+        :returns: instance of type "Gblocks_Preview_Output" (Gblocks Preview
+           Output ** ** blocks are the [start, end) columns of each block,
+           0-based. ** kept has one character per input MSA column: "1" kept,
+           "0" dropped.) -> structure: parameter "blocks" of list of tuple of
+           size 2: parameter "start" of Long, parameter "end" of Long,
+           parameter "alignment_length" of Long, parameter "retained_len" of
+           Long, parameter "retained_fraction" of Double, parameter "kept" of
+           String
+        """
+        # ctx is the context object
+        # return variables are: returnVal
+        #BEGIN preview_Gblocks
+        console = []
+        preview_start = time.time()
+        self.log(console,'Running preview_Gblocks with params=')
+        self.log(console, "\n"+pformat(params))
+
+        if 'input_ref' not in params:
+            raise ValueError('input_ref parameter is required')
+
+
+        #### Column counts of this MSA version: cached after the first preview or trim,
+        ##   so later calls only pin the version and run the O(L) block selection
+        ws = workspaceService(self.workspaceURL, token=ctx['token'])
+        try:
+            info = ws.get_object_info3({'objects': [{'ref': params['input_ref']}]})['infos'][0]
+        except Exception as e:
+            raise ValueError('Unable to fetch input_ref object info from workspace: ' + str(e))
+        input_type_name = info[2].split('.')[1].split('-')[0]
+        if input_type_name != 'MSA':
+            raise ValueError('Cannot yet handle input_ref type of: '+input_type_name)
+
+        cached_counts = self.get_column_counts(info, None, console)
+        if cached_counts is None:
+            (MSA_in, info, MSA_aln) = self.get_input_MSA(ws, versioned_ref(info), console, info=info)
+            cached_counts = self.get_column_counts(info, MSA_aln, console)
+        (counts, symbols, L_first_seq) = cached_counts
+        L_alignment = counts.shape[0]
+        # every column counts each row once, gaps included
+        N_seqs = int(counts[0].sum()) if L_alignment > 0 else 0
+
+
+        #### Check the settings as run_Gblocks does, and select blocks
+        ##
+        invalid_msgs = []
+        self.validate_Gblocks_params(params, N_seqs, L_first_seq, 'native', True,
+                                     invalid_msgs, console)
+        if len(invalid_msgs) > 0:
+            raise ValueError("\n".join(invalid_msgs))
+
+        keep, blocks = select_blocks(counts, symbols, N_seqs, **resolve_params(params, N_seqs))
+        L_kept = int(keep.sum())
+        returnVal = {'blocks': [[int(block_start), int(block_end)] for block_start, block_end in blocks],
+                     'alignment_length': L_alignment,
+                     'retained_len': L_kept,
+                     'retained_fraction': float(L_kept) / max(L_alignment, 1),
+                     'kept': (keep.astype(np.uint8) + ord('0')).tobytes().decode('ascii')}
+
+        self.log(console, 'Flanks: '+format_flanks(blocks))
+        self.log(console,"preview_Gblocks DONE in "+str(int(round(1000*(time.time() - preview_start))))+" ms")
+        #END preview_Gblocks
+
+        # At some point might do deeper type checking...
+        if not isinstance(returnVal, dict):
+            raise ValueError('Method preview_Gblocks return value ' +
+                             'returnVal is not type dict as required.')
+        # return the results
+        return [returnVal]
     def status(self, ctx):
         #BEGIN_STATUS
         returnVal = {'state': "OK",
                      'message': "",
                      'version': self.VERSION,
                      'git_url': self.GIT_URL,
-                     'git_commit_hash': self.GIT_COMMIT_HASH}
+                     'git_commit_hash': self.GIT_COMMIT_HASH,
+                     'http_session_pool': session_pool_stats(),
+                     'callback_polling': poll_strategy_stats(),
+                     'service_url_cache': service_url_cache_stats(),
+                     'request_compression': request_compression_stats()}
+        if self.object_cache is not None:
+            returnVal['object_cache'] = self.object_cache.stats()
+        if self.column_count_cache is not None:
+            returnVal['column_count_cache'] = self.column_count_cache.stats()
         #END_STATUS
         return [returnVal]
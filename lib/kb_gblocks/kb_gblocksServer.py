@@ -342,6 +342,18 @@ class Application(object):
                              name='kb_gblocks.run_Gblocks',
                              types=[dict])
         self.method_authentication['kb_gblocks.run_Gblocks'] = 'required'  # noqa
+        self.rpc_service.add(impl_kb_gblocks.run_Gblocks_sweep,
+                             name='kb_gblocks.run_Gblocks_sweep',
+                             types=[dict])
+        self.method_authentication['kb_gblocks.run_Gblocks_sweep'] = 'required'  # noqa
+        self.rpc_service.add(impl_kb_gblocks.run_Gblocks_batch,
+                             name='kb_gblocks.run_Gblocks_batch',
+                             types=[dict])
+        self.method_authentication['kb_gblocks.run_Gblocks_batch'] = 'required'  # noqa
+        self.rpc_service.add(impl_kb_gblocks.preview_Gblocks,
+                             name='kb_gblocks.preview_Gblocks',
+                             types=[dict])
+        self.method_authentication['kb_gblocks.preview_Gblocks'] = 'required'  # noqa
         self.rpc_service.add(impl_kb_gblocks.status,
                              name='kb_gblocks.status',
                              types=[dict])
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+#
+# Incremental decoding of Workspace get_objects2 responses for KBaseTrees.MSA
+#
+# The "alignment" mapping of each object is walked row by row with an
+# event-based JSON parser (ijson), and every row goes straight into a
+# compact uint8 matrix, so the row_id -> sequence dict is never built.
+# Everything else in the object is small and is decoded as usual.
+#
+# ijson is pinned to 2.x, the last series that runs on Python 2.7.  It
+# decodes non-integer numbers as Decimal, so they're converted to float here
+# to match what json.loads gives.
+#
+from decimal import Decimal
+
+import ijson
+import numpy as np
+
+from kb_gblocks.engine import RowBuffer
+
+
+_OBJECT_PREFIX = 'result.item.data.item'
+_DATA_PREFIX = _OBJECT_PREFIX+'.data'
+_ALIGNMENT_PREFIX = _DATA_PREFIX+'.alignment'
+
+
+def get_objects2_stream(ws, params, context=None):
+    '''
+    Workspace get_objects2 on a generated Workspace client, returning the
+    JSON-RPC response body as a file-like object for read_MSA_objects
+    instead of the decoded result.  The caller must close() it.  This lives
+    here rather than in installed_clients, whose clients are regenerated by
+    kb-sdk install
+    '''
+    return ws._client.call_method_stream('Workspace.get_objects2', [params], ws._service_ver, context)
+
+
+def read_MSA_objects(stream, n_rows_hints=None):
+    '''
+    Decode a get_objects2 response stream of MSA objects.
+
+    Returns a list with one (data, info, row_ids, matrix) per object, where
+    data is the object without its "alignment" and matrix holds the
+    alignment rows, in row_ids order (the order they were sent in)
+    '''
+    objects = []
+    builder = None
+    row_ids = []
+    rows = None
+    for prefix, event, value in ijson.parse(stream):
+        if not prefix.startswith(_OBJECT_PREFIX):
+            continue
+        if event == 'number' and isinstance(value, Decimal):
+            value = float(value)
+
+        # alignment rows: the mapping's keys are row ids, its values the rows
+        if prefix == _ALIGNMENT_PREFIX:
+            if event == 'map_key':
+                row_ids.append(value)
+            continue
+        if prefix.startswith(_ALIGNMENT_PREFIX+'.'):
+            if event != 'string':
+                raise ValueError("MSA alignment row '"+row_ids[-1]+"' is not a string")
+            rows.append(value.encode('ascii'))
+            continue
+        if prefix == _DATA_PREFIX and event == 'map_key' and value == 'alignment':
+            continue
+
+        # everything else
+        if prefix == _OBJECT_PREFIX and event == 'start_map':
+            builder = ijson.ObjectBuilder()
+            n_rows_hint = 0
+            if n_rows_hints is not None and len(objects) < len(n_rows_hints):
+                n_rows_hint = n_rows_hints[len(objects)]
+            rows = RowBuffer(n_rows_hint)
+            row_ids = []
+        builder.event(event, value)
+        if prefix == _OBJECT_PREFIX and event == 'end_map':
+            obj = builder.value
+            objects.append((obj.get('data', dict()), obj['info'], row_ids, rows.result()))
+            builder = None
+    return objects
+
+
+def order_rows(row_ids, matrix, row_order):
+    '''
+    Put matrix rows into row_order (a permutation of row_ids).  The rows are
+    moved in place, one permutation cycle at a time through a single row
+    buffer, so the N x L matrix is not copied.  Returns the reordered matrix
+    '''
+    if list(row_ids) == list(row_order):
+        return matrix
+    row_index = dict([(row_id, row_i) for row_i, row_id in enumerate(row_ids)])
+    try:
+        perm = np.array([row_index[row_id] for row_id in row_order], dtype=np.int64)
+    except KeyError as e:
+        raise ValueError("MSA row_order id "+str(e)+" has no alignment row")
+    if len(perm) != matrix.shape[0] or not (np.bincount(perm, minlength=matrix.shape[0]) == 1).all():
+        # not a permutation (rows left out or repeated), so the result is a different matrix
+        return matrix[perm]
+
+    # row dest_i takes row perm[dest_i]
+    row_buffer = np.empty(matrix.shape[1], dtype=matrix.dtype)
+    unplaced = np.flatnonzero(perm != np.arange(len(perm))).tolist()
+    perm = perm.tolist()
+    placed = [False] * len(perm)
+    for cycle_start in unplaced:
+        if placed[cycle_start]:
+            continue
+        row_buffer[:] = matrix[cycle_start]
+        dest_i = cycle_start
+        while perm[dest_i] != cycle_start:
+            matrix[dest_i] = matrix[perm[dest_i]]
+            placed[dest_i] = True
+            dest_i = perm[dest_i]
+        matrix[dest_i] = row_buffer
+        placed[dest_i] = True
+    return matrix
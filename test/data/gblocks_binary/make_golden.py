@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+#
+# Regenerate the Gblocks binary outputs the native engine is checked against
+# in kb_gblocks_engine_test.py, for the DsrA test MSA in each gap mode (b5).
+# Run from test/ inside the module image, where the binary is installed:
+#
+#   PYTHONPATH=../lib python data/gblocks_binary/make_golden.py [/kb/module/Gblocks]
+#
+import json
+import os
+import sys
+
+from kb_gblocks.alignment import Alignment
+from kb_gblocks.engine import TRIM_LEVEL_TO_B5
+from kb_gblocks.gblocks_runner import build_gblocks_cmd, run_streaming
+
+
+GOLDEN_DIR = os.path.dirname(os.path.abspath(__file__))
+MSA_PATH = os.path.join(GOLDEN_DIR, '..', 'DsrA.MSA.json')
+
+
+def main(gblocks_bin):
+    with open(MSA_PATH, 'r') as MSA_handle:
+        MSA_in = json.load(MSA_handle)
+    MSA_aln = Alignment.from_MSA(MSA_in, MSA_in['row_order'], MSA_in.get('default_row_labels'))
+
+    for trim_level, b5 in sorted(TRIM_LEVEL_TO_B5.items()):
+        # same command run_Gblocks builds.  Gblocks names its outputs <input>-gb and <input>-gb.htm
+        input_MSA_file_path = os.path.join(GOLDEN_DIR, 'DsrA.b5-'+b5+'.fasta')
+        MSA_aln.write_fasta(input_MSA_file_path)
+        gblocks_cmd = build_gblocks_cmd(gblocks_bin, input_MSA_file_path, {'trim_level': trim_level}, 'p')
+        returncode, log_lines = run_streaming(gblocks_cmd, cwd=GOLDEN_DIR, timeout=600)
+        os.remove(input_MSA_file_path)
+        # the binary exits 1 on success
+        if returncode != 1 or not os.path.isfile(input_MSA_file_path+'-gb'):
+            raise ValueError(' '.join(gblocks_cmd)+' failed, return code '+str(returncode)+"\n"+"\n".join(log_lines))
+        print(' '.join(gblocks_cmd)+' -> '+os.path.basename(input_MSA_file_path)+'-gb')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1] if len(sys.argv) > 1 else '/kb/module/Gblocks')
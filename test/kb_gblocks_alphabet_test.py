@@ -0,0 +1,85 @@
+import unittest
+import os
+import re
+import time
+
+import numpy as np
+
+from kb_gblocks.alphabet import classify_alphabet, format_alphabet, char_counts
+from kb_gblocks.engine import msa_to_matrix, column_counts, select_blocks, gap_fraction
+from kb_gblocks.alignment import Alignment, AlignmentStats
+from kb_gblocks.clw import conservation_line, _symbol_bits
+
+
+class kb_gblocksAlphabetTest(unittest.TestCase):
+
+    def classify(self, rows, declared_type=None):
+        return classify_alphabet(msa_to_matrix(rows), declared_type)
+
+    def test_types(self):
+        dna = self.classify(['ACGT-ACGTN', 'acgtnAC-GT'])
+        self.assertEqual((dna['type'], dna['gblocks_type'], dna['is_nuc']), ('DNA', 'd', True))
+        self.assertEqual((dna['n_residues'], dna['n_gaps']), (18, 2))
+        self.assertAlmostEqual(dna['frequencies']['A'], 3.0/18)
+        self.assertAlmostEqual(dna['ambiguous_fraction'], 2.0/18)
+
+        rna = self.classify(['ACGU-', 'ACGUu'])
+        self.assertEqual(rna['type'], 'RNA')
+        self.assertEqual(rna['gblocks_type'], 'd')
+        # lower case ambiguity codes are still nucleotides
+        self.assertEqual(self.classify(['ACGTrykm', 'ACGTswbd'])['type'], 'DNA')
+
+        prot = self.classify(['MKVLA-', 'mkvqla'])
+        self.assertEqual((prot['type'], prot['gblocks_type'], prot['is_nuc']), ('protein', 'p', False))
+        self.assertEqual(self.classify(['MKV#', 'MKVA'])['other_chars'], '#')
+        self.assertEqual(self.classify(['---', '---'])['type'], 'protein')
+
+        codon = self.classify(['ATGAAA---', 'ATGAAG---'], 'codon')
+        self.assertEqual((codon['type'], codon['gblocks_type']), ('codon', 'c'))
+        self.assertEqual(self.classify(['MKVLA', 'MKVLA'], 'codon')['type'], 'protein')
+        self.assertIn('DNA (-t=d)', format_alphabet(dna))
+
+    def test_gap_set_shared(self):
+        # '.' is a gap to the classifier, the engine, the stats, the mask and the CLUSTALW writer alike
+        rows = ['AC.GT', 'AC-GT', 'ACGGT']
+        matrix = msa_to_matrix(rows)
+        alphabet = self.classify(rows)
+        self.assertEqual((alphabet['type'], alphabet['n_gaps'], alphabet['other_chars']), ('DNA', 2, ''))
+
+        counts, symbols = column_counts(matrix, alphabet['char_counts'])
+        self.assertEqual(symbols.tolist(), column_counts(matrix)[1].tolist())
+        self.assertTrue(np.array_equal(counts, column_counts(matrix)[0]))
+        keep, blocks = select_blocks(counts, symbols, 3, b1=2, b2=2, b3=8, b4=2, b5='n')
+        self.assertEqual(keep.tolist(), [True, True, False, True, True])
+        self.assertAlmostEqual(gap_fraction(counts, symbols, 3, np.ones(5, dtype=bool)), 2.0/15)
+
+        aln = Alignment(['a', 'b', 'c'], ['a', 'b', 'c'], matrix)
+        self.assertEqual(AlignmentStats.from_alignment(aln).row_lengths.tolist(), [4, 4, 5])
+        self.assertEqual(aln.remove_mask_positions(ref_row=None).row_str(2), 'ACGT')
+        self.assertEqual(conservation_line(matrix, _symbol_bits(matrix), [], []), '** **')
+        self.assertEqual(char_counts(matrix).tolist(), alphabet['char_counts'].tolist())
+
+    @unittest.skipUnless(os.environ.get('KB_GBLOCKS_BENCHMARKS'), 'set KB_GBLOCKS_BENCHMARKS=1 to run (20000 x 2000 MSA)')
+    def test_benchmark_vs_regex(self):
+        N = 20000
+        L = 2000
+        rng = np.random.RandomState(5)
+        matrix = np.frombuffer(b'ACGT-', dtype=np.uint8)[rng.randint(0, 5, size=(N, L))]
+
+        start_time = time.time()
+        alphabet = classify_alphabet(matrix)
+        lut_sec = time.time() - start_time
+        self.assertEqual(alphabet['type'], 'DNA')
+
+        # the per-row regex classify_alphabet() replaced, which reads every row of a nucleotide MSA
+        NUC_MSA_pattern = re.compile(r"^[\.\-_ACGTUXNRYSWKMBDHVacgtuxnryswkmbdhv \t\n]+$")
+        start_time = time.time()
+        all_seqs_nuc = True
+        for row_i in range(N):
+            if NUC_MSA_pattern.match(matrix[row_i].tobytes().decode('ascii')) == None:
+                all_seqs_nuc = False
+                break
+        regex_sec = time.time() - start_time
+        self.assertTrue(all_seqs_nuc)
+        # one pass over the matrix beats the row-by-row regex it replaced
+        self.assertLess(lut_sec, regex_sec)
@@ -0,0 +1,346 @@
+import unittest
+import json
+import os
+import threading
+import time
+import zlib
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer  # py2
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer  # py3
+try:
+    from SocketServer import ThreadingMixIn  # py2
+except ImportError:
+    from socketserver import ThreadingMixIn  # py3
+
+import requests
+
+import numpy as np
+
+from installed_clients.baseclient import BaseClient, AdaptivePollStrategy, ServerError, session_pool_stats, service_url_cache_stats
+from installed_clients.baseclient import configure_request_compression, request_compression_stats
+from installed_clients.DataFileUtilClient import DataFileUtil
+from installed_clients.KBaseReportClient import KBaseReport
+from installed_clients.WorkspaceClient import Workspace
+from kb_gblocks.callback_jobs import submit_job, wait_all
+from kb_gblocks.msa_stream import get_objects2_stream, read_MSA_objects
+from requests.exceptions import ConnectionError
+
+
+class _StandInServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _CallbackHandler(BaseHTTPRequestHandler):
+    '''
+    Local stand-in for the SDK callback server.  Methods submitted as
+    Svc._<sleep_ms>_submit finish <sleep_ms> after submission and return their args.
+    Chunked and gzip request bodies are read, unless server.accept_gzip is off,
+    when gzip bodies get the JSON parse error a server reading them as JSON would send.
+    '''
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_body(self):
+        if self.headers.get('Transfer-Encoding') == 'chunked':
+            chunks = []
+            while True:
+                chunk_len = int(self.rfile.readline().strip(), 16)
+                if chunk_len == 0:
+                    self.rfile.readline()
+                    break
+                chunks.append(self.rfile.read(chunk_len))
+                self.rfile.readline()
+            body = b''.join(chunks)
+        else:
+            body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.body_bytes.append(len(body))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            if not self.server.accept_gzip:
+                return None
+            body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+        return body
+
+    def do_POST(self):
+        server = self.server
+        body = self.read_body()
+        if body is None:
+            self.send_error_response({'id': None}, 'Parse error', -32700)
+            return
+        req = json.loads(body.decode('utf-8'))
+        with server.lock:
+            server.calls.append(req['method'])
+        mod, meth = req['method'].split('.')
+        if meth.endswith('_submit'):
+            with server.lock:
+                job_id = str(len(server.jobs))
+                server.jobs[job_id] = (time.time() + int(meth[1:-len('_submit')]) / 1000.0, req['params'])
+            result = [job_id]
+        elif req['method'] == 'ServiceWizard.get_service_status':
+            module_name = req['params'][0]['module_name']
+            if module_name not in server.service_urls:
+                self.send_error_response(req, 'no such module: '+module_name)
+                return
+            result = [{'url': server.service_urls[module_name]}]
+        elif meth == '_check_job':
+            finish_time, params = server.jobs[req['params'][0]]
+            if time.time() >= finish_time:
+                result = [{'finished': 1, 'result': params}]
+            else:
+                result = [{'finished': 0}]
+        else:
+            result = req['params']
+        body = json.dumps({'version': '1.1', 'id': req['id'], 'result': result}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def send_error_response(self, req, message, code=-32500):
+        body = json.dumps({'version': '1.1', 'id': req['id'],
+                           'error': {'name': 'JSONRPCError', 'code': code, 'message': message}}).encode('utf-8')
+        self.send_response(500)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_stand_in_server():
+    server = _StandInServer(('127.0.0.1', 0), _CallbackHandler)
+    server.lock = threading.Lock()
+    server.calls = []
+    server.jobs = dict()
+    server.service_urls = dict()
+    server.body_bytes = []
+    server.accept_gzip = True
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, 'http://127.0.0.1:'+str(server.server_address[1])
+
+
+class kb_gblocksBaseClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server, self.url = start_stand_in_server()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_run_job(self):
+        client = BaseClient(self.url, token='fake', async_job_check_time_ms=20)
+        self.assertEqual(client.run_job('Svc.100', [{'a': 1}]), {'a': 1})
+
+    def test_wait_all_overlaps_jobs(self):
+        client_a = BaseClient(self.url, token='fake', async_job_check_time_ms=20)
+        client_b = BaseClient(self.url, token='fake', async_job_check_time_ms=20)
+        start_time = time.time()
+        jobs = [client_a.submit_job('Svc.600', ['slow']),
+                client_b.submit_job('Svc.300', ['fast']),
+                client_a.submit_job('Svc.400', ['x', 'y'])]
+        results = client_a.wait_all(jobs)
+        elapsed = time.time() - start_time
+        self.assertEqual(results, ['slow', 'fast', ['x', 'y']])
+        # set by the slowest job, not the 1.3 sec sum
+        self.assertLess(elapsed, 1.0)
+
+    def test_callback_jobs_on_generated_clients(self):
+        dfu = DataFileUtil(self.url, token='fake', async_job_check_time_ms=20)
+        report_client = KBaseReport(self.url, token='fake', async_job_check_time_ms=20)
+        start_time = time.time()
+        jobs = [submit_job(dfu, 'Svc.600', {'file_path': 'a.fasta'}),
+                submit_job(report_client, 'Svc.400', {'message': 'done'})]
+        self.assertEqual(wait_all(jobs), [{'file_path': 'a.fasta'}, {'message': 'done'}])
+        self.assertLess(time.time() - start_time, 0.9)
+        self.assertEqual(wait_all([]), [])
+
+    def test_get_objects2_stream_on_generated_client(self):
+        ws = Workspace(self.url, token='fake')
+        info = [1, 'msa', 'KBaseTrees.MSA-1.0', '2020-01-01T00:00:00+0000', 1, 'user', 2, 'ws', 'md5', 100, None]
+        # the stand-in echoes the params back as the result
+        MSA_stream = get_objects2_stream(ws, {'data': [{'data': {'alignment': {'a': 'MKV', 'b': 'M-V'}}, 'info': info}]})
+        try:
+            (data, stream_info, row_ids, matrix) = read_MSA_objects(MSA_stream)[0]
+        finally:
+            MSA_stream.close()
+        self.assertEqual(self.server.calls, ['Workspace.get_objects2'])
+        self.assertEqual((data, stream_info), ({}, info))
+        self.assertEqual(dict(zip(row_ids, [matrix[row_i].tobytes() for row_i in range(len(row_ids))])),
+                         {'a': b'MKV', 'b': b'M-V'})
+
+    def test_polling_reuses_connections(self):
+        # polling-heavy job: constant 5 ms poll interval for a 500 ms job
+        client = BaseClient(self.url, token='fake', async_job_check_time_ms=5,
+                            async_job_check_time_scale_percent=100)
+        stats_before = session_pool_stats()
+        self.assertEqual(client.run_job('Svc.500', ['done']), 'done')
+        stats_after = session_pool_stats()
+        n_requests = stats_after['requests'] - stats_before['requests']
+        n_opened = stats_after['connections_opened'] - stats_before['connections_opened']
+        self.assertGreater(n_requests, 20)
+        self.assertLessEqual(n_opened, 1)
+
+    @unittest.skipUnless(os.environ.get('KB_GBLOCKS_BENCHMARKS'), 'set KB_GBLOCKS_BENCHMARKS=1 to run (1000 calls each way)')
+    def test_polling_reuses_connections_benchmark(self):
+        # the same requests through the pool vs a new connection each time, as before pooling
+        n_requests = 1000
+        client = BaseClient(self.url, token='fake')
+        body = json.dumps({'method': 'Svc.echo', 'params': [], 'version': '1.1', 'id': '1'})
+        start_time = time.time()
+        for request_i in range(n_requests):
+            client._call(self.url, 'Svc.echo', [])
+        pooled_sec = time.time() - start_time
+        start_time = time.time()
+        for request_i in range(n_requests):
+            requests.post(self.url, data=body)
+        unpooled_sec = time.time() - start_time
+        self.assertLess(pooled_sec, unpooled_sec)
+
+    def test_pool_shared_across_threads(self):
+        stats_before = session_pool_stats()
+        results = []
+
+        def run_one(thread_i):
+            client = BaseClient(self.url, token='fake', async_job_check_time_ms=10,
+                                async_job_check_time_scale_percent=100)
+            results.append(client.run_job('Svc.200', [thread_i]))
+
+        threads = [threading.Thread(target=run_one, args=(thread_i,)) for thread_i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(results), list(range(5)))
+        stats_after = session_pool_stats()
+        self.assertLessEqual(stats_after['connections_opened'] - stats_before['connections_opened'], 5)
+
+    def test_poll_strategy_schedule(self):
+        client = BaseClient(self.url, token='fake')  # 0.1 sec base, 150% growth, 300 sec cap
+        strategy = AdaptivePollStrategy(latency_floor_s=0.5, latency_fraction=0.05)
+        # no history: geometric, but never more than the latency bound
+        self.assertAlmostEqual(strategy.next_delay(client, 'Svc.m', 0.0, None), 0.1)
+        self.assertAlmostEqual(strategy.next_delay(client, 'Svc.m', 0.1, 0.1), 0.15)
+        self.assertAlmostEqual(strategy.next_delay(client, 'Svc.m', 2.0, 0.4), 0.5)
+        self.assertAlmostEqual(strategy.next_delay(client, 'Svc.m', 600.0, 20.0), 30.0)
+
+        # a report job that takes 2.1 sec
+        for duration in [2.0, 2.1, 2.2]:
+            strategy.record('Svc.m', duration, 0.1)
+        (window_start, window_end) = strategy.predict('Svc.m')
+        self.assertAlmostEqual(window_start, 1.8)
+        self.assertAlmostEqual(window_end, 2.42)
+        # skip ahead to the window (bounded), poll at the base interval inside it, back off after
+        self.assertAlmostEqual(strategy.next_delay(client, 'Svc.m', 0.0, None), 0.5)
+        self.assertAlmostEqual(strategy.next_delay(client, 'Svc.m', 1.5, 0.5), 0.3)
+        self.assertAlmostEqual(strategy.next_delay(client, 'Svc.m', 1.8, 0.3), 0.1)
+        self.assertAlmostEqual(strategy.next_delay(client, 'Svc.m', 2.5, 0.1), 0.1)
+        self.assertAlmostEqual(strategy.next_delay(client, 'Svc.m', 2.6, 0.1), 0.15)
+
+        stats = strategy.stats()['Svc.m']
+        self.assertEqual(stats['completions'], 3)
+        self.assertEqual(stats['latency_histogram']['<=0.1s'], 3)
+
+    def test_poll_strategy_learns(self):
+        strategy = AdaptivePollStrategy()
+        client = BaseClient(self.url, token='fake', poll_strategy=strategy)
+        for run_i in range(3):
+            self.assertEqual(client.run_job('Svc.700', [run_i]), run_i)
+        stats = strategy.stats()['Svc.700']
+        self.assertEqual(stats['completions'], 3)
+        (window_start, window_end) = stats['predicted_window_sec']
+        self.assertTrue(window_start < 0.7 < window_end + 0.2)
+        # once learned, the job takes few polls
+        polls_before = self.server.calls.count('Svc._check_job')
+        client.run_job('Svc.700', ['last'])
+        self.assertLess(self.server.calls.count('Svc._check_job') - polls_before, 10)
+
+    @unittest.skipUnless(os.environ.get('KB_GBLOCKS_BENCHMARKS'), 'set KB_GBLOCKS_BENCHMARKS=1 to run (wall-clock poll latency)')
+    def test_poll_strategy_latency_benchmark(self):
+        strategy = AdaptivePollStrategy()
+        client = BaseClient(self.url, token='fake', poll_strategy=strategy)
+        for run_i in range(3):
+            client.run_job('Svc.700', [run_i])
+        # once learned, the job is noticed within about one base interval
+        start_time = time.time()
+        client.run_job('Svc.700', ['last'])
+        self.assertLess(time.time() - start_time, 0.7 + 0.15)
+
+    def test_service_url_cache(self):
+        self.server.service_urls['Dyn'] = self.url
+        self.server.service_urls['Gone'] = 'http://127.0.0.1:1'
+        client = BaseClient(self.url, token='fake', lookup_url=True)
+        other_client = BaseClient(self.url, token='fake', lookup_url=True)
+        stats_before = service_url_cache_stats()
+
+        # shared across clients: one ServiceWizard lookup for both calls
+        self.assertEqual(client.call_method('Dyn.echo', ['a']), 'a')
+        self.assertEqual(other_client.call_method('Dyn.echo', ['b']), 'b')
+        self.assertEqual(self.server.calls.count('ServiceWizard.get_service_status'), 1)
+
+        # negative caching: the failed lookup isn't repeated
+        for call_i in range(2):
+            with self.assertRaises(ServerError):
+                client.call_method('Missing.echo', [])
+        self.assertEqual(self.server.calls.count('ServiceWizard.get_service_status'), 2)
+
+        # a connection error on the cached url invalidates it
+        for call_i in range(2):
+            with self.assertRaises(ConnectionError):
+                client.call_method('Gone.echo', [])
+        self.assertEqual(self.server.calls.count('ServiceWizard.get_service_status'), 4)
+
+        stats_after = service_url_cache_stats()
+        self.assertEqual(stats_after['hits'] - stats_before['hits'], 1)
+        self.assertEqual(stats_after['misses'] - stats_before['misses'], 4)
+        self.assertEqual(stats_after['negative_hits'] - stats_before['negative_hits'], 1)
+        self.assertEqual(stats_after['invalidations'] - stats_before['invalidations'], 2)
+
+    def test_request_compression(self):
+        # an MSA_out-like payload: 2000 x 2000 protein alignment
+        rng = np.random.RandomState(0)
+        consensus = rng.randint(ord('A'), ord('Z')+1, size=2000).astype(np.uint8)
+        rows = np.repeat(consensus[None, :], 2000, axis=0)
+        mutate = rng.rand(*rows.shape) < 0.2
+        rows[mutate] = rng.randint(ord('A'), ord('Z')+1, size=int(mutate.sum()))
+        MSA_out = {'alignment': dict([('row_'+str(row_i), rows[row_i].tobytes().decode('ascii'))
+                                      for row_i in range(rows.shape[0])])}
+        client = BaseClient(self.url, token='fake')
+        try:
+            configure_request_compression(['Svc.save_objects'])
+            stats_before = request_compression_stats()
+            self.assertEqual(client.call_method('Svc.save_objects', [MSA_out]), MSA_out)
+            gzip_bytes = self.server.body_bytes[-1]
+            stats_after = request_compression_stats()
+            self.assertEqual(stats_after['requests_compressed'] - stats_before['requests_compressed'], 1)
+            self.assertEqual(stats_after['bytes_after_compression'] - stats_before['bytes_after_compression'], gzip_bytes)
+
+            # other methods are sent plain
+            client.call_method('Svc.echo', ['x'])
+            self.assertEqual(stats_after['requests_compressed'], request_compression_stats()['requests_compressed'])
+
+            configure_request_compression([])
+            self.assertEqual(client.call_method('Svc.save_objects', [MSA_out]), MSA_out)
+            plain_bytes = self.server.body_bytes[-1]
+            self.assertLess(gzip_bytes, plain_bytes / 2)
+
+            # a server that can't read gzip bodies gets the call again, plain, and plain from then on
+            configure_request_compression(['Svc.save_objects'])
+            self.server.accept_gzip = False
+            refusals_before = request_compression_stats()['refusals']
+            n_bodies = len(self.server.body_bytes)
+            for call_i in range(2):
+                self.assertEqual(client.call_method('Svc.save_objects', [{'a': call_i}]), {'a': call_i})
+            self.assertEqual(len(self.server.body_bytes) - n_bodies, 3)
+            self.assertEqual(request_compression_stats()['refusals'] - refusals_before, 1)
+            self.assertIn(self.url, request_compression_stats()['refusing_urls'])
+        finally:
+            configure_request_compression([])
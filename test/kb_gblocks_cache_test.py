@@ -0,0 +1,158 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import numpy as np
+
+from kb_gblocks.cache import ResultCache, ObjectCache, ColumnCountCache, canonical_params
+from kb_gblocks.engine import column_counts, resolve_params, select_blocks
+
+
+class kb_gblocksCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        # object_info tuple: objid, name, type, save_date, ver, saved_by, wsid, ws_name, chsum, size, meta
+        self.info = [2, 'test_MSA', 'KBaseTrees.MSA-1.0', '', 3, 'user', 21855, 'ws', 'abc123', 1000, {}]
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_key_is_canonical(self):
+        cache = ResultCache(self.cache_dir, 1024**2)
+        key_a = cache.make_key(self.info, {'trim_level': "1", 'min_block_len': "10", 'min_seqs_for_flank': None}, 'binary')
+        key_b = cache.make_key(self.info, {'trim_level': 1, 'min_block_len': 10, 'desc': 'other'}, 'binary')
+        self.assertEqual(key_a, key_b)
+        self.assertNotEqual(key_a, cache.make_key(self.info, {'trim_level': 2, 'min_block_len': 10}, 'binary'))
+        self.assertNotEqual(key_a, cache.make_key(self.info, {'trim_level': 1, 'min_block_len': 10}, 'native'))
+        self.assertEqual(canonical_params({})[0], ('trim_level', 0))
+
+    def test_key_keeps_max_pos_contig_nonconserved_zero(self):
+        cache = ResultCache(self.cache_dir, 1024**2)
+        # 0 is -b3=0, while unset is the default b3=8
+        key_unset = cache.make_key(self.info, {}, 'binary')
+        key_zero = cache.make_key(self.info, {'max_pos_contig_nonconserved': 0}, 'binary')
+        self.assertNotEqual(key_unset, key_zero)
+        self.assertEqual(key_zero, cache.make_key(self.info, {'max_pos_contig_nonconserved': "0"}, 'binary'))
+        for unset_val in [None, '', -1, 8]:
+            self.assertEqual(key_unset, cache.make_key(self.info, {'max_pos_contig_nonconserved': unset_val}, 'binary'))
+        self.assertEqual(resolve_params({'max_pos_contig_nonconserved': 0}, 10)['b3'], 0)
+        self.assertEqual(resolve_params({}, 10)['b3'], 8)
+
+    def test_put_get(self):
+        cache = ResultCache(self.cache_dir, 1024**2)
+        key = cache.make_key(self.info, {}, 'native')
+        self.assertIsNone(cache.get(key))
+        matrix = np.frombuffer(b'MKVLAMKVLA', dtype=np.uint8).reshape(2, 5)
+        cache.put(key, ['a', 'b'], matrix, [[0, 5]])
+        entry = cache.get(key)
+        self.assertEqual(entry['row_ids'], ['a', 'b'])
+        self.assertEqual(entry['matrix'].tobytes(), b'MKVLAMKVLA')
+        self.assertEqual(entry['blocks'].tolist(), [[0, 5]])
+
+        stats = cache.record(False)
+        stats = cache.record(True, 100)
+        self.assertEqual(stats, {'hits': 1, 'misses': 1, 'bytes_saved': 100})
+
+    def test_lru_eviction(self):
+        matrix = np.zeros((10, 1000), dtype=np.uint8)
+        probe = ResultCache(self.cache_dir, 1024**3)
+        probe.put('probe', ['r'+str(i) for i in range(10)], matrix, [])
+        entry_bytes = os.path.getsize(probe.entry_path('probe'))
+        os.remove(probe.entry_path('probe'))
+
+        cache = ResultCache(self.cache_dir, 2*entry_bytes)
+        for key in ['first', 'second']:
+            cache.put(key, ['r'+str(i) for i in range(10)], matrix, [])
+            time.sleep(0.05)
+        # touch 'first' so 'second' is the least recently used
+        self.assertIsNotNone(cache.get('first'))
+        time.sleep(0.05)
+        cache.put('third', ['r'+str(i) for i in range(10)], matrix, [])
+        self.assertIsNotNone(cache.get('first'))
+        self.assertIsNone(cache.get('second'))
+        self.assertIsNotNone(cache.get('third'))
+
+    def test_object_cache(self):
+        cache = ObjectCache(self.cache_dir, 1024**2)
+        fields = ['alignment', 'row_order']
+        key = cache.make_key(self.info, fields)
+        self.assertEqual(key, cache.make_key(list(self.info), ['row_order', 'alignment']))
+        self.assertNotEqual(key, cache.make_key(self.info, ['row_order']))
+        self.assertIsNone(cache.get(key))
+
+        # a low-entropy alignment, as MSAs are, is stored compressed
+        matrix = np.tile(np.frombuffer(b'MKV-LAMKVQLA', dtype=np.uint8), (200, 50))
+        data = {'row_order': ['r'+str(i) for i in range(200)], 'alignment_length': 600}
+        cache.put(key, data, self.info, data['row_order'], matrix, 250000)
+        self.assertLess(os.path.getsize(cache.entry_path(key)), matrix.nbytes // 10)
+
+        entry = cache.get(key)
+        self.assertEqual(entry['data'], data)
+        self.assertEqual(entry['info'], self.info)
+        self.assertEqual(entry['row_ids'], data['row_order'])
+        self.assertTrue(np.array_equal(entry['matrix'], matrix))
+
+        cache.record(False)
+        cache.record(True, entry['fetched_bytes'])
+        self.assertEqual(cache.stats(), {'hits': 1, 'misses': 1, 'bytes_saved': 250000})
+
+    def test_column_count_cache(self):
+        cache = ColumnCountCache(self.cache_dir, 1024**3)
+        key = cache.make_key(self.info)
+        self.assertIsNone(cache.get(key))
+
+        matrix = np.frombuffer(b'MKV-LA' b'mkvqla' b'MRV-LA', dtype=np.uint8).reshape(3, 6)
+        counts, symbols = column_counts(matrix)
+        cache.put(key, counts, symbols, 5)
+        cached_counts, cached_symbols, L_first_seq = cache.get(key)
+        self.assertIsInstance(cached_counts, np.memmap)
+        self.assertTrue(np.array_equal(cached_counts, counts))
+        self.assertTrue(np.array_equal(cached_symbols, symbols))
+        self.assertEqual(cached_symbols.dtype, np.uint8)
+        self.assertEqual(L_first_seq, 5)
+
+        # an empty MSA has no symbols to hold L_first_seq
+        empty_key = cache.make_key(list(self.info[:4])+[4]+list(self.info[5:]))
+        counts, symbols = column_counts(np.zeros((0, 0), dtype=np.uint8))
+        cache.put(empty_key, counts, symbols, 0)
+        self.assertEqual([part.shape for part in cache.get(empty_key)[:2]], [(0, 0), (0,)])
+        self.assertEqual(cache.get(empty_key)[2], 0)
+
+    @unittest.skipUnless(os.environ.get('KB_GBLOCKS_BENCHMARKS'), 'set KB_GBLOCKS_BENCHMARKS=1 to run (20000 x 5000 MSA)')
+    def test_column_count_retrim_benchmark(self):
+        # re-trims from cached counts take the same time whatever N is
+        L = 5000
+        cache = ColumnCountCache(self.cache_dir, 1024**3)
+        rng = np.random.RandomState(11)
+        residues = np.frombuffer(b'ACDEFGHIKLMNPQRSTVWY-', dtype=np.uint8)
+        consensus = residues[rng.randint(0, 20, size=L)]
+        timings = []
+        for N in [2000, 20000]:
+            matrix = np.repeat(consensus[None, :], N, axis=0)
+            mutate = rng.rand(N, L) < 0.1
+            matrix[mutate] = residues[rng.randint(0, 21, size=int(mutate.sum()))]
+            info = list(self.info)
+            info[0] = N
+            key = cache.make_key(info)
+
+            start_time = time.time()
+            counts, symbols = column_counts(matrix)
+            cache.put(key, counts, symbols, L)
+            count_sec = time.time() - start_time
+
+            retrim_sec = 0.0
+            for setting in [{'min_block_len': 10}, {'min_block_len': 20, 'trim_level': 2}]:
+                start_time = time.time()
+                cached_counts, cached_symbols, L_first_seq = cache.get(key)
+                keep, blocks = select_blocks(cached_counts, cached_symbols, N, **resolve_params(setting, N))
+                retrim_sec += (time.time() - start_time) / 2
+                direct_keep, direct_blocks = select_blocks(counts, symbols, N, **resolve_params(setting, N))
+                self.assertTrue(np.array_equal(keep, direct_keep))
+            timings.append((N, count_sec, retrim_sec))
+        # re-trims read L x K counts, so they stay far cheaper than counting as N grows
+        for N, count_sec, retrim_sec in timings:
+            self.assertLess(retrim_sec, count_sec)
+        self.assertLess(timings[-1][2], timings[-1][1] / 10)
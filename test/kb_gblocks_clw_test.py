@@ -0,0 +1,93 @@
+import unittest
+import os
+import re
+import shutil
+import tempfile
+
+import numpy as np
+
+from kb_gblocks.alignment import Alignment
+from kb_gblocks.clw import write_clw, NUC_STRONG_GROUPS, PROT_STRONG_GROUPS, PROT_WEAK_GROUPS
+
+
+def reference_clw(aln, all_seqs_nuc, title):
+    # the per-column loop write_clw() replaced, with its weak-group check fixed
+    max_row_width = 60
+    strong_groups = NUC_STRONG_GROUPS if all_seqs_nuc else PROT_STRONG_GROUPS
+    weak_groups = None if all_seqs_nuc else PROT_WEAK_GROUPS
+    rows = [aln.row_str(row_i) for row_i in range(aln.N)]
+    alignment_length = aln.L
+
+    clw_buf = [title, '']
+    long_id_len = max([len(label) for label in aln.labels])
+    aln_pos = [0] * aln.N
+    full_row_cnt = alignment_length // max_row_width
+    if alignment_length % max_row_width == 0:
+        full_row_cnt -= 1
+    for chunk_i in range(full_row_cnt + 1):
+        aln_chunk_upper_bound = min((chunk_i+1)*max_row_width, alignment_length)
+        for row_i in range(aln.N):
+            row_id_disp = re.sub(r'\s', '_', aln.labels[row_i])
+            row_id_disp += ' ' * (long_id_len-len(row_id_disp))
+            aln_chunk = rows[row_i][chunk_i*max_row_width:aln_chunk_upper_bound]
+            aln_pos[row_i] += len([c for c in aln_chunk if c != '-'])
+            clw_buf.append(row_id_disp+' '+aln_chunk+' '+str(aln_pos[row_i]))
+
+        cons_line = ''
+        for pos_i in range(chunk_i*max_row_width, aln_chunk_upper_bound):
+            col_chars = set([row[pos_i] for row in rows if row[pos_i] != '-'])
+            seq_cnt = len([row for row in rows if row[pos_i] != '-'])
+            if seq_cnt <= 1:
+                cons_char = ' '
+            elif len(col_chars) == 1:
+                cons_char = '*'
+            elif any([all([c in group for c in col_chars]) for group in strong_groups]):
+                cons_char = ':'
+            elif weak_groups != None and any([all([c in group for c in col_chars]) for group in weak_groups]):
+                cons_char = '.'
+            else:
+                cons_char = ' '
+            cons_line += cons_char
+        clw_buf.append(' '*long_id_len+' '+cons_line)
+        clw_buf.append('')
+    return "\n".join(clw_buf)+"\n"
+
+
+class kb_gblocksCLWTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write_and_read(self, aln, all_seqs_nuc):
+        clw_path = os.path.join(self.tmp_dir, 'out.clw')
+        write_clw(clw_path, aln, all_seqs_nuc, 'CLUSTALW format of GBLOCKS trimmed MSA test: desc')
+        with open(clw_path, 'r') as clw_handle:
+            return clw_handle.read()
+
+    def random_aln(self, alphabet, N, L, seed):
+        rng = np.random.RandomState(seed)
+        codes = np.frombuffer(alphabet, dtype=np.uint8)
+        # mostly-conserved columns, so every conservation class shows up
+        matrix = np.repeat(codes[rng.randint(0, len(codes), size=(1, L))], N, axis=0)
+        mutate = rng.rand(N, L) < 0.2
+        matrix[mutate] = codes[rng.randint(0, len(codes), size=int(mutate.sum()))]
+        labels = ['seq '+str(row_i)+' x'*(row_i % 3) for row_i in range(N)]
+        return Alignment(['r'+str(row_i) for row_i in range(N)], labels, matrix)
+
+    def test_matches_reference(self):
+        for alphabet, all_seqs_nuc in [(b'ACDEFGHIKLMNPQRSTVWYacs--', False),
+                                       (b'ACGTUacgtN--', True)]:
+            for N, L in [(2, 1), (5, 60), (7, 61), (12, 250)]:
+                aln = self.random_aln(alphabet, N, L, N*L)
+                self.assertEqual(self.write_and_read(aln, all_seqs_nuc),
+                                 reference_clw(aln, all_seqs_nuc, 'CLUSTALW format of GBLOCKS trimmed MSA test: desc'))
+
+    def test_weak_group_column(self):
+        # A/C/S is only in the weak group ACS; A/S/T is in the strong group AST
+        aln = Alignment(['a', 'b', 'c'], ['a', 'b', 'c'],
+                        np.frombuffer(b'AAAM' b'CSAM' b'STA-', dtype=np.uint8).reshape(3, 4).copy())
+        clw_lines = self.write_and_read(aln, False).split("\n")
+        self.assertEqual(clw_lines[5], '  .:**')
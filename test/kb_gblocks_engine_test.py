@@ -0,0 +1,247 @@
+import unittest
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from kb_gblocks import engine
+from kb_gblocks.engine import resolve_params, msa_to_matrix, column_counts, select_blocks, format_flanks, write_gb_fasta, read_gb_fasta, TRIM_LEVEL_TO_B5
+from kb_gblocks.gblocks_runner import build_gblocks_cmd, run_streaming, read_gblocks_flanks
+from kb_gblocks.alignment import Alignment
+
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+# Gblocks binary outputs for the DsrA MSA, from data/gblocks_binary/make_golden.py
+GOLDEN_DIR = os.path.join(DATA_DIR, 'gblocks_binary')
+GBLOCKS_BIN = '/kb/module/Gblocks'
+
+
+class kb_gblocksEngineTest(unittest.TestCase):
+
+    def run_engine(self, rows, params):
+        matrix = msa_to_matrix(rows)
+        counts, symbols = column_counts(matrix)
+        gblocks_params = resolve_params(params, len(rows))
+        return select_blocks(counts, symbols, len(rows), **gblocks_params)
+
+    def test_resolve_params_defaults(self):
+        gblocks_params = resolve_params({'trim_level': "0",
+                                         'min_seqs_for_conserved': "0",
+                                         'min_seqs_for_flank': "0"}, 20)
+        self.assertEqual(gblocks_params, {'b1': 11, 'b2': 17, 'b3': 8, 'b4': 10, 'b5': 'n'})
+
+        gblocks_params = resolve_params({'trim_level': "2",
+                                         'max_pos_contig_nonconserved': "0",
+                                         'min_block_len': "5"}, 20)
+        self.assertEqual(gblocks_params['b3'], 0)
+        self.assertEqual(gblocks_params['b4'], 5)
+        self.assertEqual(gblocks_params['b5'], 'a')
+
+    def test_conserved_alignment_is_one_block(self):
+        rows = ['MKVLAAGIVGLLAQTEWSRA'] * 4
+        keep, blocks = self.run_engine(rows, {})
+        self.assertTrue(keep.all())
+        self.assertEqual(blocks.tolist(), [[0, 20]])
+        self.assertEqual(format_flanks(blocks), '[1  20]')
+
+    def test_case_insensitive_conservation(self):
+        rows = ['MKVLAAGIVGLLAQTEWSRA', 'mkvlaagivgllaqtewsra',
+                'MKVLAAGIVGLLAQTEWSRA', 'mkvlaagivgllaqtewsra']
+        keep, blocks = self.run_engine(rows, {})
+        self.assertTrue(keep.all())
+
+    def test_gap_modes(self):
+        rows = ['MKVLAAGIVGLL-AQTEWSRAYPLK',
+                'MKVLAAGIVGLLRAQTEWSRAYPLK',
+                'MKVLAAGIVGLLRAQTEWSRAYPLK',
+                'MKVLAAGIVGLLRAQTEWSRAYPLK']
+        # no gap positions allowed: the gappy column splits the alignment into two blocks
+        keep, blocks = self.run_engine(rows, {'trim_level': 0, 'min_block_len': 5})
+        self.assertEqual(blocks.tolist(), [[0, 12], [13, 25]])
+        self.assertFalse(keep[12])
+        # half: one gap in four sequences is not a gap position
+        keep, blocks = self.run_engine(rows, {'trim_level': 1, 'min_block_len': 5})
+        self.assertEqual(blocks.tolist(), [[0, 25]])
+
+    def test_min_block_len_and_nonconserved_stretch(self):
+        # 20 columns where every sequence has a different residue
+        residues = 'ACDEFGHIKLMNPQRSTVWY'
+        rows = ['MKVLAAGIVG'+residues[5*i:]+residues[:5*i]+'LLAQTEWSRA' for i in range(4)]
+        keep, blocks = self.run_engine(rows, {'max_pos_contig_nonconserved': 8, 'min_block_len': 10})
+        self.assertEqual(blocks.tolist(), [[0, 10], [30, 40]])
+        keep, blocks = self.run_engine(rows, {'max_pos_contig_nonconserved': 8, 'min_block_len': 11})
+        self.assertEqual(blocks.tolist(), [])
+        self.assertEqual(int(keep.sum()), 0)
+
+    def test_flanks_retrimmed_after_gap_removal(self):
+        # 10 rows: columns 0-3 and 6-9 highly conserved, 4 conserved (7 of 10), 5 a gap position.
+        # dropping the gap position leaves the first block ending on column 4, which isn't a flank
+        rows = []
+        for row_i in range(10):
+            rows.append('MKVL'+('A' if row_i < 7 else 'S')+('-' if row_i == 0 else 'G')+'WYFP')
+        counts, symbols = column_counts(msa_to_matrix(rows))
+        keep, blocks = select_blocks(counts, symbols, 10, b1=6, b2=9, b3=8, b4=3, b5='n')
+        self.assertEqual(blocks.tolist(), [[0, 4], [6, 10]])
+        self.assertEqual(keep.tolist(), [True]*4 + [False]*2 + [True]*4)
+
+    def test_column_counts_across_chunks(self):
+        rng = np.random.RandomState(3)
+        residues = np.frombuffer(b'ACDEFGHIKLMNPQRSTVWYacdefghik-.X', dtype=np.uint8)
+        matrix = residues[rng.randint(0, len(residues), size=(37, 53))]
+        saved_chunk_cells = engine._COLUMN_COUNT_CHUNK_CELLS
+        try:
+            # chunks smaller than a column, a few columns, and the whole matrix
+            for chunk_cells in [16, 100, 1 << 20]:
+                engine._COLUMN_COUNT_CHUNK_CELLS = chunk_cells
+                counts, symbols = column_counts(matrix)
+                for pos_i in [0, 26, 52]:
+                    column = matrix[:, pos_i].tobytes().decode('ascii').upper()
+                    self.assertEqual(counts[pos_i].tolist(), [column.count(chr(code)) for code in symbols])
+                self.assertEqual(int(counts.sum()), matrix.size)
+        finally:
+            engine._COLUMN_COUNT_CHUNK_CELLS = saved_chunk_cells
+
+    def run_supermatrix(self, L):
+        # concatenated supermatrix: conserved blocks longer than the binary's 32000 short-int limit,
+        # separated by fully variable stretches at 30% and 65% of L.  Returns (blocks, keep, sec)
+        N = 8
+        rng = np.random.RandomState(7)
+        residues = np.frombuffer(b'ACDEFGHIKLMNPQRSTVWY', dtype=np.uint8)
+        matrix = np.empty((N, L), dtype=np.uint8)
+        matrix[:, :] = residues[rng.randint(0, 20, size=L)]
+        for start, end in [(3*L//10, 3*L//10+100), (65*L//100, 65*L//100+200)]:
+            for row_i in range(N):
+                matrix[row_i, start:end] = residues[(np.arange(start, end) + 2*row_i) % 20]
+
+        start_time = time.time()
+        counts, symbols = column_counts(matrix)
+        gblocks_params = resolve_params({'max_pos_contig_nonconserved': 50,
+                                         'min_block_len': L//5}, N)
+        keep, blocks = select_blocks(counts, symbols, N, **gblocks_params)
+        return blocks, keep, time.time() - start_time
+
+    def test_supermatrix_long_blocks(self):
+        L = 200000
+        blocks, keep, engine_sec = self.run_supermatrix(L)
+        self.assertEqual(blocks.dtype, np.int64)
+        self.assertEqual(blocks.tolist(), [[0, 60000], [60100, 130000], [130200, L]])
+        self.assertEqual(int(keep.sum()), L - 300)
+
+    @unittest.skipUnless(os.environ.get('KB_GBLOCKS_BENCHMARKS'), 'set KB_GBLOCKS_BENCHMARKS=1 to run (8 x 1000000 MSA)')
+    def test_supermatrix_million_columns_benchmark(self):
+        L = 1000000
+        short_sec = self.run_supermatrix(L // 5)[2]
+        blocks, keep, engine_sec = self.run_supermatrix(L)
+        self.assertEqual(blocks.tolist(), [[0, 300000], [300100, 650000], [650200, L]])
+        self.assertEqual(int(keep.sum()), L - 300)
+        # linear in L: 5x the columns takes well under 15x the time
+        self.assertLess(engine_sec, 15 * short_sec)
+
+    def binary_output(self, MSA_aln, trim_level, tmp_dir):
+        # saved output if there is one, otherwise run the binary if it's installed
+        gb_path = os.path.join(GOLDEN_DIR, 'DsrA.b5-'+TRIM_LEVEL_TO_B5[trim_level]+'.fasta-gb')
+        if os.path.isfile(gb_path):
+            return gb_path
+        if not os.path.isfile(GBLOCKS_BIN):
+            return None
+        input_MSA_file_path = os.path.join(tmp_dir, os.path.basename(gb_path)[:-len('-gb')])
+        MSA_aln.write_fasta(input_MSA_file_path)
+        run_streaming(build_gblocks_cmd(GBLOCKS_BIN, input_MSA_file_path, {'trim_level': trim_level}, 'p'),
+                      cwd=tmp_dir, timeout=600)
+        return input_MSA_file_path+'-gb'
+
+    def test_native_matches_binary(self):
+        with open(os.path.join(DATA_DIR, 'DsrA.MSA.json'), 'r') as MSA_handle:
+            MSA_in = json.load(MSA_handle)
+        MSA_aln = Alignment.from_MSA(MSA_in, MSA_in['row_order'], MSA_in['default_row_labels'])
+        counts, symbols = column_counts(MSA_aln.matrix)
+
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            for trim_level in sorted(TRIM_LEVEL_TO_B5.keys()):
+                gb_path = self.binary_output(MSA_aln, trim_level, tmp_dir)
+                if gb_path is None:
+                    self.skipTest('no saved Gblocks output in '+GOLDEN_DIR+' and no '+GBLOCKS_BIN
+                                  +' to make it (see make_golden.py)')
+                keep, blocks = select_blocks(counts, symbols, MSA_aln.N,
+                                             **resolve_params({'trim_level': trim_level}, MSA_aln.N))
+
+                b5 = 'b5='+TRIM_LEVEL_TO_B5[trim_level]
+                self.assertEqual(format_flanks(blocks), format_flanks(read_gblocks_flanks(gb_path+'.htm')), b5)
+                read_ids, binary_matrix = read_gb_fasta(gb_path, n_rows_hint=MSA_aln.N)
+                self.assertEqual(len(read_ids), MSA_aln.N, b5)
+                self.assertTrue(np.array_equal(MSA_aln.matrix[:, keep], binary_matrix), b5)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_ragged_rows_rejected(self):
+        with self.assertRaises(ValueError):
+            msa_to_matrix(['MKVL', 'MKV'])
+
+    def legacy_read_gb(self, path):
+        # the char-at-a-time loop read_gb_fasta() replaced, for the benchmark
+        id_order = []
+        alignment = dict()
+        with open(path, 'r') as gb_handle:
+            for line in gb_handle:
+                line = line.rstrip()
+                if line.startswith('>'):
+                    this_id = line[1:]
+                    id_order.append(this_id)
+                    alignment[this_id] = ''
+                    continue
+                for c in line:
+                    if c != ' ' and c != "\n":
+                        alignment[this_id] += c
+        return id_order, alignment
+
+    def test_read_gb_fasta_round_trip(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            rows = ['MKVLAAGIVGLLAQTEWSRAYPLK'*5, 'MKVLAAGIVG-LAQTEWSRAYPLK'*5, 'mkvlaagivgllaqtewsraypl-'*5]
+            row_ids = ['seq1', 'seq2 with desc', 'seq3']
+            gb_path = os.path.join(tmp_dir, 'msa.fasta-gb')
+            write_gb_fasta(gb_path, row_ids, msa_to_matrix(rows))
+            # tiny chunks so records and lines straddle chunk boundaries; hint too small forces growth
+            for chunk_size in [7, 64, 1 << 22]:
+                read_ids, matrix = read_gb_fasta(gb_path, n_rows_hint=1, chunk_size=chunk_size)
+                self.assertEqual(read_ids, row_ids)
+                self.assertEqual([matrix[i].tobytes().decode('ascii') for i in range(len(rows))], rows)
+
+            # no blocks: rows with no residues
+            write_gb_fasta(gb_path, row_ids, msa_to_matrix(rows)[:, :0])
+            read_ids, matrix = read_gb_fasta(gb_path, n_rows_hint=3)
+            self.assertEqual(read_ids, row_ids)
+            self.assertEqual(matrix.shape, (3, 0))
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    @unittest.skipUnless(os.environ.get('KB_GBLOCKS_BENCHMARKS'), 'set KB_GBLOCKS_BENCHMARKS=1 to run (100000 x 120 MSA)')
+    def test_read_gb_fasta_benchmark(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            L = 120
+            residues = np.frombuffer(b'ACDEFGHIKLMNPQRSTVWY-', dtype=np.uint8)
+            rng = np.random.RandomState(11)
+            for N in [1000, 10000, 100000]:
+                matrix = residues[rng.randint(0, len(residues), size=(N, L))]
+                row_ids = ['row_'+str(i) for i in range(N)]
+                gb_path = os.path.join(tmp_dir, str(N)+'.fasta-gb')
+                write_gb_fasta(gb_path, row_ids, matrix)
+
+                start_time = time.time()
+                read_ids, read_matrix = read_gb_fasta(gb_path, n_rows_hint=N)
+                stream_sec = time.time() - start_time
+                start_time = time.time()
+                legacy_ids, legacy_alignment = self.legacy_read_gb(gb_path)
+                legacy_sec = time.time() - start_time
+                self.assertEqual(read_ids, legacy_ids)
+                self.assertTrue(np.array_equal(read_matrix, matrix))
+                self.assertEqual(read_matrix[N-1].tobytes().decode('ascii'), legacy_alignment[legacy_ids[-1]])
+            # at 100000 rows the streaming reader is over 2x faster than the per-line loop it replaced
+            self.assertLess(2 * stream_sec, legacy_sec)
+        finally:
+            shutil.rmtree(tmp_dir)
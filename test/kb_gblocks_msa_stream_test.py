@@ -0,0 +1,107 @@
+import unittest
+import io
+import os
+import json
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2
+    tracemalloc = None
+
+import numpy as np
+
+from kb_gblocks.msa_stream import read_MSA_objects, order_rows
+
+
+def get_objects2_response(objects):
+    return json.dumps({'version': '1.1', 'id': '1',
+                       'result': [{'data': [{'data': data, 'info': info} for data, info in objects]}]}).encode('utf-8')
+
+
+class kb_gblocksMSAStreamTest(unittest.TestCase):
+
+    def MSA_info(self, name):
+        return [1, name, 'KBaseTrees.MSA-1.0', '2020-01-01T00:00:00+0000', 1, 'user', 2, 'ws', 'md5', 100, None]
+
+    def test_read_MSA_objects(self):
+        objects = [({'row_order': ['b', 'a', 'c'], 'alignment_length': 4, 'sequence_type': 'protein',
+                     'alignment': {'a': 'MK-V', 'b': 'MKLV', 'c': 'M--V'},
+                     'default_row_labels': {'a': 'seq a', 'b': 'seq b', 'c': 'seq c'}},
+                    self.MSA_info('one')),
+                   ({'alignment': {'x': 'AC', 'y': 'A-'}, 'ids_score': 0.25}, self.MSA_info('two'))]
+        decoded = read_MSA_objects(io.BytesIO(get_objects2_response(objects)), [3])
+        self.assertEqual(len(decoded), 2)
+
+        (data, info, row_ids, matrix) = decoded[0]
+        self.assertNotIn('alignment', data)
+        self.assertEqual(data['row_order'], ['b', 'a', 'c'])
+        self.assertEqual(data['default_row_labels']['c'], 'seq c')
+        self.assertEqual(info[1], 'one')
+        self.assertEqual(matrix.dtype, np.uint8)
+        ordered = order_rows(row_ids, matrix, data['row_order'])
+        self.assertEqual(ordered.tobytes(), b'MKLVMK-VM--V')
+
+        (data, info, row_ids, matrix) = decoded[1]
+        # numbers come back as json.loads gives them, so the data can be re-encoded
+        self.assertEqual(data, {'ids_score': 0.25})
+        self.assertIsInstance(data['ids_score'], float)
+        self.assertEqual(json.loads(json.dumps(data)), data)
+        self.assertEqual(info[1], 'two')
+        self.assertEqual(order_rows(row_ids, matrix, sorted(row_ids)).tobytes(), b'ACA-')
+
+        with self.assertRaises(ValueError):
+            order_rows(row_ids, matrix, ['x', 'z'])
+
+    def test_order_rows_in_place(self):
+        rng = np.random.RandomState(5)
+        N = 500
+        matrix = rng.randint(ord('A'), ord('Z')+1, size=(N, 30)).astype(np.uint8)
+        row_ids = ['row_'+str(row_i) for row_i in range(N)]
+        perm = rng.permutation(N)
+        expected = matrix[perm]
+        ordered = order_rows(row_ids, matrix, [row_ids[row_i] for row_i in perm])
+        self.assertIs(ordered, matrix)
+        self.assertTrue(np.array_equal(ordered, expected))
+
+        # a row_order that leaves rows out can't be done in place
+        matrix = expected.copy()
+        ordered = order_rows(row_ids, matrix, ['row_3', 'row_1'])
+        self.assertTrue(np.array_equal(ordered, expected[[3, 1]]))
+
+    def test_ragged_rows_rejected(self):
+        response = get_objects2_response([({'alignment': {'a': 'MKV', 'b': 'MK'}}, self.MSA_info('bad'))])
+        with self.assertRaises(ValueError):
+            read_MSA_objects(io.BytesIO(response))
+
+    @unittest.skipUnless(os.environ.get('KB_GBLOCKS_BENCHMARKS'), 'set KB_GBLOCKS_BENCHMARKS=1 to run (10000 x 1000 MSA)')
+    @unittest.skipIf(tracemalloc is None, 'tracemalloc needs Python 3')
+    def test_benchmark_vs_full_decode(self):
+        L = 1000
+        for N in [1000, 10000]:
+            rng = np.random.RandomState(N)
+            rows = rng.randint(ord('A'), ord('Z')+1, size=(N, L)).astype(np.uint8)
+            row_ids = ['row_'+str(row_i) for row_i in range(N)]
+            alignment = dict([(row_ids[row_i], rows[row_i].tobytes().decode('ascii')) for row_i in range(N)])
+            response = get_objects2_response([({'row_order': row_ids, 'alignment': alignment}, self.MSA_info('big'))])
+            alignment = None
+
+            tracemalloc.start()
+            (data, info, stream_row_ids, matrix) = read_MSA_objects(io.BytesIO(response), [N])[0]
+            matrix = order_rows(stream_row_ids, matrix, data['row_order'])
+            stream_peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            self.assertTrue(np.array_equal(matrix, rows))
+
+            # as before: the whole response decoded, then copied into the matrix
+            tracemalloc.start()
+            MSA_in = json.loads(response.decode('utf-8'))['result'][0]['data'][0]['data']
+            full_matrix = np.frombuffer(''.join([MSA_in['alignment'][row_id] for row_id in MSA_in['row_order']]).encode('ascii'),
+                                        dtype=np.uint8).reshape(N, L)
+            full_peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            full_matrix = full_matrix.copy()
+            MSA_in = None
+            self.assertTrue(np.array_equal(full_matrix, rows))
+            # the streamed decode never holds the decoded response, so it peaks at under half the memory
+            self.assertLess(2 * stream_peak, full_peak)
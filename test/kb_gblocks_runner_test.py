@@ -0,0 +1,71 @@
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+from kb_gblocks.gblocks_runner import build_gblocks_cmd, run_streaming, read_gblocks_flanks
+
+
+class kb_gblocksRunnerTest(unittest.TestCase):
+
+    def test_build_gblocks_cmd(self):
+        params = { 'trim_level':                  "1",
+                   'min_seqs_for_conserved':      "6",
+                   'min_seqs_for_flank':          "9",
+                   'max_pos_contig_nonconserved': "8",
+                   'min_block_len':               "10",
+                   'remove_mask_positions_flag':  "0"
+                 }
+        gblocks_cmd = build_gblocks_cmd('/kb/module/Gblocks', '/tmp/in.fasta', params, 'p')
+        self.assertEqual(gblocks_cmd, ['/kb/module/Gblocks', '/tmp/in.fasta',
+                                       '-t=p', '-b5=h', '-b2=9', '-b1=6', '-b3=8', '-b4=10'])
+
+    def test_build_gblocks_cmd_defaults(self):
+        params = { 'trim_level':             "0",
+                   'min_seqs_for_conserved': "0",
+                   'min_seqs_for_flank':     None
+                 }
+        gblocks_cmd = build_gblocks_cmd('/kb/module/Gblocks', '/tmp/in.fasta', params, 'd')
+        self.assertEqual(gblocks_cmd, ['/kb/module/Gblocks', '/tmp/in.fasta', '-t=d'])
+        gblocks_cmd = build_gblocks_cmd('/kb/module/Gblocks', '/tmp/in.fasta', params, 'c')
+        self.assertEqual(gblocks_cmd, ['/kb/module/Gblocks', '/tmp/in.fasta', '-t=c'])
+
+    def test_build_gblocks_cmd_bad_trim_level(self):
+        with self.assertRaises(ValueError):
+            build_gblocks_cmd('/kb/module/Gblocks', '/tmp/in.fasta', {'trim_level': "3"}, 'p')
+        with self.assertRaises(ValueError):
+            build_gblocks_cmd('/kb/module/Gblocks', '/tmp/in.fasta', {}, True)
+
+    def test_run_streaming_large_output_on_both_pipes(self):
+        # much more than a pipe buffer on stdout and stderr, written before exit
+        script = ("import sys\n"
+                  "for i in range(20000):\n"
+                  "    sys.stdout.write('out line %d\\n' % i)\n"
+                  "    sys.stderr.write('err line %d\\n' % i)\n"
+                  "sys.exit(1)\n")
+        lines_seen = []
+        returncode, log_lines = run_streaming([sys.executable, '-c', script], timeout=60,
+                                              log_fn=lines_seen.append, max_log_lines=100)
+        self.assertEqual(returncode, 1)
+        self.assertEqual(len(lines_seen), 40000)
+        self.assertEqual(len(log_lines), 100)
+        self.assertIn('out line 19999', lines_seen)
+        self.assertIn('STDERR: err line 19999', lines_seen)
+
+    def test_run_streaming_timeout(self):
+        start_time = time.time()
+        with self.assertRaises(ValueError):
+            run_streaming([sys.executable, '-c', 'import time; time.sleep(30)'], timeout=1)
+        self.assertLess(time.time() - start_time, 10)
+
+    def test_read_gblocks_flanks(self):
+        (htm_fd, htm_path) = tempfile.mkstemp(suffix='-gb.htm')
+        with os.fdopen(htm_fd, 'w') as htm_handle:
+            htm_handle.write("<pre>\nFlanks: [90  107]  [113  126]  [144  169]  \n\n</pre>\n")
+        try:
+            blocks = read_gblocks_flanks(htm_path)
+        finally:
+            os.remove(htm_path)
+        self.assertEqual(blocks.tolist(), [[89, 107], [112, 126], [143, 169]])
+        self.assertEqual(read_gblocks_flanks(htm_path).shape, (0, 2))
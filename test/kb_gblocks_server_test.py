@@ -54,6 +54,27 @@ class kb_gblocksTest(unittest.TestCase):
     def getContext(self):
         return self.__class__.ctx
 
+    def saveTestMSA(self, obj_name):
+        MSA_json_file = os.path.join('data', 'DsrA.MSA.json')
+        with open (MSA_json_file, 'r', 0) as MSA_json_fh:
+            MSA_obj = json.load(MSA_json_fh)
+
+        provenance = [{}]
+        MSA_info = self.getWsClient().save_objects({
+            'workspace': self.getWsName(),
+            'objects': [
+                {
+                    'type': 'KBaseTrees.MSA',
+                    'data': MSA_obj,
+                    'name': obj_name,
+                    'meta': {},
+                    'provenance': provenance
+                }
+            ]})[0]
+
+        [OBJID_I, NAME_I, TYPE_I, SAVE_DATE_I, VERSION_I, SAVED_BY_I, WSID_I, WORKSPACE_I, CHSUM_I, SIZE_I, META_I] = range(11)  # object_info tuple
+        return str(MSA_info[WSID_I])+'/'+str(MSA_info[OBJID_I])+'/'+str(MSA_info[VERSION_I])
+
     def test_kb_gblocks_run_Gblocks_01(self):
         # Prepare test objects in workspace if needed using 
         # self.getWsClient().save_objects({'workspace': self.getWsName(), 'objects': []})
@@ -69,25 +90,9 @@ class kb_gblocksTest(unittest.TestCase):
         obj_out_type = 'KBaseTrees.MSA'
 
         # MSA
-        MSA_json_file = os.path.join('data', 'DsrA.MSA.json')
-        with open (MSA_json_file, 'r', 0) as MSA_json_fh:
-            MSA_obj = json.load(MSA_json_fh)
-
-        provenance = [{}]
-        MSA_info = self.getWsClient().save_objects({
-            'workspace': self.getWsName(), 
-            'objects': [
-                {
-                    'type': 'KBaseTrees.MSA',
-                    'data': MSA_obj,
-                    'name': 'test_MSA',
-                    'meta': {},
-                    'provenance': provenance
-                }
-            ]})[0]
+        MSA_ref = self.saveTestMSA('test_MSA')
 
         [OBJID_I, NAME_I, TYPE_I, SAVE_DATE_I, VERSION_I, SAVED_BY_I, WSID_I, WORKSPACE_I, CHSUM_I, SIZE_I, META_I] = range(11)  # object_info tuple
-        MSA_ref = str(MSA_info[WSID_I])+'/'+str(MSA_info[OBJID_I])+'/'+str(MSA_info[VERSION_I])
 
         parameters = { 'workspace_name': self.getWsName(),
 		       'desc':           'test_Gblocks',
@@ -114,3 +119,197 @@ class kb_gblocksTest(unittest.TestCase):
         self.assertEqual(created_obj_0_info[TYPE_I].split('-')[0], obj_out_type)
 
         pass
+
+    def test_kb_gblocks_run_Gblocks_02_native_engine(self):
+        obj_basename = 'gblocks'
+        obj_out_name = obj_basename+'.'+"test_output_native.MSA"
+        obj_out_type = 'KBaseTrees.MSA'
+
+        # MSA
+        MSA_ref = self.saveTestMSA('test_MSA_native')
+
+        [OBJID_I, NAME_I, TYPE_I, SAVE_DATE_I, VERSION_I, SAVED_BY_I, WSID_I, WORKSPACE_I, CHSUM_I, SIZE_I, META_I] = range(11)  # object_info tuple
+
+        parameters = { 'workspace_name': self.getWsName(),
+                       'desc':           'test_Gblocks_native',
+                       'input_ref':      MSA_ref,
+                       'output_name':    obj_out_name,
+                       'trim_level':                  "1",
+                       'min_seqs_for_conserved':      "0",
+                       'min_seqs_for_flank':          "0",
+                       'max_pos_contig_nonconserved': "8",
+                       'min_block_len':               "10",
+                       'remove_mask_positions_flag':  "0",
+                       'engine':                      "native"
+                     }
+
+        ret = self.getImpl().run_Gblocks(self.getContext(), parameters)[0]
+        self.assertIsNotNone(ret['report_ref'])
+
+        # check created obj
+        report_obj = self.getWsClient().get_objects([{'ref':ret['report_ref']}])[0]['data']
+        self.assertIsNotNone(report_obj['objects_created'][0]['ref'])
+
+        created_obj_0_info = self.getWsClient().get_object_info_new({'objects':[{'ref':report_obj['objects_created'][0]['ref']}]})[0]
+        self.assertEqual(created_obj_0_info[NAME_I], obj_out_name)
+        self.assertEqual(created_obj_0_info[TYPE_I].split('-')[0], obj_out_type)
+
+    def test_kb_gblocks_run_Gblocks_03_preflight_reject(self):
+        MSA_ref = self.saveTestMSA('test_MSA_preflight')
+
+        # DsrA MSA: N=11, alignment_length=491
+        parameters = { 'workspace_name':              self.getWsName(),
+                       'input_ref':                   MSA_ref,
+                       'output_name':                 'test_MSA_preflight.Gblocks',
+                       'min_seqs_for_conserved':      "0",
+                       'min_seqs_for_flank':          "12",
+                       'min_block_len':               "1000"
+                     }
+
+        ret = self.getImpl().run_Gblocks(self.getContext(), parameters)[0]
+        report_obj = self.getWsClient().get_objects([{'ref':ret['report_ref']}])[0]['data']
+        self.assertEqual(report_obj['objects_created'], [])
+        self.assertIn("Min Seqs for Flank Pos (12) must be <= N (N=11)", report_obj['text_message'])
+        self.assertIn("Min Block Len (1000) must be <= alignment length (491)", report_obj['text_message'])
+
+    def test_kb_gblocks_preview_Gblocks_01(self):
+        MSA_ref = self.saveTestMSA('test_MSA_preview')
+
+        parameters = { 'input_ref':                   MSA_ref,
+                       'trim_level':                  "1",
+                       'max_pos_contig_nonconserved': "8",
+                       'min_block_len':               "10"
+                     }
+
+        ret = self.getImpl().preview_Gblocks(self.getContext(), parameters)[0]
+        self.assertEqual(ret['alignment_length'], 491)
+        self.assertEqual(len(ret['kept']), 491)
+        self.assertEqual(ret['kept'].count('1'), ret['retained_len'])
+        self.assertEqual(sum([block_end - block_start for block_start, block_end in ret['blocks']]), ret['retained_len'])
+
+        # second call is served from the column count cache, same answer
+        ret_again = self.getImpl().preview_Gblocks(self.getContext(), parameters)[0]
+        self.assertEqual(ret_again, ret)
+
+    def test_kb_gblocks_preview_Gblocks_02_conserved_without_flank(self):
+        MSA_ref = self.saveTestMSA('test_MSA_preview_conserved')
+
+        # DsrA MSA: N=11, so the unset flank defaults to 9 and conserved=7 is valid
+        parameters = { 'input_ref':                   MSA_ref,
+                       'min_seqs_for_conserved':      7
+                     }
+
+        ret = self.getImpl().preview_Gblocks(self.getContext(), parameters)[0]
+        self.assertEqual(ret['alignment_length'], 491)
+        self.assertEqual(ret['kept'].count('1'), ret['retained_len'])
+        self.assertEqual(sum([block_end - block_start for block_start, block_end in ret['blocks']]), ret['retained_len'])
+
+    def test_kb_gblocks_preview_Gblocks_03_longer_than_first_seq(self):
+        MSA_ref = self.saveTestMSA('test_MSA_preview_first_seq')
+
+        # DsrA MSA: alignment length 491, but 398 residues in the first sequence, as run_Gblocks checks.
+        # the second call reads L first seq from the column count cache
+        parameters = { 'input_ref':                   MSA_ref,
+                       'min_block_len':               "450"
+                     }
+        for call_i in range(2):
+            with self.assertRaises(ValueError) as invalid_context:
+                self.getImpl().preview_Gblocks(self.getContext(), parameters)
+            self.assertIn("Min Block Len (450) must be <= L first seq (398)", str(invalid_context.exception))
+
+    def test_kb_gblocks_run_Gblocks_sweep_01(self):
+        MSA_ref = self.saveTestMSA('test_MSA_sweep')
+        obj_out_name = 'gblocks.test_output_sweep.MSA'
+
+        parameters = { 'workspace_name':               self.getWsName(),
+                       'desc':                         'test_Gblocks_sweep',
+                       'input_ref':                    MSA_ref,
+                       'output_name':                  obj_out_name,
+                       'trim_levels':                  [0, 1, 2],
+                       'min_block_lens':               [5, 10, 20],
+                       'max_pos_contig_nonconserveds': [4, 8],
+                       'save_setting_indices':         [9]
+                     }
+
+        ret = self.getImpl().run_Gblocks_sweep(self.getContext(), parameters)[0]
+        self.assertIsNotNone(ret['report_ref'])
+        self.assertEqual(len(ret['settings']), 18)
+
+        # more permissive gap handling never retains fewer columns
+        retained_len = dict()
+        for setting in ret['settings']:
+            retained_len[(setting['trim_level'], setting['min_block_len'], setting['max_pos_contig_nonconserved'])] = setting['retained_len']
+        self.assertLessEqual(retained_len[(0, 10, 8)], retained_len[(1, 10, 8)])
+        self.assertLessEqual(retained_len[(1, 10, 8)], retained_len[(2, 10, 8)])
+
+        # only the picked setting is saved
+        saved = [setting for setting in ret['settings'] if 'output_ref' in setting]
+        self.assertEqual(len(saved), 1)
+        self.assertEqual(saved[0]['index'], 9)
+        saved_obj = self.getWsClient().get_objects([{'ref': saved[0]['output_ref']}])[0]['data']
+        self.assertEqual(saved_obj['alignment_length'], saved[0]['retained_len'])
+
+    def test_kb_gblocks_run_Gblocks_sweep_02_invalid_settings(self):
+        # each setting gets the run_Gblocks checks, before anything is fetched
+        parameters = { 'workspace_name':               self.getWsName(),
+                       'input_ref':                    'not/fetched/1',
+                       'output_name':                  'test_output_sweep_invalid.MSA',
+                       'trim_levels':                  [0, 3],
+                       'min_block_lens':               [1, 10]
+                     }
+        with self.assertRaises(ValueError) as invalid_context:
+            self.getImpl().run_Gblocks_sweep(self.getContext(), parameters)
+        self.assertIn("Min Block Len (1) must be >= 2 (settings 0, 2)", str(invalid_context.exception))
+        self.assertIn("Trim Level (3) must be >= 0 and <= 2 (settings 2, 3)", str(invalid_context.exception))
+
+    def test_kb_gblocks_run_Gblocks_sweep_03_longer_than_first_seq(self):
+        MSA_ref = self.saveTestMSA('test_MSA_sweep_first_seq')
+
+        # DsrA MSA: alignment length 491, but 398 residues in the first sequence, as run_Gblocks checks
+        parameters = { 'workspace_name':               self.getWsName(),
+                       'input_ref':                    MSA_ref,
+                       'output_name':                  'test_output_sweep_first_seq.MSA',
+                       'min_block_lens':               [10, 450]
+                     }
+        with self.assertRaises(ValueError) as invalid_context:
+            self.getImpl().run_Gblocks_sweep(self.getContext(), parameters)
+        self.assertIn("Min Block Len (450) must be <= L first seq (398) (settings 1)", str(invalid_context.exception))
+
+    def test_kb_gblocks_run_Gblocks_batch_01(self):
+        MSA_refs = [self.saveTestMSA('test_MSA_batch_'+str(i)) for i in range(3)]
+
+        parameters = { 'workspace_name':              self.getWsName(),
+                       'desc':                        'test_Gblocks_batch',
+                       'input_refs':                  MSA_refs,
+                       'output_suffix':               '.Gblocks',
+                       'trim_level':                  "1",
+                       'max_pos_contig_nonconserved': "8",
+                       'min_block_len':               "10",
+                       'engine':                      "native",
+                       'max_workers':                 2
+                     }
+
+        ret = self.getImpl().run_Gblocks_batch(self.getContext(), parameters)[0]
+        self.assertIsNotNone(ret['report_ref'])
+        self.assertEqual(len(ret['output_refs']), 3)
+
+        NAME_I = 1
+        output_infos = self.getWsClient().get_object_info_new({'objects': [{'ref': ref} for ref in ret['output_refs']]})
+        self.assertEqual(sorted([info[NAME_I] for info in output_infos]),
+                         ['test_MSA_batch_'+str(i)+'.Gblocks' for i in range(3)])
+
+    def test_kb_gblocks_run_Gblocks_batch_02_longer_than_first_seq(self):
+        MSA_ref = self.saveTestMSA('test_MSA_batch_first_seq')
+
+        # DsrA MSA: alignment length 491, but 398 residues in the first sequence, as run_Gblocks checks
+        parameters = { 'workspace_name':              self.getWsName(),
+                       'input_refs':                  [MSA_ref],
+                       'output_suffix':               '.Gblocks',
+                       'min_block_len':               "450",
+                       'engine':                      "native"
+                     }
+
+        ret = self.getImpl().run_Gblocks_batch(self.getContext(), parameters)[0]
+        self.assertEqual(ret['output_refs'], [])
+        report_obj = self.getWsClient().get_objects([{'ref':ret['report_ref']}])[0]['data']
+        self.assertIn("FAILED: Min Block Len (450) must be <= L first seq (398)", report_obj['text_message'])